@@ -14,13 +14,21 @@ celery_app = Celery("app")
 #   should have a `CELERY_` prefix.
 celery_app.config_from_object("django.conf:settings", namespace="CELERY")
 
-celery_app.conf.task_queues = [
-    Queue(
-        "spear_tasks",
-        Exchange("spear_tasks"),
-        routing_key="spear_tasks",
+
+def spear_queue(name):
+    return Queue(
+        name,
+        Exchange(name),
+        routing_key=name,
         queue_arguments={"x-max-priority": 10},
-    ),
+    )
+
+
+# the shared queue and one queue per Spear server (see spear_queue.routing)
+celery_app.conf.task_queues = [
+    spear_queue("spear_tasks"),
+    spear_queue("spear_tasks.HPTC-RAY-SP01"),
+    spear_queue("spear_tasks.HPTC-RAY-SP02"),
     # Queue("dead_letter_queue", routing_key="dead_letter_queue"),
 ]
 
@@ -28,6 +36,9 @@ celery_app.conf.task_queues = [
 celery_app.conf.task_acks_late = True
 celery_app.conf.task_default_priority = 5
 celery_app.conf.worker_prefetch_multiplier = 1
+# wait for RabbitMQ to confirm every publish, the outbox relay only deletes an
+# entry once the broker has its message
+celery_app.conf.broker_transport_options = {"confirm_publish": True}
 
 celery_app.autodiscover_tasks()
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "spear_job_api.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -95,7 +97,8 @@ LOGGING = {
     "loggers": {
         "": {
             "handlers": ["console"],
-            "level": "DEBUG",
+            # DEBUG logs every payload on the hot paths, opt in with LOG_LEVEL
+            "level": os.environ.get("LOG_LEVEL", "INFO"),
         },
     },
 }
@@ -168,3 +171,82 @@ CELERY_ENABLE_UTC = False
 
 
 REST_FRAMEWORK = {"DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema"}
+
+# Queue statistics endpoint: maximum age of the stored statistics (seconds)
+# and the window of completed jobs the duration percentiles cover (hours)
+SPEAR_JOB_STATS_MAX_AGE = int(os.environ.get("SPEAR_JOB_STATS_MAX_AGE", 10))
+SPEAR_JOB_STATS_WINDOW_HOURS = int(os.environ.get("SPEAR_JOB_STATS_WINDOW_HOURS", 24))
+
+# Stale job reaper: a RUNNING job without a heartbeat for this many seconds is
+# considered lost, SPEAR_JOB_HEARTBEAT_TIMEOUTS overrides it per workflow as a
+# JSON object like {"workflow_name": seconds}
+SPEAR_JOB_HEARTBEAT_TIMEOUT = int(os.environ.get("SPEAR_JOB_HEARTBEAT_TIMEOUT", 300))
+SPEAR_JOB_HEARTBEAT_TIMEOUTS = json.loads(
+    os.environ.get("SPEAR_JOB_HEARTBEAT_TIMEOUTS", "{}")
+)
+
+# Fair-share scheduler (spear_queue.scheduler): when enabled, submitted jobs
+# stay PENDING until the schedule_spear_jobs command starts them in one of the
+# SPEAR_WORKER_SLOTS worker slots. The slots are shared by RayStation system
+# ("raystation_system") or by workflow ("workflow") with the weights of
+# SPEAR_SCHEDULER_WEIGHTS, a JSON object like {"system_name": 2.0} (default
+# 1), and a waiting job gains a priority level every
+# SPEAR_SCHEDULER_AGING_SECONDS
+SPEAR_SCHEDULER_ENABLED = os.environ.get("SPEAR_SCHEDULER_ENABLED", "0") == "1"
+SPEAR_WORKER_SLOTS = int(os.environ.get("SPEAR_WORKER_SLOTS", 2))
+SPEAR_SCHEDULER_SHARE_BY = os.environ.get(
+    "SPEAR_SCHEDULER_SHARE_BY", "raystation_system"
+)
+SPEAR_SCHEDULER_WEIGHTS = json.loads(os.environ.get("SPEAR_SCHEDULER_WEIGHTS", "{}"))
+SPEAR_SCHEDULER_AGING_SECONDS = float(
+    os.environ.get("SPEAR_SCHEDULER_AGING_SECONDS", 600)
+)
+
+# Routing of the jobs to the per-server queues (spear_queue.routing): "shared"
+# (one queue for all servers) or "least-loaded". SPEAR_SERVER_SLOTS is the
+# number of concurrent jobs per server as a JSON object, the jobs of the
+# SPEAR_PINNED_WORKFLOWS (a JSON list) go to the server that has the patient
+# loaded
+SPEAR_ROUTING_POLICY = os.environ.get("SPEAR_ROUTING_POLICY", "shared")
+SPEAR_SERVER_SLOTS = json.loads(
+    os.environ.get("SPEAR_SERVER_SLOTS", '{"HPTC-RAY-SP01": 1, "HPTC-RAY-SP02": 1}')
+)
+SPEAR_PINNED_WORKFLOWS = json.loads(os.environ.get("SPEAR_PINNED_WORKFLOWS", "[]"))
+
+# Duplicate submissions (spear_queue.tasks.bulk_enqueue_spear_jobs) return the
+# waiting or running job, or a completed job created within the last this many
+# seconds, instead of registering a new one
+SPEAR_JOB_DEDUP_WINDOW = int(os.environ.get("SPEAR_JOB_DEDUP_WINDOW", 3600))
+
+# Archival (spear_job_api.archive): finished jobs created more than this many
+# days ago are moved to the archive table by the archive_spear_jobs command,
+# their logs zlib-compressed unless SPEAR_JOB_ARCHIVE_COMPRESS_LOGS is "0"
+SPEAR_JOB_ARCHIVE_DAYS = float(os.environ.get("SPEAR_JOB_ARCHIVE_DAYS", 30))
+SPEAR_JOB_ARCHIVE_COMPRESS_LOGS = (
+    os.environ.get("SPEAR_JOB_ARCHIVE_COMPRESS_LOGS", "1") == "1"
+)
+
+# Live job events (spear_job_api.events): the Redis the status changes and log
+# appends are published on ("" disables publishing), and the seconds between
+# the keep-alive comments of the event streams
+SPEAR_JOB_EVENTS_URL = os.environ.get("SPEAR_JOB_EVENTS_URL", CELERY_RESULT_BACKEND)
+SPEAR_JOB_EVENTS_KEEPALIVE = float(os.environ.get("SPEAR_JOB_EVENTS_KEEPALIVE", 15))
+
+# Revocation (spear_job_api.revocation): the Redis holding the ids of the
+# revoked tasks the workers drop before they run ("" disables it, only the
+# Celery revoke is broadcast), and the seconds an id is kept there, at least
+# as long as a task may wait in the queue
+SPEAR_JOB_REVOKED_URL = os.environ.get("SPEAR_JOB_REVOKED_URL", CELERY_RESULT_BACKEND)
+SPEAR_JOB_REVOKED_TTL = int(os.environ.get("SPEAR_JOB_REVOKED_TTL", 7 * 24 * 3600))
+
+# Outbox relay (spear_queue.outbox): a failed publish is retried after
+# SPEAR_OUTBOX_RETRY_DELAY seconds, doubled with every attempt up to
+# SPEAR_OUTBOX_RETRY_MAX_DELAY, and the jobs of an entry are marked FAILED
+# after SPEAR_OUTBOX_MAX_ATTEMPTS. A batch is claimed for
+# SPEAR_OUTBOX_CLAIM_SECONDS, the other relays take it again after that
+SPEAR_OUTBOX_RETRY_DELAY = float(os.environ.get("SPEAR_OUTBOX_RETRY_DELAY", 5))
+SPEAR_OUTBOX_RETRY_MAX_DELAY = float(
+    os.environ.get("SPEAR_OUTBOX_RETRY_MAX_DELAY", 600)
+)
+SPEAR_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("SPEAR_OUTBOX_MAX_ATTEMPTS", 10))
+SPEAR_OUTBOX_CLAIM_SECONDS = float(os.environ.get("SPEAR_OUTBOX_CLAIM_SECONDS", 300))
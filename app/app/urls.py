@@ -19,6 +19,7 @@ from django.contrib import admin
 from django.urls import path
 from django.urls.conf import include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from spear_job_api.metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -33,4 +34,5 @@ urlpatterns = [
     path(
         "api/", include("spear_job_api.urls")
     ),  # for rendering the schema to a swagger documentation
+    path("metrics", metrics_view, name="metrics"),  # Prometheus scrape endpoint
 ]
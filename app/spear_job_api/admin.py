@@ -26,6 +26,9 @@ class SpearJobAdmin(admin.ModelAdmin):
         "server_name",
         "latest_heartbeat",
     )
+    # select widgets would render every job as an option
+    raw_id_fields = ["parent", "depends_on"]
+    list_select_related = ["raystation_system"]
     list_filter = ["priority", "status", "server_name"]
     search_fields = [
         "celery_job_id",
@@ -0,0 +1,199 @@
+"""Archival of finished Spear jobs.
+
+The SpearJob table holds the queue and the recent history. COMPLETED, FAILED
+and REVOKED jobs created more than SPEAR_JOB_ARCHIVE_DAYS ago are moved to
+SpearJobArchive with their log chunks, in small transactions that lock the
+jobs they move only. A job graph is moved with its steps, once none of them
+is waiting or running anymore.
+
+find_spear_job and afind_spear_job look a job up by id or celery_job_id in
+both tables, the detail endpoints use them so archived jobs stay reachable.
+"""
+
+import logging
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import SpearJob, SpearJobArchive, SpearJobLogChunk, SpearJobStatus
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = [
+    SpearJobStatus.COMPLETED,
+    SpearJobStatus.FAILED,
+    SpearJobStatus.REVOKED,
+]
+ACTIVE_STATUSES = [
+    SpearJobStatus.PENDING,
+    SpearJobStatus.QUEUED,
+    SpearJobStatus.RUNNING,
+]
+
+
+@dataclass
+class ArchiveResult:
+    jobs: int = 0
+    log_chunks: int = 0
+    log_bytes: int = 0
+    stored_log_bytes: int = 0
+
+
+def archivable_jobs(cutoff: datetime):
+    """The finished top level jobs created before cutoff."""
+    return (
+        SpearJob.objects.filter(
+            status__in=FINISHED_STATUSES, created_at__lt=cutoff, parent__isnull=True
+        )
+        # a graph waits for its last steps
+        .exclude(steps__status__in=ACTIVE_STATUSES)
+    )
+
+
+def job_logs(jobs: list[SpearJob]) -> dict[int, list[str]]:
+    """The log entries of the jobs, legacy logs column first."""
+    logs = {job.pk: [job.logs] if job.logs else [] for job in jobs}
+    chunks = (
+        SpearJobLogChunk.objects.filter(job_id__in=logs)
+        .order_by("job_id", "sequence")
+        .values_list("job_id", "text")
+    )
+    for job_id, text in chunks.iterator(chunk_size=2000):
+        logs[job_id].append(text)
+    return logs
+
+
+def archived_copy(job: SpearJob, entries: list[str], compress: bool):
+    log_data = "\n".join(entries).encode("utf-8") if entries else None
+    if log_data is not None and compress:
+        log_data = zlib.compress(log_data)
+    return SpearJobArchive(
+        id=job.pk,
+        patient_id=job.patient_id,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        completed_at=job.completed_at,
+        status=job.status,
+        celery_job_id=job.celery_job_id,
+        worker_name=job.worker_name,
+        server_name=job.server_name,
+        workflow_name=job.workflow_name,
+        config_blob_id=job.config_blob_id,
+        config_overrides=job.config_overrides,
+        raystation_system_id=job.raystation_system_id,
+        priority=job.priority,
+        parent_id=job.parent_id,
+        step_name=job.step_name,
+        log_data=log_data,
+        log_compressed=compress and log_data is not None,
+    )
+
+
+def archive_spear_jobs(
+    *,
+    days: Optional[float] = None,
+    batch_size: int = 100,
+    max_batches: Optional[int] = None,
+    compress: Optional[bool] = None,
+    now: Optional[datetime] = None,
+) -> ArchiveResult:
+    """Move the finished jobs older than `days` (default
+    SPEAR_JOB_ARCHIVE_DAYS) to the archive, batch_size jobs (plus their
+    steps) per transaction. Jobs locked by someone else are skipped."""
+    days = settings.SPEAR_JOB_ARCHIVE_DAYS if days is None else days
+    compress = (
+        settings.SPEAR_JOB_ARCHIVE_COMPRESS_LOGS if compress is None else compress
+    )
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    result = ArchiveResult()
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        with transaction.atomic():
+            root_ids = list(
+                archivable_jobs(cutoff)
+                .select_for_update(skip_locked=True, of=("self",))
+                .order_by("created_at", "id")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not root_ids:
+                break
+            # parents before their steps
+            jobs = list(
+                SpearJob.objects.select_for_update()
+                .filter(Q(pk__in=root_ids) | Q(parent_id__in=root_ids))
+                .order_by("pk")
+            )
+            logs = job_logs(jobs)
+            archived = [archived_copy(job, logs[job.pk], compress) for job in jobs]
+            SpearJobArchive.objects.bulk_create(archived)
+            SpearJob.objects.filter(pk__in=root_ids).delete()
+
+        result.jobs += len(jobs)
+        result.log_chunks += sum(len(entries) for entries in logs.values())
+        result.log_bytes += sum(
+            len("\n".join(entries).encode("utf-8")) for entries in logs.values()
+        )
+        result.stored_log_bytes += sum(len(job.log_data or b"") for job in archived)
+        logger.info(f"Archived {len(jobs)} spear jobs")
+        if len(root_ids) < batch_size:
+            break
+    return result
+
+
+def _detail_jobs(defer_logs: bool):
+    jobs = SpearJob.objects.with_config().with_last_log_sequence()
+    return jobs.defer("logs") if defer_logs else jobs
+
+
+def find_spear_job(
+    *,
+    spear_job_id: Optional[int] = None,
+    celery_job_id: Optional[str] = None,
+    defer_logs: bool = False,
+) -> SpearJob | SpearJobArchive:
+    """Return the job with the id or celery_job_id, from the SpearJob table
+    or else from the archive. Raises SpearJob.DoesNotExist if neither has it.
+    With defer_logs the legacy logs column of a SpearJob is not loaded, see
+    detail.defer_logs.
+    """
+    lookup = (
+        {"pk": spear_job_id}
+        if spear_job_id is not None
+        else {"celery_job_id": celery_job_id}
+    )
+    try:
+        return _detail_jobs(defer_logs).get(**lookup)
+    except SpearJob.DoesNotExist:
+        pass
+    try:
+        return SpearJobArchive.objects.with_config().get(**lookup)
+    except SpearJobArchive.DoesNotExist:
+        raise SpearJob.DoesNotExist(f"Spear job {lookup} not found.")
+
+
+async def afind_spear_job(
+    *,
+    spear_job_id: Optional[int] = None,
+    celery_job_id: Optional[str] = None,
+    defer_logs: bool = False,
+) -> SpearJob | SpearJobArchive:
+    """Async version of find_spear_job."""
+    lookup = (
+        {"pk": spear_job_id}
+        if spear_job_id is not None
+        else {"celery_job_id": celery_job_id}
+    )
+    try:
+        return await _detail_jobs(defer_logs).aget(**lookup)
+    except SpearJob.DoesNotExist:
+        pass
+    try:
+        return await SpearJobArchive.objects.with_config().aget(**lookup)
+    except SpearJobArchive.DoesNotExist:
+        raise SpearJob.DoesNotExist(f"Spear job {lookup} not found.")
@@ -0,0 +1,262 @@
+"""Async views of the spear jobs API for the high-volume worker traffic.
+
+They serve the same data as the matching SpearJobViewSet endpoints under
+/api/async/, with the async ORM. Their benefit needs an ASGI server, e.g.
+`uvicorn app.asgi:application`, under runserver (WSGI) every request runs
+its own event loop.
+"""
+
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import serializers
+from .archive import afind_spear_job
+from .detail import defer_logs, job_etag, parse_log_selection, read_logs
+from .events import (
+    STATUS,
+    JobEventSubscription,
+    format_sse,
+    log_event,
+    status_event,
+)
+from .filters import SpearJobFilterBackend
+from .models import SpearJob, SpearJobArchive, SpearJobLogChunk, SpearJobStatus
+from .serializers import (
+    SpearJobAppendLogSerializer,
+    SpearJobBatchHeartbeatSerializer,
+    SpearJobDetailSerializer,
+    SpearJobHeartbeatSerializer,
+)
+from .services import aappend_spear_job_logs, arecord_spear_job_heartbeats
+from .views import not_modified
+
+
+def not_found() -> JsonResponse:
+    return JsonResponse({"detail": "Not found."}, status=404)
+
+
+def parse_body(request) -> tuple[dict | None, JsonResponse | None]:
+    """Return the JSON body of a request, or a 400 response."""
+    try:
+        return json.loads(request.body or b"{}"), None
+    except (ValueError, UnicodeDecodeError) as exc:
+        return None, JsonResponse({"detail": f"JSON parse error - {exc}"}, status=400)
+
+
+async def render_job(request, **lookup) -> JsonResponse:
+    """Render a job like SpearJobViewSet.render_job."""
+    try:
+        fields = SpearJobDetailSerializer.parse_fields(request.GET)
+        selection = parse_log_selection(request.GET)
+    except serializers.ValidationError as exc:
+        return JsonResponse(exc.detail, status=400)
+    try:
+        job = await afind_spear_job(**lookup, defer_logs=defer_logs(fields, selection))
+    except SpearJob.DoesNotExist:
+        return not_found()
+
+    etag = job_etag(job, request.GET)
+    if not_modified(request, etag):
+        response = HttpResponse(status=304)
+    else:
+        context, extra = {"fields": fields}, {}
+        if fields is None or "logs" in fields:
+            if selection is None:
+                context["logs"] = await job.aget_logs()
+            else:
+                context["logs"], extra = await sync_to_async(read_logs)(job, selection)
+        data = SpearJobDetailSerializer(job, context=context).data | extra
+        response = JsonResponse(data)
+    response["ETag"] = etag
+    return response
+
+
+@require_GET
+async def retrieve(request, id):
+    """Retrieve a Spear job by its id."""
+    return await render_job(request, spear_job_id=id)
+
+
+@require_GET
+async def retrieve_by_celery_job_id(request, celery_job_id):
+    """Retrieve a Spear job by its celery job ID."""
+    return await render_job(request, celery_job_id=celery_job_id)
+
+
+@csrf_exempt
+@require_POST
+async def heartbeat(request):
+    """Record a heartbeat for many Spear jobs, identified by celery_job_ids."""
+    data, error = parse_body(request)
+    if error:
+        return error
+    serializer = SpearJobBatchHeartbeatSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    updated = await arecord_spear_job_heartbeats(**serializer.validated_data)
+    return JsonResponse({"updated": updated})
+
+
+@csrf_exempt
+@require_POST
+async def heartbeat_by_celery_job_id(request, celery_job_id):
+    """Record a heartbeat for a Spear job by its celery job ID."""
+    data, error = parse_body(request)
+    if error:
+        return error
+    serializer = SpearJobHeartbeatSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    if not await arecord_spear_job_heartbeats(
+        celery_job_ids=[celery_job_id], **serializer.validated_data
+    ):
+        return not_found()
+    return HttpResponse(status=204)
+
+
+@csrf_exempt
+@require_POST
+async def append_logs_by_celery_job_id(request, celery_job_id):
+    """Append log entries to a Spear job by its celery job ID."""
+    data, error = parse_body(request)
+    if error:
+        return error
+    serializer = SpearJobAppendLogSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    if not await aappend_spear_job_logs(
+        celery_job_id=celery_job_id, entries=serializer.validated_data["entries"]
+    ):
+        return not_found()
+    return HttpResponse(status=204)
+
+
+FINISHED_STATUSES = {
+    SpearJobStatus.COMPLETED,
+    SpearJobStatus.FAILED,
+    SpearJobStatus.REVOKED,
+}
+# the set stream caches which jobs match its filters, up to this many
+MAX_MATCH_CACHE = 10000
+
+
+def event_stream_response(stream) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # do not let a proxy buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def log_backlog(job_id: int, after: int):
+    """The log events of a job after the sequence number, from the database."""
+    async for sequence, text in (
+        SpearJobLogChunk.objects.filter(job_id=job_id, sequence__gt=after)
+        .order_by("sequence")
+        .values_list("sequence", "text")
+    ):
+        yield log_event(job_id, sequence, text)
+
+
+async def job_event_stream(job: SpearJob, after: int | None):
+    keepalive = settings.SPEAR_JOB_EVENTS_KEEPALIVE
+    async with JobEventSubscription(job.pk) as subscription:
+        # subscribed before reading the database, nothing falls in between
+        status = await SpearJob.objects.values_list("status", flat=True).aget(pk=job.pk)
+        yield format_sse(status_event(job.pk, status))
+        if after is None and job.logs:
+            yield format_sse(log_event(job.pk, None, job.logs))
+        last = -1 if after is None else after
+        async for event in log_backlog(job.pk, last):
+            last = event["sequence"]
+            yield format_sse(event)
+
+        while status not in FINISHED_STATUSES:
+            event = await subscription.get(timeout=keepalive)
+            if event is None:
+                yield ": keepalive\n\n"
+            elif event["type"] == STATUS:
+                status = event["status"]
+                yield format_sse(event)
+            elif event["sequence"] == last + 1:
+                last = event["sequence"]
+                yield format_sse(event)
+            elif event["sequence"] > last:
+                # missed an event, catch up from the database
+                async for event in log_backlog(job.pk, last):
+                    last = event["sequence"]
+                    yield format_sse(event)
+
+        # entries appended with the final status
+        async for event in log_backlog(job.pk, last):
+            yield format_sse(event)
+
+
+async def archived_job_stream(job: SpearJobArchive):
+    yield format_sse(status_event(job.pk, job.status))
+    logs = await job.aget_logs()
+    if logs is not None:
+        yield format_sse(log_event(job.pk, None, logs))
+
+
+@require_GET
+async def job_events(request, id):
+    """Stream the status changes and new log entries of a Spear job as
+    Server-Sent Events, until the job is finished.
+
+    The stream starts with the current status and the logged entries. A
+    client resumes with ?after=<sequence> or the Last-Event-ID header (the
+    sequence number of the last log event it received) and then only gets
+    the entries logged after it."""
+    after = request.GET.get("after", request.headers.get("Last-Event-ID"))
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        return JsonResponse({"detail": "'after' must be an integer."}, status=400)
+    try:
+        job = await afind_spear_job(spear_job_id=id)
+    except SpearJob.DoesNotExist:
+        return not_found()
+    if isinstance(job, SpearJobArchive):
+        return event_stream_response(archived_job_stream(job))
+    return event_stream_response(job_event_stream(job, after))
+
+
+async def filtered_event_stream(filters: dict):
+    keepalive = settings.SPEAR_JOB_EVENTS_KEEPALIVE
+    queryset = SpearJob.objects.filter(**filters)
+    matches = {}
+    async with JobEventSubscription() as subscription:
+        yield ": subscribed\n\n"
+        while True:
+            event = await subscription.get(timeout=keepalive)
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            job_id = event["job_id"]
+            if filters and (event["type"] == STATUS or job_id not in matches):
+                if len(matches) >= MAX_MATCH_CACHE:
+                    matches.clear()
+                matches[job_id] = await queryset.filter(pk=job_id).aexists()
+            if not filters or matches[job_id]:
+                # the sequence numbers are per job, no event ids
+                yield format_sse(event, with_id=False)
+
+
+@require_GET
+async def events(request):
+    """Stream the status changes and new log entries of the Spear jobs
+    matching the list filters (e.g. ?parent=<id> for the steps of a job
+    graph) as Server-Sent Events.
+
+    The filters are evaluated when an event arrives. Events are not replayed,
+    follow a job with its own event stream to resume from a sequence number.
+    """
+    try:
+        filters = SpearJobFilterBackend().get_filters(request.GET)
+    except serializers.ValidationError as exc:
+        return JsonResponse(exc.detail, status=400)
+    return event_stream_response(filtered_event_stream(filters))
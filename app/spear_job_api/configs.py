@@ -0,0 +1,87 @@
+"""Storage format of the workflow configs of the spear jobs.
+
+Most jobs run a workflow with its default config or with a few values
+changed, so a job does not store its config. It references a
+content-addressed SpearWorkflowConfig blob (zlib-compressed canonical JSON,
+identified by its SHA-256) and, if the config differs from the template of
+its workflow, the difference as a JSON merge patch (RFC 7386) in
+config_overrides. SpearJob.workflow_config expands both transparently.
+"""
+
+import copy
+import hashlib
+import json
+import zlib
+from typing import Any
+from .workflows import workflow_registry
+
+
+def canonical_json(value: Any) -> bytes:
+    """The JSON encoding of a config that is equal for equal configs."""
+    return json.dumps(
+        value, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+def config_digest(config: Any) -> str:
+    return hashlib.sha256(canonical_json(config)).hexdigest()
+
+
+def compress_config(config: Any) -> bytes:
+    return zlib.compress(canonical_json(config))
+
+
+def decompress_config(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data))
+
+
+def merge_patch(target: Any, patch: Any) -> Any:
+    """Apply a JSON merge patch, returns a new value."""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = copy.deepcopy(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def diff_config(base: Any, target: Any) -> Any:
+    """The JSON merge patch turning base into target."""
+    if not isinstance(base, dict) or not isinstance(target, dict):
+        return target
+    patch = {key: None for key in base.keys() - target.keys()}
+    for key, value in target.items():
+        if key not in base:
+            patch[key] = value
+        elif base[key] != value:
+            patch[key] = diff_config(base[key], value)
+    return patch
+
+
+def split_config(workflow_name: str | None, config: Any) -> tuple[Any, dict | None]:
+    """Split a config into the config to store as blob and the overrides.
+
+    The blob is the template of the workflow if the config is smaller as a
+    patch of it, else the config itself. Merge patches cannot set null
+    values, configs containing any are stored whole."""
+    if config is None:
+        return None, None
+    try:
+        template = workflow_registry.get(workflow_name).config
+    except FileNotFoundError:
+        return config, None
+    encoded = canonical_json(config)
+    if canonical_json(template) == encoded:
+        return template, None
+    overrides = diff_config(template, config)
+    if (
+        isinstance(overrides, dict)
+        and overrides
+        and canonical_json(merge_patch(template, overrides)) == encoded
+        and len(canonical_json(overrides)) < len(encoded)
+    ):
+        return template, overrides
+    return config, None
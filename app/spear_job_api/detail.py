@@ -0,0 +1,240 @@
+"""Partial and conditional reads for the job detail endpoints.
+
+The detail endpoints (SpearJobViewSet.retrieve and by_celery_job_id, and
+their async versions) accept
+
+- ?fields=status,logs,... to only render some fields of the job,
+- ?log_offset=N for the log entries from sequence number N on,
+- ?log_tail=N for the last N log entries,
+- ?log_range=START-END (or START-) for characters START to END (inclusive,
+  like an HTTP Range) of the log text.
+
+The legacy logs column (the log written before the log chunks, see
+SpearJob.iter_logs) is the entry before sequence number 0: log_offset=0 and
+a log_tail reaching past the first chunk include it.
+
+The log entries are selected, and the characters of a range cut, by the
+database, so a long log is not loaded to render part of it. The job is read
+without its legacy logs column for these requests and for ?fields= without
+logs (see defer_logs). Partial log reads add "log_next_offset" (the offset
+to poll next) or "log_length" (of the whole log text) to the response.
+
+The responses carry an ETag built from the version of the job row, its
+latest heartbeat and its last log sequence number, a request with a
+matching If-None-Match gets a 304 without the job being rendered. Updates
+accept the ETag (or a plain "VERSION") as If-Match, see if_match_version:
+only the version is compared, heartbeats do not bump it and do not make
+updates fail.
+"""
+
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Optional
+from django.db.models import F, Sum, Window
+from django.db.models.functions import Length, Substr
+from django.utils.http import parse_etags
+from rest_framework import serializers
+from .models import SpearJob, SpearJobArchive, SpearJobLogChunk
+
+
+@dataclass(frozen=True)
+class LogSelection:
+    """The part of a job log to read, see parse_log_selection."""
+
+    offset: Optional[int] = None
+    tail: Optional[int] = None
+    start: Optional[int] = None
+    # exclusive
+    stop: Optional[int] = None
+
+    @property
+    def is_range(self) -> bool:
+        return self.start is not None
+
+
+def _non_negative(params, name: str) -> Optional[int]:
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise serializers.ValidationError({name: "Expected a non-negative integer."})
+    return value
+
+
+def parse_log_selection(params) -> Optional[LogSelection]:
+    """The log selection of the query parameters, None for the whole log.
+    Raises serializers.ValidationError on invalid parameters."""
+    given = [name for name in ("log_offset", "log_tail", "log_range") if name in params]
+    if not given:
+        return None
+    if len(given) > 1:
+        raise serializers.ValidationError(
+            {"detail": f"Use only one of {', '.join(given)}."}
+        )
+    if "log_offset" in params:
+        return LogSelection(offset=_non_negative(params, "log_offset"))
+    if "log_tail" in params:
+        return LogSelection(tail=_non_negative(params, "log_tail"))
+    start, _, end = params["log_range"].partition("-")
+    try:
+        start, end = int(start), int(end) if end else None
+    except ValueError:
+        start = -1
+    if start < 0 or (end is not None and end < start):
+        raise serializers.ValidationError(
+            {"log_range": "Expected START-END or START- character positions."}
+        )
+    return LogSelection(start=start, stop=None if end is None else end + 1)
+
+
+def defer_logs(fields: Optional[list[str]], selection: Optional[LogSelection]) -> bool:
+    """Whether the job of a detail request is read without its legacy logs
+    column: the whole log is not rendered, read_logs reads the legacy entry
+    only if the selection includes it."""
+    return selection is not None or (fields is not None and "logs" not in fields)
+
+
+def job_etag(job: SpearJob | SpearJobArchive, params) -> str:
+    """The ETag of the detail representation of a job for the query
+    parameters. Jobs read with with_last_log_sequence() only."""
+    query = hashlib.sha256(
+        "&".join(f"{k}={v}" for k, v in sorted(params.items())).encode()
+    ).hexdigest()[:8]
+    if isinstance(job, SpearJobArchive):
+        # archived jobs do not change anymore
+        return f'W/"{job.pk}-archived-{query}"'
+    heartbeat = (
+        int(job.latest_heartbeat.timestamp() * 1_000_000) if job.latest_heartbeat else 0
+    )
+    return f'W/"{job.pk}-{job.version}-{heartbeat}-{job.last_log_sequence}-{query}"'
+
+
+def if_match_version(if_match: Optional[str]) -> Optional[int]:
+    """The job version an If-Match header expects: the version of an ETag of
+    job_etag, or a plain "VERSION". None without If-Match or for "*".
+    Raises serializers.ValidationError for other values."""
+    if not if_match:
+        return None
+    etags = parse_etags(if_match)
+    if etags == ["*"]:
+        return None
+    match = len(etags) == 1 and re.fullmatch(
+        r'(?:W/)?"(?:\d+-(\d+)-\d+-\w+-\w+|(\d+))"', etags[0]
+    )
+    if not match:
+        raise serializers.ValidationError(
+            {"If-Match": "Expected one ETag of the job or a version."}
+        )
+    return int(match[1] or match[2])
+
+
+def _entries(logs: Optional[str]) -> list[str]:
+    return logs.split("\n") if logs else []
+
+
+def _read_archived_logs(job: SpearJobArchive, selection: LogSelection):
+    # the archived log is one text, its entries are its lines
+    logs = job.get_logs()
+    if selection.is_range:
+        logs = logs or ""
+        return logs[selection.start : selection.stop], {"log_length": len(logs)}
+    entries = _entries(logs)
+    if selection.offset is not None:
+        selected = entries[selection.offset :]
+    else:
+        selected = entries[len(entries) - selection.tail :] if selection.tail else []
+    return "\n".join(selected), {"log_next_offset": len(entries)}
+
+
+def _read_legacy_logs(job: SpearJob, start: int = 0, stop: Optional[int] = None):
+    """The length of the legacy logs column and its characters start to
+    stop, cut by the database (the job may be read without the column)."""
+    return (
+        SpearJob.objects.filter(pk=job.pk)
+        .annotate(
+            legacy_length=Length("logs"),
+            legacy_part=Substr(
+                "logs", start + 1, None if stop is None else max(stop - start, 0)
+            ),
+        )
+        .values_list("legacy_length", "legacy_part")
+        .get()
+    )
+
+
+def _read_range(job: SpearJob, start: int, stop: Optional[int]):
+    """Characters start to stop of the log text: the legacy logs column,
+    a newline if both are set, and the log chunks joined by newlines."""
+    legacy_length, legacy_part = _read_legacy_logs(job, start, stop)
+    chunks = SpearJobLogChunk.objects.filter(job_id=job.pk)
+    # a chunk and the newline after it end at the running total of the
+    # lengths (plus newlines), those overlapping the range are read
+    chunk_length = chunks.aggregate(total=Sum(Length("text") + 1))["total"] or 0
+    base = legacy_length + 1 if legacy_length and chunk_length else 0
+    length = (legacy_length or 0) + (1 if legacy_length and chunk_length else 0)
+    length += max(chunk_length - 1, 0)
+    stop = length if stop is None else min(stop, length)
+
+    pieces = [legacy_part or ""]
+    if legacy_length and chunk_length and start <= legacy_length < stop:
+        pieces.append("\n")
+    local_start, local_stop = start - base, stop - base
+    if local_stop > 0:
+        rows = (
+            chunks.annotate(
+                end=Window(Sum(Length("text") + 1), order_by=F("sequence").asc()),
+                begin=F("end") - Length("text") - 1,
+            )
+            .filter(end__gt=local_start, begin__lt=local_stop)
+            .order_by("sequence")
+            .values_list("begin", "text")
+        )
+        for begin, text in rows:
+            piece = text + "\n"
+            pieces.append(piece[max(local_start - begin, 0) : local_stop - begin])
+    return "".join(pieces)[: max(stop - start, 0)], {"log_length": length}
+
+
+def read_logs(job, selection: Optional[LogSelection]):
+    """The (selected part of the) log of a job and the extra response fields."""
+    if selection is None:
+        return job.get_logs(), {}
+    if isinstance(job, SpearJobArchive):
+        return _read_archived_logs(job, selection)
+    if selection.is_range:
+        return _read_range(job, selection.start, selection.stop)
+
+    chunks = SpearJobLogChunk.objects.filter(job_id=job.pk)
+    if selection.offset is not None:
+        rows = list(
+            chunks.filter(sequence__gte=selection.offset)
+            .order_by("sequence")
+            .values_list("sequence", "text")
+        )
+        with_legacy = selection.offset == 0
+    else:
+        rows = list(
+            chunks.order_by("-sequence").values_list("sequence", "text")[
+                : selection.tail
+            ]
+        )[::-1]
+        with_legacy = len(rows) < selection.tail
+    entries = [text for _, text in rows]
+    if with_legacy:
+        _, legacy_logs = _read_legacy_logs(job)
+        if legacy_logs:
+            entries.insert(0, legacy_logs)
+    if rows:
+        next_offset = rows[-1][0] + 1
+    elif selection.offset is not None:
+        next_offset = selection.offset
+    elif job.last_log_sequence is not None:
+        next_offset = job.last_log_sequence + 1
+    else:
+        next_offset = 0
+    return "\n".join(entries), {"log_next_offset": next_offset}
@@ -0,0 +1,113 @@
+"""Live events of the spear jobs, published on Redis pub/sub.
+
+Every status change of a SpearJob (saved, bulk updated or created, see
+SpearJob.publish_status_changes) and every appended log chunk is published,
+once the transaction commits, as a JSON message on the channel of the job
+(job_channel). The event stream views (async_views.job_events and
+async_views.events) subscribe to one job or to all of them and forward the
+events as Server-Sent Events.
+
+Pub/sub does not keep messages, a client catches up from the database:
+the stream of a job first sends the log chunks after the sequence number the
+client has seen, then the live events. Publishing is best effort, a Redis
+outage does not fail the updates.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Optional
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "spear_jobs.events"
+
+STATUS = "status"
+LOG = "log"
+
+
+def job_channel(job_id: int) -> str:
+    return f"{CHANNEL_PREFIX}.{job_id}"
+
+
+def status_event(job_id: int, status: str) -> dict[str, Any]:
+    return {"type": STATUS, "job_id": job_id, "status": status}
+
+
+def log_event(job_id: int, sequence: Optional[int], text: str) -> dict[str, Any]:
+    return {"type": LOG, "job_id": job_id, "sequence": sequence, "text": text}
+
+
+def format_sse(event: dict[str, Any], with_id: bool = True) -> str:
+    """An event in the text/event-stream format. Log events carry their
+    sequence number as event id, which the browser sends back as
+    Last-Event-ID when it reconnects."""
+    lines = [f"event: {event['type']}"]
+    if with_id and event["type"] == LOG and event.get("sequence") is not None:
+        lines.append(f"id: {event['sequence']}")
+    lines.append(f"data: {json.dumps(event)}")
+    return "\n".join(lines) + "\n\n"
+
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.SPEAR_JOB_EVENTS_URL, socket_connect_timeout=1, socket_timeout=1
+        )
+    return _client
+
+
+def _publish(events: list[dict[str, Any]]) -> None:
+    try:
+        pipeline = _redis().pipeline(transaction=False)
+        for event in events:
+            pipeline.publish(job_channel(event["job_id"]), json.dumps(event))
+        pipeline.execute()
+    except redis.RedisError as exc:
+        logger.warning(f"Could not publish {len(events)} spear job events: {exc}")
+
+
+def publish_job_events(events: list[dict[str, Any]]) -> None:
+    """Publish the events once the current transaction commits."""
+    if events and settings.SPEAR_JOB_EVENTS_URL:
+        transaction.on_commit(lambda: _publish(events))
+
+
+class JobEventSubscription:
+    """Async subscription to the events of one job, or of all jobs."""
+
+    def __init__(self, job_id: Optional[int] = None):
+        self.job_id = job_id
+        self._client = None
+        self._pubsub = None
+
+    async def __aenter__(self):
+        self._client = redis.asyncio.Redis.from_url(settings.SPEAR_JOB_EVENTS_URL)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        if self.job_id is None:
+            await self._pubsub.psubscribe(f"{CHANNEL_PREFIX}.*")
+        else:
+            await self._pubsub.subscribe(job_channel(self.job_id))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._pubsub.aclose()
+        await self._client.aclose()
+
+    async def get(self, timeout: float) -> Optional[dict[str, Any]]:
+        """The next event, or None if there was none within timeout seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            message = await self._pubsub.get_message(timeout=remaining)
+            if message is not None:
+                return json.loads(message["data"])
+        return None
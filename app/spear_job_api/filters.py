@@ -0,0 +1,98 @@
+"""Filter backends for the spear jobs API."""
+
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+
+class SpearJobFilterBackend(BaseFilterBackend):
+    """Filter the spear jobs list on query parameters.
+
+    Multiple values of status, priority, server_name, raystation_system,
+    workflow_name and parent (the steps of job graphs) are given comma
+    separated, the time range parameters take
+    ISO 8601 datetimes. Every filter is backed by a (column, created_at, id)
+    index so it combines with the keyset pagination."""
+
+    list_filters = {
+        "status": "status__in",
+        "priority": "priority__in",
+        "server_name": "server_name__in",
+        "raystation_system": "raystation_system__system_name__in",
+        "workflow_name": "workflow_name__in",
+        "parent": "parent__in",
+    }
+    range_filters = {
+        "created_after": "created_at__gte",
+        "created_before": "created_at__lt",
+        "started_after": "started_at__gte",
+        "started_before": "started_at__lt",
+        "completed_after": "completed_at__gte",
+        "completed_before": "completed_at__lt",
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, "action", None) != "list":
+            # detail lookups must not be narrowed by query parameters
+            return queryset
+        return queryset.filter(**self.get_filters(request.query_params))
+
+    def get_filters(self, params) -> dict:
+        """The queryset filters of the query parameters. Raises
+        serializers.ValidationError on invalid values."""
+        filters = {}
+        for param, lookup in self.list_filters.items():
+            value = params.get(param)
+            if value:
+                filters[lookup] = value.split(",")
+        if "priority__in" in filters:
+            try:
+                filters["priority__in"] = [int(p) for p in filters["priority__in"]]
+            except ValueError:
+                raise serializers.ValidationError(
+                    {"priority": "Priorities must be integers."}
+                )
+        if "parent__in" in filters:
+            try:
+                filters["parent__in"] = [int(p) for p in filters["parent__in"]]
+            except ValueError:
+                raise serializers.ValidationError(
+                    {"parent": "Parent job ids must be integers."}
+                )
+        for param, lookup in self.range_filters.items():
+            value = params.get(param)
+            if value:
+                filters[lookup] = self.parse_datetime(param, value)
+        return filters
+
+    @staticmethod
+    def parse_datetime(param, value):
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise serializers.ValidationError({param: "Expected an ISO 8601 datetime."})
+        return parsed
+
+    def get_schema_operation_parameters(self, view):
+        parameters = [
+            {
+                "name": param,
+                "required": False,
+                "in": "query",
+                "description": f"Comma separated list of {param} values",
+                "schema": {"type": "string"},
+            }
+            for param in self.list_filters
+        ]
+        parameters += [
+            {
+                "name": param,
+                "required": False,
+                "in": "query",
+                "schema": {"type": "string", "format": "date-time"},
+            }
+            for param in self.range_filters
+        ]
+        return parameters
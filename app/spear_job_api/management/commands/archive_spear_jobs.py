@@ -0,0 +1,65 @@
+import time
+from django.core.management.base import BaseCommand
+from spear_job_api.archive import archive_spear_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the finished spear jobs older than --days with their logs to the "
+        "archive table, once or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=float,
+            default=None,
+            help="Archive jobs created more than DAYS ago "
+            "(default: SPEAR_JOB_ARCHIVE_DAYS)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of jobs (and their steps) moved per transaction",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Maximum number of batches per run (default: until none is left)",
+        )
+        parser.add_argument(
+            "--compress",
+            action="store_true",
+            default=None,
+            help="Compress the archived logs (default: "
+            "SPEAR_JOB_ARCHIVE_COMPRESS_LOGS)",
+        )
+        parser.add_argument("--no-compress", action="store_false", dest="compress")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep archiving every INTERVAL seconds (0: archive once)",
+        )
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs["interval"]
+        while True:
+            start = time.perf_counter()
+            result = archive_spear_jobs(
+                days=kwargs["days"],
+                batch_size=kwargs["batch_size"],
+                max_batches=kwargs["max_batches"],
+                compress=kwargs["compress"],
+            )
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"Archived {result.jobs} jobs with {result.log_chunks} log entries "
+                f"({result.log_bytes} bytes stored as {result.stored_log_bytes}) "
+                f"in {elapsed:.3f}s"
+            )
+            if not interval:
+                break
+            time.sleep(max(0.0, interval - elapsed))
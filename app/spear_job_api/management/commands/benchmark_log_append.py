@@ -0,0 +1,94 @@
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from spear_job_api import models
+from spear_job_api.serializers import SpearJobUpdateSerializer
+from spear_job_api.stats import percentiles
+
+MB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the cost of appending log entries to a Spear job while its "
+        "log grows, optionally compared with rewriting the legacy logs column"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--total-mb", type=int, default=20, help="Log size to grow to (MB)"
+        )
+        parser.add_argument(
+            "--entry-size", type=int, default=4096, help="Size of one entry (bytes)"
+        )
+        parser.add_argument(
+            "--report-every-mb", type=int, default=2, help="Report window (MB)"
+        )
+        parser.add_argument(
+            "--legacy-mb",
+            type=int,
+            default=0,
+            help="Also grow the legacy logs column to this size (MB) for comparison",
+        )
+
+    def handle(self, *args, **kwargs):
+        entry = "x" * kwargs["entry_size"]
+        system = models.RayStationSystem.objects.create(
+            system_name=f"benchmark-{uuid.uuid4()}", system_uid=str(uuid.uuid4())
+        )
+        try:
+            self.stdout.write(self.style.SUCCESS("Append-only log chunks"))
+            self._run(system, entry, kwargs["total_mb"], kwargs["report_every_mb"])
+            if kwargs["legacy_mb"]:
+                self.stdout.write(self.style.SUCCESS("Legacy logs column rewrite"))
+                self._run(
+                    system,
+                    entry,
+                    kwargs["legacy_mb"],
+                    kwargs["report_every_mb"],
+                    legacy=True,
+                )
+        finally:
+            # cascades to the benchmark jobs and their log chunks
+            system.delete()
+
+    def _run(self, system, entry, total_mb, report_every_mb, legacy=False):
+        job = models.SpearJob.objects.create(
+            patient_id="benchmark",
+            celery_job_id=str(uuid.uuid4()),
+            workflow_name="benchmark",
+            raystation_system=system,
+        )
+        written = 0
+        durations = []
+        next_report = report_every_mb * MB
+        while written < total_mb * MB:
+            start = time.perf_counter()
+            if legacy:
+                job.logs = f"{job.logs}\n{entry}" if job.logs else entry
+                job.save(update_fields=["logs"])
+            else:
+                serializer = SpearJobUpdateSerializer(
+                    instance=job, data={"append_log": entry}, partial=True
+                )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            durations.append(time.perf_counter() - start)
+            written += len(entry) + 1
+
+            if written >= next_report:
+                self._report(written, durations)
+                durations = []
+                next_report += report_every_mb * MB
+
+        if durations:
+            self._report(written, durations)
+
+    def _report(self, written, durations):
+        durations_ms = [d * 1000 for d in durations]
+        p95 = percentiles(durations_ms, 95)["p95"]
+        self.stdout.write(
+            f"  log size {written / MB:7.1f} MB | appends {len(durations_ms):6d} "
+            f"| mean {statistics.mean(durations_ms):8.3f} ms | p95 {p95:8.3f} ms"
+        )
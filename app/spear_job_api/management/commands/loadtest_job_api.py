@@ -0,0 +1,130 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management.base import BaseCommand
+from spear_job_api import models
+from spear_job_api.stats import percentiles
+
+# endpoint -> (sync (method, path), async (method, path), json body), {id}
+# and {celery_job_id} are filled in per request
+ENDPOINTS = {
+    "retrieve": (
+        ("GET", "/api/spear-jobs/{id}/"),
+        ("GET", "/api/async/spear-jobs/{id}/"),
+        None,
+    ),
+    "by-celery": (
+        ("GET", "/api/spear-jobs/by-celery/{celery_job_id}/"),
+        ("GET", "/api/async/spear-jobs/by-celery/{celery_job_id}/"),
+        None,
+    ),
+    "heartbeat": (
+        ("POST", "/api/spear-jobs/by-celery/{celery_job_id}/heartbeat/"),
+        ("POST", "/api/async/spear-jobs/by-celery/{celery_job_id}/heartbeat/"),
+        {},
+    ),
+    "append-log": (
+        ("PATCH", "/api/spear-jobs/by-celery/{celery_job_id}/"),
+        ("POST", "/api/async/spear-jobs/by-celery/{celery_job_id}/logs/"),
+        {"append_log": "load test log entry"},
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the sync (SpearJobViewSet) and async job endpoints of a "
+        "running server that uses the same database as this command, and "
+        "report requests/sec and latency percentiles"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8080",
+            help="Base URL of the server, e.g. uvicorn app.asgi:application",
+        )
+        parser.add_argument(
+            "--endpoints",
+            nargs="+",
+            choices=list(ENDPOINTS),
+            default=list(ENDPOINTS),
+        )
+        parser.add_argument(
+            "--requests", type=int, default=2000, help="Requests per endpoint"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=32, help="Concurrent clients"
+        )
+        parser.add_argument(
+            "--jobs", type=int, default=100, help="Number of jobs to spread over"
+        )
+
+    def handle(self, *args, **kwargs):
+        system = models.RayStationSystem.objects.create(
+            system_name=f"loadtest-{uuid.uuid4()}", system_uid=str(uuid.uuid4())
+        )
+        try:
+            jobs = models.SpearJob.objects.bulk_create(
+                models.SpearJob(
+                    patient_id=f"loadtest_{i}",
+                    celery_job_id=str(uuid.uuid4()),
+                    status=models.SpearJobStatus.RUNNING,
+                    workflow_name="loadtest",
+                    workflow_config={"key": "value"},
+                    raystation_system=system,
+                )
+                for i in range(kwargs["jobs"])
+            )
+            self.stdout.write(
+                f"{'endpoint':<12} {'view':<6} {'req/s':>9} {'p50 ms':>8} "
+                f"{'p99 ms':>8} {'errors':>7}"
+            )
+            for endpoint in kwargs["endpoints"]:
+                sync_request, async_request, body = ENDPOINTS[endpoint]
+                for view, (method, path) in (
+                    ("sync", sync_request),
+                    ("async", async_request),
+                ):
+                    self._run(
+                        endpoint,
+                        view,
+                        method,
+                        kwargs["url"].rstrip("/") + path,
+                        body,
+                        jobs,
+                        kwargs["requests"],
+                        kwargs["concurrency"],
+                    )
+        finally:
+            # cascades to the load test jobs and their log chunks
+            system.delete()
+
+    def _run(self, endpoint, view, method, url, body, jobs, count, concurrency):
+        local = threading.local()
+
+        def call(i):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            job = jobs[i % len(jobs)]
+            start = time.perf_counter()
+            response = local.session.request(
+                method,
+                url.format(id=job.id, celery_job_id=job.celery_job_id),
+                json=body,
+            )
+            return time.perf_counter() - start, response.ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(call, range(count)))
+        elapsed = time.perf_counter() - start
+
+        points = percentiles([duration * 1000 for duration, _ok in results], 50, 99)
+        errors = sum(1 for _duration, ok in results if not ok)
+        self.stdout.write(
+            f"{endpoint:<12} {view:<6} {count / elapsed:9.1f} "
+            f"{points['p50']:8.2f} {points['p99']:8.2f} {errors:7d}"
+        )
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from spear_job_api.stats import refresh_job_stats
+
+
+class Command(BaseCommand):
+    help = "Refresh the spear job queue statistics, once or every --interval seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep refreshing every INTERVAL seconds (0: refresh once)",
+        )
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs["interval"]
+        while True:
+            start = time.perf_counter()
+            snapshot = refresh_job_stats()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"Refreshed job stats of {snapshot.data['total']} jobs in {elapsed:.3f}s"
+            )
+            if not interval:
+                break
+            time.sleep(max(0.0, interval - elapsed))
@@ -0,0 +1,167 @@
+"""Prometheus metrics of the spear job API and queue, served at /metrics.
+
+With several server processes (e.g. uvicorn --workers), set
+PROMETHEUS_MULTIPROC_DIR to a directory shared by the processes so /metrics
+aggregates all of them.
+"""
+
+import os
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection, transaction
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# durations of the API requests and jobs span milliseconds to hours
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200)
+
+REQUEST_DURATION = Histogram(
+    "spear_api_request_duration_seconds",
+    "Duration of the API requests per view (viewset action)",
+    ["view", "method", "status"],
+    buckets=REQUEST_BUCKETS,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "spear_api_request_db_queries",
+    "Number of database queries per API request",
+    ["view"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+REQUEST_DB_DURATION = Histogram(
+    "spear_api_request_db_duration_seconds",
+    "Time spent in database queries per API request",
+    ["view"],
+    buckets=REQUEST_BUCKETS,
+)
+PUBLISH_DURATION = Histogram(
+    "spear_enqueue_publish_duration_seconds",
+    "Duration of publishing (and confirming) one enqueue_spear_job message",
+    buckets=REQUEST_BUCKETS,
+)
+PUBLISH_FAILURES = Counter(
+    "spear_enqueue_publish_failures_total",
+    "Number of enqueue_spear_job messages that failed to publish",
+)
+RELAY_BATCH_DURATION = Histogram(
+    "spear_outbox_relay_batch_duration_seconds",
+    "Duration of relaying one batch of the outbox",
+    buckets=REQUEST_BUCKETS,
+)
+JOB_QUEUE_WAIT = Histogram(
+    "spear_job_queue_wait_seconds",
+    "Time from the creation to the start of a job",
+    ["workflow", "server"],
+    buckets=JOB_BUCKETS,
+)
+JOB_RUN_TIME = Histogram(
+    "spear_job_run_seconds",
+    "Time from the start to the completion of a job",
+    ["workflow", "server"],
+    buckets=JOB_BUCKETS,
+)
+
+
+def metrics_view(request):
+    """Serve the metrics in the Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def observe_job_durations(job, fields) -> None:
+    """Observe the queue wait and run time of a job once the update setting
+    its started_at or completed_at (in `fields`) is committed."""
+    labels = {"workflow": job.workflow_name or "", "server": job.server_name or ""}
+    observations = []
+    if "started_at" in fields and job.started_at and job.created_at:
+        observations.append(
+            (JOB_QUEUE_WAIT, (job.started_at - job.created_at).total_seconds())
+        )
+    if "completed_at" in fields and job.completed_at and job.started_at:
+        observations.append(
+            (JOB_RUN_TIME, (job.completed_at - job.started_at).total_seconds())
+        )
+    if observations:
+        transaction.on_commit(
+            lambda: [
+                histogram.labels(**labels).observe(max(seconds, 0))
+                for histogram, seconds in observations
+            ]
+        )
+
+
+class QueryCounter:
+    """Database execute wrapper counting the queries and their duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+def view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match else "<unresolved>"
+
+
+class MetricsMiddleware:
+    """Record the duration of every request per view, and the number and
+    duration of its database queries.
+
+    The views are labelled by URL name, e.g. spear_job_api:spearjob-list,
+    which is one label per viewset action. Under an ASGI server the views
+    run in other threads than the middleware and the queries are not counted."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        view = view_name(request)
+        REQUEST_DB_QUERIES.labels(view=view).observe(queries.count)
+        REQUEST_DB_DURATION.labels(view=view).observe(queries.duration)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def observe(request, response, duration):
+        REQUEST_DURATION.labels(
+            view=view_name(request),
+            method=request.method,
+            status=response.status_code,
+        ).observe(duration)
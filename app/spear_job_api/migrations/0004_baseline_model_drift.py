@@ -0,0 +1,51 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+# The SpearWorkflowTemplate model and the status choices of SpearJob were in
+# the models without a migration, kept apart from the log chunk table
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0003_alter_spearjob_celery_job_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpearWorkflowTemplate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=200, unique=True)),
+                ("description", models.TextField(blank=True, null=True)),
+                ("default_config", models.JSONField(blank=True, null=True)),
+                ("enabled", models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="spearjob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "Pending"),
+                    ("QUEUED", "Queued"),
+                    ("RUNNING", "Running"),
+                    ("COMPLETED", "Completed"),
+                    ("FAILED", "Failed"),
+                    ("REVOKED", "Revoked"),
+                ],
+                default="PENDING",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0004_baseline_model_drift"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpearJobLogChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sequence", models.PositiveIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("text", models.TextField()),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="log_chunks",
+                        to="spear_job_api.spearjob",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Spear Job Log Chunk",
+                "verbose_name_plural": "Spear Job Log Chunks",
+                "ordering": ["job", "sequence"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("job", "sequence"), name="unique_spearjob_log_sequence"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0005_spearjoblogchunk"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["created_at", "id"], name="spearjob_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["status", "created_at", "id"], name="spearjob_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["priority", "created_at", "id"], name="spearjob_priority_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["server_name", "created_at", "id"], name="spearjob_server_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["raystation_system", "created_at", "id"],
+                name="spearjob_system_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["workflow_name", "created_at", "id"],
+                name="spearjob_workflow_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(fields=["started_at"], name="spearjob_started_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(fields=["completed_at"], name="spearjob_completed_idx"),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0006_spearjob_list_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpearJobStatsSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("computed_at", models.DateTimeField()),
+                ("data", models.JSONField()),
+            ],
+            options={
+                "verbose_name": "Spear Job Stats Snapshot",
+                "verbose_name_plural": "Spear Job Stats Snapshots",
+            },
+        ),
+    ]
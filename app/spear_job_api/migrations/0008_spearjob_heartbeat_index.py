@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0007_spearjobstatssnapshot"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["status", "latest_heartbeat"], name="spearjob_heartbeat_idx"
+            ),
+        ),
+    ]
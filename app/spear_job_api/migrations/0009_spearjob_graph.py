@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0008_spearjob_heartbeat_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="spearjob",
+            name="depends_on",
+            field=models.ManyToManyField(
+                blank=True, related_name="dependents", to="spear_job_api.spearjob"
+            ),
+        ),
+        migrations.AddField(
+            model_name="spearjob",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="steps",
+                to="spear_job_api.spearjob",
+            ),
+        ),
+        migrations.AddField(
+            model_name="spearjob",
+            name="step_name",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                fields=["parent", "created_at", "id"], name="spearjob_parent_idx"
+            ),
+        ),
+    ]
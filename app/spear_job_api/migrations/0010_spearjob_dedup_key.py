@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0009_spearjob_graph"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="spearjob",
+            name="dedup_key",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name="spearjob",
+            index=models.Index(
+                condition=models.Q(("dedup_key", ""), _negated=True),
+                fields=["dedup_key", "created_at"],
+                name="spearjob_dedup_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="spearjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("status__in", ["PENDING", "QUEUED", "RUNNING"]),
+                    models.Q(("dedup_key", ""), _negated=True),
+                ),
+                fields=("dedup_key",),
+                name="spearjob_active_dedup_key",
+            ),
+        ),
+    ]
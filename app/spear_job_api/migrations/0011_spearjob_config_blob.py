@@ -0,0 +1,125 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:37
+
+import hashlib
+import json
+import zlib
+import django.db.models.deletion
+from django.db import migrations, models
+
+# jobs read and updated per batch
+BATCH_SIZE = 2000
+
+
+# frozen copies of spear_job_api.configs, the blobs written here must not
+# change with the live module
+
+
+def canonical_json(value):
+    return json.dumps(
+        value, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+def merge_patch(target, patch):
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def move_configs(apps, schema_editor):
+    """Store the configs of the jobs without a blob whole as blobs, the jobs
+    created from now on store overrides of their workflow template. The jobs
+    are updated per batch, one UPDATE per config of a batch."""
+    SpearJob = apps.get_model("spear_job_api", "SpearJob")
+    SpearWorkflowConfig = apps.get_model("spear_job_api", "SpearWorkflowConfig")
+    blob_ids = {}
+
+    def update(pks_by_digest):
+        for digest, pks in pks_by_digest.items():
+            SpearJob.objects.filter(pk__in=pks).update(config_blob_id=blob_ids[digest])
+
+    pks_by_digest = {}
+    jobs = SpearJob.objects.filter(
+        config_blob__isnull=True, workflow_config__isnull=False
+    ).values_list("pk", "workflow_config")
+    for count, (pk, config) in enumerate(jobs.iterator(chunk_size=BATCH_SIZE), 1):
+        encoded = canonical_json(config)
+        digest = hashlib.sha256(encoded).hexdigest()
+        if digest not in blob_ids:
+            blob_ids[digest] = SpearWorkflowConfig.objects.get_or_create(
+                digest=digest, defaults={"data": zlib.compress(encoded)}
+            )[0].pk
+        pks_by_digest.setdefault(digest, []).append(pk)
+        if count % BATCH_SIZE == 0:
+            update(pks_by_digest)
+            pks_by_digest = {}
+    update(pks_by_digest)
+
+
+def restore_configs(apps, schema_editor):
+    SpearJob = apps.get_model("spear_job_api", "SpearJob")
+    SpearWorkflowConfig = apps.get_model("spear_job_api", "SpearWorkflowConfig")
+    for blob in SpearWorkflowConfig.objects.iterator(chunk_size=100):
+        config = json.loads(zlib.decompress(blob.data))
+        SpearJob.objects.filter(config_blob=blob, config_overrides__isnull=True).update(
+            workflow_config=config
+        )
+        jobs = SpearJob.objects.filter(
+            config_blob=blob, config_overrides__isnull=False
+        ).values_list("pk", "config_overrides")
+        for pk, overrides in jobs.iterator(chunk_size=BATCH_SIZE):
+            SpearJob.objects.filter(pk=pk).update(
+                workflow_config=merge_patch(config, overrides)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0010_spearjob_dedup_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpearWorkflowConfig",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("digest", models.CharField(max_length=64, unique=True)),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="spearjob",
+            name="config_overrides",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="spearjob",
+            name="config_blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="spear_job_api.spearworkflowconfig",
+            ),
+        ),
+        # the workflow_config column is removed by 0014, once no running code
+        # writes it anymore
+        migrations.RunPython(move_configs, restore_configs),
+    ]
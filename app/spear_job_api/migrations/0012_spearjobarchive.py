@@ -0,0 +1,102 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0011_spearjob_config_blob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpearJobArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("patient_id", models.CharField(max_length=100)),
+                ("created_at", models.DateTimeField()),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("QUEUED", "Queued"),
+                            ("RUNNING", "Running"),
+                            ("COMPLETED", "Completed"),
+                            ("FAILED", "Failed"),
+                            ("REVOKED", "Revoked"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("celery_job_id", models.CharField(max_length=36, unique=True)),
+                (
+                    "worker_name",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                (
+                    "server_name",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("HPTC-RAY-SP01", "HPTC-RAY-SP01"),
+                            ("HPTC-RAY-SP02", "HPTC-RAY-SP02"),
+                        ],
+                        max_length=100,
+                        null=True,
+                    ),
+                ),
+                (
+                    "workflow_name",
+                    models.CharField(blank=True, max_length=200, null=True),
+                ),
+                ("config_overrides", models.JSONField(blank=True, null=True)),
+                ("priority", models.SmallIntegerField(default=5)),
+                ("step_name", models.CharField(blank=True, default="", max_length=200)),
+                ("log_data", models.BinaryField(blank=True, null=True)),
+                ("log_compressed", models.BooleanField(default=False)),
+                (
+                    "config_blob",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to="spear_job_api.spearworkflowconfig",
+                    ),
+                ),
+                (
+                    "parent",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="steps",
+                        to="spear_job_api.spearjobarchive",
+                    ),
+                ),
+                (
+                    "raystation_system",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_jobs",
+                        to="spear_job_api.raystationsystem",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Archived Spear Job",
+                "verbose_name_plural": "Archived Spear Jobs",
+                "indexes": [
+                    models.Index(
+                        fields=["created_at", "id"], name="spearjobarchive_created_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0012_spearjobarchive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="spearjob",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:07
+
+from importlib import import_module
+from django.db import migrations
+
+# the jobs created by code still writing workflow_config after 0011 ran get
+# their blob before the column is dropped
+move_configs = import_module(
+    "spear_job_api.migrations.0011_spearjob_config_blob"
+).move_configs
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_job_api", "0013_spearjob_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_configs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="spearjob",
+            name="workflow_config",
+        ),
+    ]
@@ -1,5 +1,20 @@
-from django.db import models
+import copy
+import zlib
+from typing import Any, Iterable
+from django.db import IntegrityError, models, transaction
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
+from django.utils.functional import cached_property
+from .configs import (
+    compress_config,
+    config_digest,
+    decompress_config,
+    merge_patch,
+    split_config,
+)
+from .events import log_event, publish_job_events, status_event
+
+# SpearJob.workflow_config was not assigned since the job was loaded or saved
+_UNSET = object()
 
 
 class SpearServer(models.TextChoices):
@@ -36,6 +51,124 @@ class RayStationSystem(models.Model):
         verbose_name_plural = "RayStation Systems"
 
 
+class SpearWorkflowConfigManager(models.Manager):
+    """Manager storing the workflow config blobs."""
+
+    def store(self, configs: Iterable[Any]) -> dict[str, "SpearWorkflowConfig"]:
+        """Return the blobs of the configs by digest, inserting the missing
+        ones. Concurrent inserts of the same config are ignored."""
+        by_digest = {config_digest(config): config for config in configs}
+        if not by_digest:
+            return {}
+        blobs = self.in_bulk(by_digest, field_name="digest")
+        missing = by_digest.keys() - blobs.keys()
+        if missing:
+            self.bulk_create(
+                [
+                    self.model(digest=digest, data=compress_config(by_digest[digest]))
+                    for digest in sorted(missing)
+                ],
+                ignore_conflicts=True,
+            )
+            blobs.update(self.in_bulk(missing, field_name="digest"))
+        return blobs
+
+    def assign(self, jobs: Iterable["SpearJob"]) -> None:
+        """Store the workflow configs assigned to the jobs as blobs and
+        overrides (see spear_job_api.configs)."""
+        jobs = [job for job in jobs if job._workflow_config is not _UNSET]
+        splits = [split_config(job.workflow_name, job._workflow_config) for job in jobs]
+        blobs = self.store(base for base, _ in splits if base is not None)
+        for job, (base, overrides) in zip(jobs, splits):
+            job.config_blob = None if base is None else blobs[config_digest(base)]
+            job.config_overrides = overrides
+            job._workflow_config = _UNSET
+
+
+class SpearWorkflowConfig(models.Model):
+    """A workflow config shared by the jobs referencing it, stored once per
+    content as zlib-compressed canonical JSON."""
+
+    digest = models.CharField(max_length=64, unique=True)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    objects = SpearWorkflowConfigManager()
+
+    @cached_property
+    def config(self) -> Any:
+        """The decoded config. It is shared by the jobs, do not modify it."""
+        return decompress_config(self.data)
+
+    def expand(self, overrides: dict | None) -> Any:
+        """A copy of the config with the overrides of a job applied."""
+        if overrides is None:
+            return copy.deepcopy(self.config)
+        return merge_patch(self.config, overrides)
+
+    def __str__(self):
+        return self.digest[:12]
+
+
+class SpearJobQuerySet(models.QuerySet):
+    """QuerySet of SpearJobs with the loading strategies of the API."""
+
+    def with_raystation_system(self):
+        """Join the RayStation system, the serializers always render its name."""
+        return self.select_related("raystation_system")
+
+    def with_config(self):
+        """Also join the workflow config blob, for the views and tasks that
+        read workflow_config."""
+        return self.select_related("raystation_system", "config_blob")
+
+    def with_last_log_sequence(self):
+        """Annotate the sequence number of the last log chunk, read from the
+        (job, sequence) unique index."""
+        return self.annotate(
+            last_log_sequence=models.Subquery(
+                SpearJobLogChunk.objects.filter(job_id=models.OuterRef("pk"))
+                .order_by("-sequence")
+                .values("sequence")[:1]
+            )
+        )
+
+    def for_list(self):
+        """Jobs for listing, without the potentially large text/JSON columns."""
+        return self.with_raystation_system().defer("logs", "config_overrides")
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        SpearWorkflowConfig.objects.assign(objs)
+        jobs = super().bulk_create(objs, *args, **kwargs)
+        SpearJob.publish_status_changes(jobs)
+        return jobs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """Bump the version of the jobs with the update. The version is not
+        checked, the last writer wins: this is for the internal bulk writes
+        of the scheduler, reaper, outbox relay and job graphs. See
+        SpearJob.compare_and_set for the checked update of one job.
+
+        The version is incremented in SQL, a stale copy of a job must not
+        move it back to a version an old ETag still matches."""
+        objs = list(objs)
+        for obj in objs:
+            obj.version = models.F("version") + 1
+        fields = [*fields, "version"] if "version" not in fields else fields
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        versions = dict(
+            SpearJob.objects.filter(pk__in=[obj.pk for obj in objs]).values_list(
+                "pk", "version"
+            )
+        )
+        for obj in objs:
+            obj.version = versions[obj.pk]
+        if "status" in fields:
+            SpearJob.publish_status_changes(objs)
+        return rows
+
+
 class SpearJob(models.Model):
     """Model representing a Spear job."""
 
@@ -71,7 +204,16 @@ class SpearJob(models.Model):
         max_length=100, null=True, blank=True, choices=SpearServer.choices
     )
     workflow_name = models.CharField(max_length=200, null=True, blank=True)
-    workflow_config = models.JSONField(null=True, blank=True)
+    # the workflow config is stored as a shared blob and a merge patch of it,
+    # read and assigned through the workflow_config property
+    config_blob = models.ForeignKey(
+        SpearWorkflowConfig,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    config_overrides = models.JSONField(null=True, blank=True)
     latest_heartbeat = models.DateTimeField(null=True, blank=True)
     raystation_system = models.ForeignKey(
         RayStationSystem,
@@ -83,27 +225,314 @@ class SpearJob(models.Model):
     priority = models.SmallIntegerField(
         default=5, validators=[MaxValueValidator(10), MinValueValidator(1)]
     )
+    # a job graph (see spear_queue.graphs) is a parent job, which is not a
+    # celery task itself, and its steps
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="steps",
+        db_index=False,  # covered by spearjob_parent_idx
+    )
+    step_name = models.CharField(max_length=200, blank=True, default="")
+    # hash identifying duplicate submissions (see spear_queue.tasks.dedup_key)
+    dedup_key = models.CharField(max_length=64, blank=True, default="")
+    depends_on = models.ManyToManyField(
+        "self", symmetrical=False, blank=True, related_name="dependents"
+    )
+
+    # incremented on every write of the row, the ETag of the detail views
+    version = models.PositiveIntegerField(default=0)
+
+    objects = SpearJobQuerySet.as_manager()
+
+    class Meta:
+        # the list endpoint pages on (created_at, id), every filter it offers
+        # has a matching (column, created_at, id) index
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="spearjob_created_idx"),
+            models.Index(
+                fields=["status", "created_at", "id"], name="spearjob_status_idx"
+            ),
+            models.Index(
+                fields=["priority", "created_at", "id"], name="spearjob_priority_idx"
+            ),
+            models.Index(
+                fields=["server_name", "created_at", "id"], name="spearjob_server_idx"
+            ),
+            models.Index(
+                fields=["raystation_system", "created_at", "id"],
+                name="spearjob_system_idx",
+            ),
+            models.Index(
+                fields=["workflow_name", "created_at", "id"],
+                name="spearjob_workflow_idx",
+            ),
+            models.Index(
+                fields=["parent", "created_at", "id"], name="spearjob_parent_idx"
+            ),
+            models.Index(fields=["started_at"], name="spearjob_started_idx"),
+            models.Index(fields=["completed_at"], name="spearjob_completed_idx"),
+            # the stale job reaper looks up RUNNING jobs by their last heartbeat
+            models.Index(
+                fields=["status", "latest_heartbeat"], name="spearjob_heartbeat_idx"
+            ),
+            models.Index(
+                fields=["dedup_key", "created_at"],
+                condition=~models.Q(dedup_key=""),
+                name="spearjob_dedup_idx",
+            ),
+        ]
+        constraints = [
+            # at most one waiting or running job per submission, concurrent
+            # duplicate submissions fail on this index
+            models.UniqueConstraint(
+                fields=["dedup_key"],
+                condition=models.Q(status__in=["PENDING", "QUEUED", "RUNNING"])
+                & ~models.Q(dedup_key=""),
+                name="spearjob_active_dedup_key",
+            ),
+        ]
+
+    @staticmethod
+    def resolve_server_name(worker_name: str | None, routed: str = "") -> str:
+        """Return the Spear server a worker runs on, based on its name, or
+        else the server the job was routed to (see spear_queue.routing)."""
+        if worker_name and "sp1" in worker_name.lower():
+            return SpearServer.SP1
+        if worker_name and "sp2" in worker_name.lower():
+            return SpearServer.SP2
+        if routed in SpearServer.values:
+            return routed
+        return "Unknown Server" if worker_name else ""
+
+    @staticmethod
+    def server_name_expression(worker_name: str | None):
+        """resolve_server_name as a value or an expression of the current
+        server_name, for updates that do not read the job first."""
+        resolved = SpearJob.resolve_server_name(worker_name)
+        if resolved in SpearServer.values:
+            return resolved
+        return models.Case(
+            models.When(
+                server_name__in=SpearServer.values, then=models.F("server_name")
+            ),
+            default=models.Value(resolved),
+        )
+
+    _workflow_config = _UNSET
+    # the status as last loaded or saved, see publish_status_changes
+    _saved_status = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        job = super().from_db(db, field_names, values)
+        job._saved_status = job.__dict__.get("status")
+        return job
+
+    @staticmethod
+    def publish_status_changes(jobs: Iterable["SpearJob"]) -> None:
+        """Publish the status of the jobs whose status changed since they
+        were loaded or saved (see spear_job_api.events)."""
+        events = []
+        for job in jobs:
+            if job.pk is not None and job.status != job._saved_status:
+                events.append(status_event(job.pk, job.status))
+                job._saved_status = job.status
+        publish_job_events(events)
+
+    @property
+    def workflow_config(self) -> Any:
+        """The workflow config, expanded from the blob and the overrides.
+        Returns a copy, assign a new config to change it."""
+        if self._workflow_config is not _UNSET:
+            return self._workflow_config
+        if self.config_blob_id is None:
+            return None
+        return self.config_blob.expand(self.config_overrides)
+
+    @workflow_config.setter
+    def workflow_config(self, value: Any) -> None:
+        # stored on save() or bulk_create()
+        self._workflow_config = value
 
     def save(self, *args, **kwargs):
         # update the server_name based on the worker that picks up the job
-        if not self.worker_name:
-            self.server_name = ""
+        self.server_name = self.resolve_server_name(self.worker_name, self.server_name)
+        update_fields = kwargs.get("update_fields")
+        self.version += 1
+        if update_fields is not None:
+            kwargs["update_fields"] = update_fields = {*update_fields, "version"}
+        if update_fields is None:
+            SpearWorkflowConfig.objects.assign([self])
+        elif "workflow_config" in update_fields:
+            SpearWorkflowConfig.objects.assign([self])
+            kwargs["update_fields"] = {
+                *update_fields,
+                "config_blob",
+                "config_overrides",
+            }
+            kwargs["update_fields"].remove("workflow_config")
+        super().save(*args, **kwargs)
+        if update_fields is None or "status" in update_fields:
+            self.publish_status_changes([self])
 
-        elif "sp1" in self.worker_name.lower():
-            self.server_name = SpearServer.SP1
+    def compare_and_set(self, fields: Iterable[str]) -> bool:
+        """Write `fields` of the job with one conditional UPDATE, only if
+        the row is still at self.version, and bump the version.
 
-        elif "sp2" in self.worker_name.lower():
-            self.server_name = SpearServer.SP2
+        Returns False, writing nothing, if another update came first: the
+        caller re-reads the job and retries (see services.update_spear_job).
+        Unlike save() no row lock is needed between the read and the write."""
+        fields = set(fields)
+        if "worker_name" in fields:
+            self.server_name = self.resolve_server_name(
+                self.worker_name, self.server_name
+            )
+            fields.add("server_name")
+        updated = SpearJob.objects.filter(pk=self.pk, version=self.version).update(
+            version=self.version + 1,
+            **{field: getattr(self, field) for field in fields},
+        )
+        if not updated:
+            return False
+        self.version += 1
+        if "status" in fields:
+            self.publish_status_changes([self])
+        return True
 
-        else:
-            self.server_name = "Unknown Server"
+    def iter_logs(self):
+        """Yield the log entries of the job in order.
 
-        super().save(*args, **kwargs)
+        Logs written before the log chunk table existed live in the legacy
+        `logs` column and come first."""
+        if self.logs:
+            yield self.logs
+        yield from SpearJobLogChunk.objects.iter_text(job_id=self.pk)
+
+    def get_logs(self) -> str | None:
+        """Return the full log of the job as a single newline separated text."""
+        entries = list(self.iter_logs())
+        return "\n".join(entries) if entries else None
+
+    async def aget_logs(self) -> str | None:
+        """Async version of get_logs."""
+        entries = [self.logs] if self.logs else []
+        entries += [
+            text
+            async for text in SpearJobLogChunk.objects.filter(job_id=self.pk)
+            .order_by("sequence")
+            .values_list("text", flat=True)
+        ]
+        return "\n".join(entries) if entries else None
 
     def __str__(self):
         return f"{self.patient_id} | {self.workflow_name} | {self.created_at: %Y-%m-%d %H:%M:%S}"
 
 
+class SpearJobLogChunkManager(models.Manager):
+    """Manager with the append/read helpers for the job log chunks."""
+
+    # concurrent appenders may race for the same sequence numbers
+    APPEND_MAX_RETRIES = 5
+
+    def append(self, *, job_id: int, entries: list[str]) -> list["SpearJobLogChunk"]:
+        """Insert log entries for a job without touching the SpearJob row."""
+        return self.append_many({job_id: entries})
+
+    def append_many(
+        self, entries_by_job: dict[int, list[str]]
+    ) -> list["SpearJobLogChunk"]:
+        """Insert log entries for several jobs with a single INSERT.
+
+        The next sequence numbers are read from the (job, sequence) unique index,
+        so the cost of an append does not depend on how much was logged before.
+        If a concurrent append claimed the same numbers, the unique constraint
+        rejects the insert and we retry with fresh numbers."""
+        entries_by_job = {
+            job_id: [entry for entry in entries if entry]
+            for job_id, entries in entries_by_job.items()
+        }
+        entries_by_job = {
+            job_id: entries for job_id, entries in entries_by_job.items() if entries
+        }
+        if not entries_by_job:
+            return []
+
+        for attempt in range(self.APPEND_MAX_RETRIES):
+            last_sequences = dict(
+                self.filter(job_id__in=entries_by_job)
+                .values("job_id")
+                .annotate(last=models.Max("sequence"))
+                .values_list("job_id", "last")
+            )
+            chunks = []
+            for job_id, entries in entries_by_job.items():
+                start = last_sequences.get(job_id, -1) + 1
+                chunks += [
+                    self.model(job_id=job_id, sequence=start + i, text=entry)
+                    for i, entry in enumerate(entries)
+                ]
+            try:
+                with transaction.atomic():
+                    chunks = self.bulk_create(chunks)
+            except IntegrityError:
+                if attempt == self.APPEND_MAX_RETRIES - 1:
+                    raise
+                continue
+            publish_job_events(
+                [log_event(c.job_id, c.sequence, c.text) for c in chunks]
+            )
+            return chunks
+
+        return []
+
+    def iter_text(self, *, job_id: int, after_sequence: int | None = None):
+        """Stream the log texts of a job in sequence order."""
+        queryset = self.filter(job_id=job_id)
+        if after_sequence is not None:
+            queryset = queryset.filter(sequence__gt=after_sequence)
+        return (
+            queryset.order_by("sequence")
+            .values_list("text", flat=True)
+            .iterator(chunk_size=2000)
+        )
+
+
+class SpearJobLogChunk(models.Model):
+    """Append-only log entry of a Spear job.
+
+    Log entries are inserted as separate rows instead of being concatenated
+    into SpearJob.logs, so appending never rewrites the (growing) job row.
+    The sequence number is per job and defines the order of the entries.
+    """
+
+    job = models.ForeignKey(
+        SpearJob,
+        on_delete=models.CASCADE,
+        related_name="log_chunks",
+    )
+    sequence = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    text = models.TextField()
+
+    objects = SpearJobLogChunkManager()
+
+    class Meta:
+        ordering = ["job", "sequence"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["job", "sequence"], name="unique_spearjob_log_sequence"
+            )
+        ]
+        verbose_name = "Spear Job Log Chunk"
+        verbose_name_plural = "Spear Job Log Chunks"
+
+    def __str__(self):
+        return f"{self.job_id} #{self.sequence}"
+
+
 class SpearWorkflowTemplate(models.Model):
     """Model representing a Spear workflow template."""
 
@@ -114,3 +543,106 @@ class SpearWorkflowTemplate(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class SpearJobStatsSnapshot(models.Model):
+    """Periodically refreshed summary of the job queue statistics.
+
+    The statistics aggregate over the whole job table, so they are computed
+    in the background (or at most once per max age) and served from here."""
+
+    computed_at = models.DateTimeField()
+    data = models.JSONField()
+
+    class Meta:
+        verbose_name = "Spear Job Stats Snapshot"
+        verbose_name_plural = "Spear Job Stats Snapshots"
+
+    def __str__(self):
+        return f"Job stats at {self.computed_at: %Y-%m-%d %H:%M:%S}"
+
+
+class SpearJobArchiveQuerySet(models.QuerySet):
+    def with_config(self):
+        return self.select_related("raystation_system", "config_blob")
+
+
+class SpearJobArchive(models.Model):
+    """A finished Spear job moved out of the SpearJob table.
+
+    The archiver (spear_job_api.archive) moves old COMPLETED, FAILED and
+    REVOKED jobs here, keeping their id and celery_job_id. The log chunks of
+    the job are joined into one text, zlib-compressed if log_compressed."""
+
+    id = models.BigIntegerField(primary_key=True)
+    patient_id = models.CharField(max_length=100)
+    created_at = models.DateTimeField()
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True, editable=False)
+    status = models.CharField(max_length=20, choices=SpearJobStatus.choices)
+    celery_job_id = models.CharField(max_length=36, unique=True)
+    worker_name = models.CharField(max_length=100, null=True, blank=True)
+    server_name = models.CharField(
+        max_length=100, null=True, blank=True, choices=SpearServer.choices
+    )
+    workflow_name = models.CharField(max_length=200, null=True, blank=True)
+    config_blob = models.ForeignKey(
+        SpearWorkflowConfig,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    config_overrides = models.JSONField(null=True, blank=True)
+    raystation_system = models.ForeignKey(
+        RayStationSystem, on_delete=models.CASCADE, related_name="archived_jobs"
+    )
+    priority = models.SmallIntegerField(default=5)
+    # job graphs are archived with their steps
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="steps",
+    )
+    step_name = models.CharField(max_length=200, blank=True, default="")
+    log_data = models.BinaryField(null=True, blank=True)
+    log_compressed = models.BooleanField(default=False)
+
+    objects = SpearJobArchiveQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_at", "id"], name="spearjobarchive_created_idx"
+            ),
+        ]
+        verbose_name = "Archived Spear Job"
+        verbose_name_plural = "Archived Spear Jobs"
+
+    @property
+    def workflow_config(self) -> Any:
+        if self.config_blob_id is None:
+            return None
+        return self.config_blob.expand(self.config_overrides)
+
+    def get_logs(self) -> str | None:
+        if self.log_data is None:
+            return None
+        data = bytes(self.log_data)
+        if self.log_compressed:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    async def aget_logs(self) -> str | None:
+        return self.get_logs()
+
+    def iter_logs(self):
+        logs = self.get_logs()
+        if logs is not None:
+            yield logs
+
+    def __str__(self):
+        return f"{self.patient_id} | {self.workflow_name} | {self.created_at: %Y-%m-%d %H:%M:%S}"
@@ -0,0 +1,91 @@
+"""Pagination classes for the spear jobs API."""
+
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class SpearJobKeysetPagination(BasePagination):
+    """Keyset (seek) pagination on (created_at, id), newest jobs first.
+
+    The cursor is the (created_at, id) of the last job of the previous page,
+    so fetching a page is an index range scan whatever its depth, and jobs
+    created in the meantime do not shift the following pages."""
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        queryset = queryset.order_by("-created_at", "-id")
+        if cursor is not None:
+            created_at, pk = cursor
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+
+        # fetch one extra row to know if there is a next page
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = (
+                base64.urlsafe_b64decode(encoded.encode("ascii"))
+                .decode("ascii")
+                .split("|")
+            )
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def encode_cursor(self, job):
+        position = f"{job.created_at.isoformat()}|{job.pk}"
+        return base64.urlsafe_b64encode(position.encode("ascii")).decode("ascii")
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
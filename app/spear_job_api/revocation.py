@@ -0,0 +1,73 @@
+"""Revocation of the Celery tasks of revoked spear jobs.
+
+Setting a job REVOKED does not stop its task. revoke_tasks therefore
+
+- adds the task ids to the revoked-id set in Redis: one key per id
+  (revoked_key) expiring after SPEAR_JOB_REVOKED_TTL seconds. The workers
+  check it in their task_prerun, one EXISTS and no database query, and drop
+  a revoked task that was still queued, also when the worker was not
+  running at the time of the broadcast;
+- broadcasts a Celery revoke, the running workers discard the messages of
+  the tasks and, with terminate, kill a task that already runs.
+
+Both are best effort, an unreachable Redis or broker does not fail the
+revocation of the jobs. The key prefix is shared with the worker
+(celery_worker/spear_queue/revocation.py).
+"""
+
+import logging
+import redis
+from celery import current_app
+from django.conf import settings
+from kombu.exceptions import OperationalError
+
+logger = logging.getLogger(__name__)
+
+REVOKED_PREFIX = "spear_jobs.revoked."
+
+
+def revoked_key(celery_job_id: str) -> str:
+    return f"{REVOKED_PREFIX}{celery_job_id}"
+
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.SPEAR_JOB_REVOKED_URL, socket_connect_timeout=1, socket_timeout=1
+        )
+    return _client
+
+
+def _add_revoked(celery_job_ids: list[str]) -> None:
+    try:
+        pipeline = _redis().pipeline(transaction=False)
+        for celery_job_id in celery_job_ids:
+            pipeline.set(
+                revoked_key(celery_job_id), 1, ex=settings.SPEAR_JOB_REVOKED_TTL
+            )
+        pipeline.execute()
+    except redis.RedisError as exc:
+        logger.warning(
+            f"Could not add {len(celery_job_ids)} revoked spear jobs to Redis: {exc}"
+        )
+
+
+def revoke_tasks(celery_job_ids, *, terminate: bool = False) -> None:
+    """Revoke the Celery tasks of jobs, terminating them if they run and
+    `terminate` is set. Call it once the jobs are REVOKED in the database,
+    e.g. from transaction.on_commit."""
+    celery_job_ids = [str(celery_job_id) for celery_job_id in celery_job_ids]
+    if not celery_job_ids:
+        return
+    if settings.SPEAR_JOB_REVOKED_URL:
+        _add_revoked(celery_job_ids)
+    try:
+        current_app.control.revoke(celery_job_ids, terminate=terminate)
+    except OperationalError as exc:
+        logger.warning(
+            f"Could not broadcast the revoke of {len(celery_job_ids)} tasks: {exc}"
+        )
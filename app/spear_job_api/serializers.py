@@ -2,6 +2,8 @@
 
 from rest_framework import serializers
 from . import models
+from .transitions import CELERY_STATES
+from .workflows import workflow_registry
 
 
 class SpearJobCreateSerializer(serializers.ModelSerializer):
@@ -13,6 +15,8 @@ class SpearJobCreateSerializer(serializers.ModelSerializer):
         write_only=True,
     )
     celery_job_id = serializers.UUIDField()
+    # a property of SpearJob, stored as a config blob and overrides
+    workflow_config = serializers.JSONField(required=False, allow_null=True)
 
     class Meta:
         model = models.SpearJob
@@ -26,6 +30,35 @@ class SpearJobCreateSerializer(serializers.ModelSerializer):
             "status",
         ]
 
+    def validate(self, attrs):
+        # jobs submitted without a config get the default of their workflow
+        if attrs.get("workflow_config") is None and attrs.get("workflow_name"):
+            try:
+                attrs["workflow_config"] = workflow_registry.get_config(
+                    attrs["workflow_name"]
+                )
+            except FileNotFoundError:
+                pass
+        return attrs
+
+
+class SpearJobBulkCreateSerializer(SpearJobCreateSerializer):
+    """Serializer for creating many SpearJobs at once.
+
+    The RayStation systems are looked up once for the whole batch by the
+    caller and passed in the "raystation_systems" context (name -> instance)
+    instead of one query per item."""
+
+    raystation_system = serializers.CharField(max_length=100, write_only=True)
+
+    def validate_raystation_system(self, value):
+        try:
+            return self.context["raystation_systems"][value]
+        except KeyError:
+            raise serializers.ValidationError(
+                f"Object with system_name={value} does not exist."
+            )
+
 
 class SpearJobDetailSerializer(serializers.ModelSerializer):
     """Serializer for retrieving a SpearJob."""
@@ -40,6 +73,9 @@ class SpearJobDetailSerializer(serializers.ModelSerializer):
         slug_field="system_uid",
         read_only=True,
     )
+    logs = serializers.SerializerMethodField()
+    # expanded from the config blob and overrides of the job
+    workflow_config = serializers.JSONField(read_only=True)
 
     class Meta:
         model = models.SpearJob
@@ -60,13 +96,71 @@ class SpearJobDetailSerializer(serializers.ModelSerializer):
             "raystation_system_name",
             "raystation_system_uid",
             "priority",
+            "parent",
+            "step_name",
         ]
         read_only_fields = fields
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the fields to render, see parse_fields
+        fields = self.context.get("fields")
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, params) -> list[str] | None:
+        """The fields of the ?fields= query parameter, None for all. Raises
+        serializers.ValidationError on unknown fields."""
+        if not params.get("fields"):
+            return None
+        fields = params["fields"].split(",")
+        unknown = set(fields) - set(cls.Meta.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {"fields": f"Unknown fields {sorted(unknown)}."}
+            )
+        return fields
+
+    def get_logs(self, obj) -> str | None:
+        # the async views read the log beforehand, serializers run sync
+        if "logs" in self.context:
+            return self.context["logs"]
+        return obj.get_logs()
+
+
+class SpearJobListSerializer(SpearJobDetailSerializer):
+    """Lightweight serializer for listing SpearJobs, without the logs and
+    the workflow config."""
+
+    logs = None
+    workflow_config = None
+
+    class Meta(SpearJobDetailSerializer.Meta):
+        fields = [
+            field
+            for field in SpearJobDetailSerializer.Meta.fields
+            if field not in ("logs", "workflow_config")
+        ]
+        read_only_fields = fields
+
+
+class SpearJobStatusField(serializers.ChoiceField):
+    """A job status, or a Celery task state mapped to one (see
+    spear_job_api.transitions.CELERY_STATES)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(choices=models.SpearJobStatus.choices, **kwargs)
+
+    def to_internal_value(self, data):
+        return super().to_internal_value(CELERY_STATES.get(data, data))
+
 
 class SpearJobUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating a SpearJob."""
 
+    status = SpearJobStatusField(required=False)
     append_log = serializers.CharField(
         write_only=True,
         required=False,
@@ -87,34 +181,122 @@ class SpearJobUpdateSerializer(serializers.ModelSerializer):
             "completed_at",
             "latest_heartbeat",
             "worker_name",
-            "logs",
             "append_log",
             "append_logs",
+            "version",
         ]
-        read_only_fields = ["logs"]
+        read_only_fields = ["version"]
 
-    def update(self, instance, validated_data):
-        """Update a SpearJob, appending logs if provided."""
+    @staticmethod
+    def pop_log_entries(validated_data: dict) -> list[str]:
+        """Remove append_log and append_logs from the validated data and
+        return the log entries to append."""
+        entries = []
         append_log = validated_data.pop("append_log", None)
         append_logs = validated_data.pop("append_logs", None)
-
-        # Append single log entry if provided
         if append_log:
-            if instance.logs:
-                instance.logs += f"\n{append_log}"
-            else:
-                instance.logs = append_log
-
-        # Append multiple log entries if provided
+            entries.append(append_log)
         if append_logs:
-            for log_entry in append_logs:
-                if instance.logs:
-                    instance.logs += f"\n{log_entry}"
-                else:
-                    instance.logs = log_entry
+            entries.extend(append_logs)
+        return entries
+
+    def update(self, instance, validated_data):
+        """Update a SpearJob, appending logs if provided.
 
-        for k, v in validated_data.items():
-            setattr(instance, k, v)
-        instance.save()
+        Log entries are stored as SpearJobLogChunk rows, the SpearJob row is
+        only saved when one of its own fields changes."""
+        entries = self.pop_log_entries(validated_data)
+        if entries:
+            models.SpearJobLogChunk.objects.append(job_id=instance.pk, entries=entries)
 
+        if not validated_data:
+            return instance
         return super().update(instance, validated_data)
+
+
+class SpearJobBulkUpdateItemSerializer(serializers.Serializer):
+    """Serializer for one item of a bulk SpearJob update."""
+
+    celery_job_id = serializers.CharField(max_length=36)
+    status = SpearJobStatusField(required=False)
+    started_at = serializers.DateTimeField(required=False, allow_null=True)
+    completed_at = serializers.DateTimeField(required=False, allow_null=True)
+    latest_heartbeat = serializers.DateTimeField(required=False, allow_null=True)
+    worker_name = serializers.CharField(
+        max_length=100, required=False, allow_null=True, allow_blank=True
+    )
+    append_log = serializers.CharField(required=False)
+    append_logs = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+    )
+
+
+class SpearJobHeartbeatSerializer(serializers.Serializer):
+    """Serializer for a heartbeat of a SpearJob."""
+
+    latest_heartbeat = serializers.DateTimeField(
+        required=False,
+        help_text="Time of the heartbeat, the server time if omitted.",
+    )
+
+
+class SpearJobBatchHeartbeatSerializer(SpearJobHeartbeatSerializer):
+    """Serializer for a heartbeat of many SpearJobs."""
+
+    celery_job_ids = serializers.ListField(
+        child=serializers.CharField(max_length=36),
+        allow_empty=False,
+        max_length=1000,
+    )
+
+
+class SpearJobAppendLogSerializer(serializers.Serializer):
+    """Serializer for appending log entries to a SpearJob."""
+
+    append_log = serializers.CharField(
+        required=False,
+        help_text="A single log entry to append to the existing logs.",
+    )
+    append_logs = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+        help_text="A list of log entries to append to the existing logs.",
+    )
+
+    def validate(self, attrs):
+        entries = []
+        if attrs.get("append_log"):
+            entries.append(attrs["append_log"])
+        entries.extend(attrs.get("append_logs", []))
+        if not entries:
+            raise serializers.ValidationError(
+                "Provide append_log or append_logs with at least one entry."
+            )
+        return {"entries": entries}
+
+
+class SpearJobRevokeSerializer(serializers.Serializer):
+    """Serializer for revoking a SpearJob."""
+
+    terminate = serializers.BooleanField(
+        default=False,
+        help_text="Kill the task if it already runs, else it runs to its end.",
+    )
+
+
+class SpearJobBulkRevokeSerializer(SpearJobRevokeSerializer):
+    """Serializer for selecting the SpearJobs to revoke at once."""
+
+    patient_id = serializers.CharField(required=False)
+    raystation_system = serializers.CharField(required=False)
+    celery_job_ids = serializers.ListField(
+        child=serializers.CharField(max_length=36), required=False, allow_empty=False
+    )
+
+    def validate(self, attrs):
+        if not attrs.keys() & {"patient_id", "raystation_system", "celery_job_ids"}:
+            raise serializers.ValidationError(
+                "Select the jobs by patient_id, raystation_system or celery_job_ids."
+            )
+        return attrs
@@ -1,9 +1,28 @@
-import json
-from importlib import resources
+from datetime import datetime
 from typing import Optional
+from asgiref.sync import sync_to_async
 from django.db import transaction
-from .serializers import SpearJobCreateSerializer, SpearJobUpdateSerializer
-from .models import SpearJob
+from django.db.models import Case, Count, F, Max, Min, Q, QuerySet, Value, When
+from django.utils import timezone
+from .serializers import (
+    SpearJobBulkCreateSerializer,
+    SpearJobBulkUpdateItemSerializer,
+    SpearJobCreateSerializer,
+    SpearJobUpdateSerializer,
+)
+from .events import publish_job_events, status_event
+from .metrics import observe_job_durations
+from .models import RayStationSystem, SpearJob, SpearJobLogChunk, SpearJobStatus
+from .revocation import revoke_tasks
+from .transitions import SpearJobTransitionError, allowed_from, can_transition
+from .workflows import workflow_registry
+
+# fields of SpearJob a bulk update item may set
+BULK_UPDATE_FIELDS = ["status", "started_at", "completed_at", "latest_heartbeat"]
+
+# reads and compare-and-set writes of an update before it gives up, see
+# update_spear_job_fields
+UPDATE_MAX_ATTEMPTS = 5
 
 
 @transaction.atomic
@@ -18,78 +37,516 @@ def create_spear_job(*, data: dict):
     return obj
 
 
+@transaction.atomic
+def bulk_create_spear_jobs(
+    *, data: list[dict], dedup_keys: Optional[list[str]] = None
+) -> list[SpearJob]:
+    """
+    Service layer function to create many SpearJobs in one transaction.
+    The RayStation systems are resolved with one query for all distinct names
+    and the jobs are inserted with a single bulk_create.
+    Raises serializers.ValidationError with a list of per-item errors if any
+    item is invalid, nothing is created in that case, and IntegrityError if
+    a dedup key (one per item) is taken by a waiting or running job.
+    """
+    names = {item.get("raystation_system") for item in data if isinstance(item, dict)}
+    raystation_systems = {
+        system.system_name: system
+        for system in RayStationSystem.objects.filter(system_name__in=names)
+    }
+    ser = SpearJobBulkCreateSerializer(
+        data=data, many=True, context={"raystation_systems": raystation_systems}
+    )
+    ser.is_valid(raise_exception=True)
+
+    jobs = []
+    for i, item in enumerate(ser.validated_data):
+        job = SpearJob(**item)
+        if dedup_keys is not None:
+            job.dedup_key = dedup_keys[i]
+        # bulk_create does not call SpearJob.save()
+        job.server_name = SpearJob.resolve_server_name(job.worker_name, job.server_name)
+        jobs.append(job)
+    return SpearJob.objects.bulk_create(jobs)
+
+
 @transaction.atomic
 def update_spear_job(
     *,
     spear_job_id: Optional[int] = None,
     celery_job_id: Optional[str] = None,
     data: dict,
+    expected_version: Optional[int] = None,
+    partial: bool = True,
 ):
     """
     Service layer function to update a SpearJob using SpearJobUpdateSerializer.
     Either spear_job_id or celery_job_id must be provided to identify the job.
-    Raises serializers.ValidationError on validation errors.
+    The job row is not locked: a status change is one conditional UPDATE
+    (see transition_spear_job), other fields are written with a
+    compare-and-set on its version (see update_spear_job_fields) and log
+    entries are appended as SpearJobLogChunk rows. With expected_version
+    (e.g. from an If-Match header) the job is only updated if it is still at
+    that version.
+    Raises serializers.ValidationError on validation errors,
+    SpearJobTransitionError if the status change is not allowed and
+    SpearJobConflict if the job is not at expected_version.
     """
-    if spear_job_id is None and celery_job_id is None:
-        raise ValueError("Provide either spear_job_id or celery_job_id.")
+    lookup = spear_job_lookup(spear_job_id=spear_job_id, celery_job_id=celery_job_id)
+    serializer = SpearJobUpdateSerializer(data=data, partial=partial)
+    serializer.is_valid(raise_exception=True)
+    changes = dict(serializer.validated_data)
+    entries = serializer.pop_log_entries(changes)
 
-    if spear_job_id is not None:
-        job = SpearJob.objects.select_for_update().get(pk=spear_job_id)
+    if "status" in changes and expected_version is None:
+        fields = dict(changes)
+        job = transition_spear_job(
+            lookup=lookup, status=fields.pop("status"), fields=fields
+        )
     else:
-        job = SpearJob.objects.select_for_update().get(celery_job_id=celery_job_id)
-
-    serializer = SpearJobUpdateSerializer(instance=job, data=data, partial=True)
-    serializer.is_valid(raise_exception=True)
-    job = serializer.save()
+        job = update_spear_job_fields(
+            lookup=lookup, changes=changes, expected_version=expected_version
+        )
+    if entries:
+        SpearJobLogChunk.objects.append(job_id=job.pk, entries=entries)
+    observe_job_durations(job, changes)
+    if job.parent_id and "status" in changes:
+        update_spear_job_graph_status(parent_ids=[job.parent_id])
     return job
 
 
-@transaction.atomic
-def revoke_spear_job(
+def spear_job_lookup(
     *, spear_job_id: Optional[int] = None, celery_job_id: Optional[str] = None
-):
+) -> dict:
+    """The filter selecting a job by spear_job_id or else celery_job_id."""
+    if spear_job_id is not None:
+        return {"pk": spear_job_id}
+    if celery_job_id is not None:
+        return {"celery_job_id": celery_job_id}
+    raise ValueError("Provide either spear_job_id or celery_job_id.")
+
+
+class SpearJobConflict(Exception):
+    """A SpearJob was changed by a concurrent update."""
+
+
+def update_spear_job_fields(
+    *, lookup: dict, changes: dict, expected_version: Optional[int] = None
+) -> SpearJob:
     """
-    Service layer function to revoke a SpearJob by setting its status to REVOKED.
-    Either spear_job_id or celery_job_id must be provided to identify the job.
-    Raises serializers.ValidationError on validation errors.
+    Set the fields in `changes` on the job selected by `lookup` with
+    optimistic concurrency: read the job, then write it with
+    SpearJob.compare_and_set. If a concurrent update (a heartbeat, another
+    status update) bumped the version in between, the job is read again and
+    the write retried, at most UPDATE_MAX_ATTEMPTS times.
+    Raises SpearJob.DoesNotExist, SpearJobTransitionError if the status
+    change is not allowed, and SpearJobConflict if the job is not at
+    expected_version or kept changing.
     """
-    if spear_job_id is None and celery_job_id is None:
-        raise ValueError("Provide either spear_job_id or celery_job_id.")
+    for _ in range(UPDATE_MAX_ATTEMPTS):
+        job = SpearJob.objects.get(**lookup)
+        if expected_version is not None and job.version != expected_version:
+            raise SpearJobConflict(
+                f"Spear job {job.pk} is at version {job.version}, "
+                f"not {expected_version}."
+            )
+        if "status" in changes and not can_transition(job.status, changes["status"]):
+            raise SpearJobTransitionError(job.pk, job.status, changes["status"])
+        for field, value in changes.items():
+            setattr(job, field, value)
+        if not changes or job.compare_and_set(changes):
+            return job
+    raise SpearJobConflict(
+        f"Spear job {job.pk} kept changing, gave up after "
+        f"{UPDATE_MAX_ATTEMPTS} attempts."
+    )
 
-    if spear_job_id is not None:
-        job = SpearJob.objects.select_for_update().get(pk=spear_job_id)
-    else:
-        job = SpearJob.objects.select_for_update().get(celery_job_id=celery_job_id)
 
-    job.status = "REVOKED"
-    job.save()
-    return job
+def transition_spear_jobs(
+    jobs: QuerySet,
+    *,
+    status: str,
+    fields: Optional[dict] = None,
+    allow_requeue: bool = False,
+) -> int:
+    """
+    Change the jobs of the queryset to `status`, setting `fields` too, with
+    one UPDATE ... WHERE status IN (...) of the statuses the life cycle
+    allows the change from (see spear_job_api.transitions, allow_requeue for
+    the internal requeue paths). Jobs at another status, `status` itself
+    included, are left unchanged. The status events are not published, only
+    the caller knows which jobs changed.
+    Returns the number of jobs changed.
+    """
+    return jobs.filter(
+        status__in=allowed_from(status, allow_requeue=allow_requeue)
+    ).update(status=status, version=F("version") + 1, **job_update_values(fields))
 
 
-def load_spear_workflow_config(filename: str | None) -> dict:
-    """Load Spear workflow configuration from a JSON file."""
-    if not filename:
-        raise FileNotFoundError("No filename provided for workflow configuration.")
-    filename = f"{filename}.json"
-    text = resources.read_text(
-        "spear_job_api.spear_workflows",
-        filename,
-        encoding="utf-8",
+def job_update_values(fields: Optional[dict]) -> dict:
+    """The values of an UPDATE setting `fields` of jobs, with the server_name
+    resolved from a worker_name (see SpearJob.save)."""
+    fields = dict(fields or {})
+    if "worker_name" in fields:
+        fields["server_name"] = SpearJob.server_name_expression(fields["worker_name"])
+    return fields
+
+
+def transition_spear_job(*, lookup: dict, status: str, fields: dict) -> SpearJob:
+    """
+    Change the status of the job selected by `lookup`, and set `fields`,
+    with one conditional UPDATE (see transition_spear_jobs), then read the
+    job back. An update repeating the status of the job only sets the fields.
+    Raises SpearJob.DoesNotExist, and SpearJobTransitionError if the life
+    cycle does not allow the change.
+    """
+    changed = transition_spear_jobs(
+        SpearJob.objects.filter(**lookup), status=status, fields=fields
+    )
+    job = SpearJob.objects.get(**lookup)
+    if changed:
+        publish_job_events([status_event(job.pk, status)])
+        return job
+    if job.status != status:
+        raise SpearJobTransitionError(job.pk, job.status, status)
+    return update_spear_job_fields(
+        lookup={"pk": job.pk}, changes=fields | {"status": status}
     )
-    return json.loads(text)
 
 
-def list_workflow_files() -> list[str]:
+@transaction.atomic
+def bulk_update_spear_jobs(*, items: list[dict]) -> list[dict]:
     """
-    Return a list of workflow config filenames (without .json extension)
-    stored under spear_job_api/spear_workflows/.
+    Service layer function to update many SpearJobs, identified by their
+    celery_job_id, in one transaction. No row is locked up front: the items
+    are grouped by the status they set and every group is applied with the
+    conditional UPDATEs of transition_spear_jobs, log entries are inserted
+    with one bulk insert. Items are validated one by one, so an invalid or
+    unknown item, or one with a status change the life cycle does not allow
+    (rejected, see spear_job_api.transitions), does not fail the others.
+    Several items of one job are applied in their order.
+    Returns one result per item, in the order of the items.
     """
-    pkg = resources.files("spear_job_api.spear_workflows")
+    results = []
+    valid_items = []
+    for item in items:
+        serializer = SpearJobBulkUpdateItemSerializer(data=item)
+        if serializer.is_valid():
+            valid_items.append((len(results), serializer.validated_data))
+            results.append(
+                {"celery_job_id": serializer.validated_data["celery_job_id"]}
+            )
+        else:
+            celery_job_id = (
+                item.get("celery_job_id") if isinstance(item, dict) else None
+            )
+            results.append(
+                {
+                    "celery_job_id": celery_job_id,
+                    "result": "invalid",
+                    "errors": serializer.errors,
+                }
+            )
+
+    # a round has one item per job at most, the items of a job are applied
+    # in their order
+    rounds = []
+    item_counts = {}
+    for index, data in valid_items:
+        round_number = item_counts.get(data["celery_job_id"], 0)
+        item_counts[data["celery_job_id"]] = round_number + 1
+        if round_number == len(rounds):
+            rounds.append([])
+        rounds[round_number].append((index, data))
+
+    parent_ids = set()
+    entries_by_job = {}
+    for round_items in rounds:
+        jobs = _apply_bulk_update_round([data for _, data in round_items])
+        for index, data in round_items:
+            job = jobs.get(data["celery_job_id"])
+            if job is None:
+                results[index]["result"] = "not_found"
+                continue
+            if "status" in data and job.status != data["status"]:
+                results[index]["result"] = "rejected"
+                results[index]["errors"] = {
+                    "status": [
+                        str(SpearJobTransitionError(job.pk, job.status, data["status"]))
+                    ]
+                }
+                continue
+            observe_job_durations(job, data)
+            if "status" in data and job.parent_id:
+                parent_ids.add(job.parent_id)
+            entries = entries_by_job.setdefault(job.pk, [])
+            if data.get("append_log"):
+                entries.append(data["append_log"])
+            entries.extend(data.get("append_logs", []))
+            results[index]["result"] = "updated"
 
-    workflow_files = [
-        path.stem  # 'workflow_a' instead of 'workflow_a.json'
-        for path in pkg.iterdir()
-        if path.suffix.lower() == ".json"
-    ]
+    update_spear_job_graph_status(parent_ids=parent_ids)
+    SpearJobLogChunk.objects.append_many(entries_by_job)
+    return results
+
+
+def _apply_bulk_update_round(items: list[dict]) -> dict[str, SpearJob]:
+    """Apply bulk update items of distinct jobs and read the jobs back, by
+    celery_job_id. The items are grouped by their status and worker_name,
+    the other fields are set per job with a CASE on the celery_job_id.
+    An item whose status is not allowed changes nothing: its job is read
+    back at another status."""
+    celery_job_ids = [data["celery_job_id"] for data in items]
+    statuses = dict(
+        SpearJob.objects.filter(celery_job_id__in=celery_job_ids).values_list(
+            "celery_job_id", "status"
+        )
+    )
+    groups = {}
+    for data in items:
+        if data["celery_job_id"] in statuses:
+            key = (data.get("status"), "worker_name" in data, data.get("worker_name"))
+            groups.setdefault(key, []).append(data)
+
+    transitioned = {}
+    for (status, has_worker_name, worker_name), group in groups.items():
+        fields = {
+            field: Case(
+                *(
+                    When(
+                        celery_job_id=data["celery_job_id"],
+                        then=Value(
+                            data[field], output_field=SpearJob._meta.get_field(field)
+                        ),
+                    )
+                    for data in group
+                    if field in data
+                ),
+                default=F(field),
+            )
+            for field in BULK_UPDATE_FIELDS
+            if field != "status" and any(field in data for data in group)
+        }
+        if has_worker_name:
+            fields["worker_name"] = worker_name
+        # repeating the current status only sets the fields, like
+        # transition_spear_job does
+        repeated = {
+            data["celery_job_id"]
+            for data in group
+            if status is None or statuses[data["celery_job_id"]] == status
+        }
+        if repeated and fields:
+            jobs = SpearJob.objects.filter(celery_job_id__in=repeated)
+            if status is not None:
+                jobs = jobs.filter(status=status)
+            values = job_update_values(fields)
+            if set(fields) != {"latest_heartbeat"}:
+                # a heartbeat alone does not bump the version, see
+                # record_spear_job_heartbeats
+                values["version"] = F("version") + 1
+            jobs.update(**values)
+        moving = [
+            data["celery_job_id"]
+            for data in group
+            if data["celery_job_id"] not in repeated
+        ]
+        if moving:
+            transition_spear_jobs(
+                SpearJob.objects.filter(celery_job_id__in=moving),
+                status=status,
+                fields=fields,
+            )
+            transitioned.update((celery_job_id, status) for celery_job_id in moving)
+
+    jobs = {
+        job.celery_job_id: job
+        for job in SpearJob.objects.defer("logs", "config_overrides").filter(
+            celery_job_id__in=statuses
+        )
+    }
+    # the UPDATEs changed the jobs now at their status, the others are
+    # rejected
+    publish_job_events(
+        [
+            status_event(jobs[celery_job_id].pk, status)
+            for celery_job_id, status in transitioned.items()
+            if jobs[celery_job_id].status == status
+        ]
+    )
+    return jobs
 
-    return sorted(workflow_files)
+
+def graph_status(counts: dict[str, int]) -> str:
+    """The status of a job graph from the number of its steps per status."""
+    total = sum(counts.values())
+    if counts.get(SpearJobStatus.FAILED):
+        return SpearJobStatus.FAILED
+    if counts.get(SpearJobStatus.COMPLETED) == total:
+        return SpearJobStatus.COMPLETED
+    if counts.get(SpearJobStatus.REVOKED):
+        return SpearJobStatus.REVOKED
+    if counts.get(SpearJobStatus.RUNNING) or counts.get(SpearJobStatus.COMPLETED):
+        return SpearJobStatus.RUNNING
+    if counts.get(SpearJobStatus.QUEUED):
+        return SpearJobStatus.QUEUED
+    return SpearJobStatus.PENDING
+
+
+@transaction.atomic
+def update_spear_job_graph_status(*, parent_ids) -> None:
+    """Derive the status, started_at and completed_at of job graphs (parent
+    jobs, see spear_queue.graphs) from their steps, with one aggregate query.
+
+    The parents are locked before the steps are counted: two steps finishing
+    in concurrent transactions would otherwise each count the other as still
+    running, and leave the parent RUNNING."""
+    parent_ids = set(parent_ids)
+    if not parent_ids:
+        return
+    # lock in primary key order so concurrent updates cannot deadlock
+    parents = list(
+        SpearJob.objects.select_for_update().filter(pk__in=parent_ids).order_by("pk")
+    )
+    counts, times = {}, {}
+    for row in (
+        SpearJob.objects.filter(parent_id__in=parent_ids)
+        .order_by()
+        .values("parent_id", "status")
+        .annotate(
+            count=Count("id"),
+            started_at=Min("started_at"),
+            completed_at=Max("completed_at"),
+        )
+    ):
+        counts.setdefault(row["parent_id"], {})[row["status"]] = row["count"]
+        started_at, completed_at = times.get(row["parent_id"], (None, None))
+        times[row["parent_id"]] = (
+            min(filter(None, [started_at, row["started_at"]]), default=None),
+            max(filter(None, [completed_at, row["completed_at"]]), default=None),
+        )
+
+    parents = [parent for parent in parents if parent.pk in counts]
+    for parent in parents:
+        parent.status = graph_status(counts[parent.pk])
+        parent.started_at, completed_at = times[parent.pk]
+        finished = parent.status in (SpearJobStatus.COMPLETED, SpearJobStatus.FAILED)
+        parent.completed_at = completed_at if finished else None
+    SpearJob.objects.bulk_update(parents, ["status", "started_at", "completed_at"])
+
+
+def record_spear_job_heartbeats(
+    *, celery_job_ids: list[str], latest_heartbeat: Optional[datetime] = None
+) -> int:
+    """
+    Service layer function to record a heartbeat for SpearJobs identified by
+    their celery_job_id. This is a single UPDATE of latest_heartbeat: no row
+    lock is taken up front, no serializer runs and SpearJob.save() is not
+    called, so heartbeats do not wait on log appends or status updates. The
+    version is not bumped, a heartbeat does not conflict with the
+    compare-and-set updates (see update_spear_job_fields).
+    Returns the number of jobs updated.
+    """
+    return SpearJob.objects.filter(celery_job_id__in=celery_job_ids).update(
+        latest_heartbeat=latest_heartbeat or timezone.now()
+    )
+
+
+async def arecord_spear_job_heartbeats(
+    *, celery_job_ids: list[str], latest_heartbeat: Optional[datetime] = None
+) -> int:
+    """Async version of record_spear_job_heartbeats."""
+    return await SpearJob.objects.filter(celery_job_id__in=celery_job_ids).aupdate(
+        latest_heartbeat=latest_heartbeat or timezone.now()
+    )
+
+
+async def aappend_spear_job_logs(*, celery_job_id: str, entries: list[str]) -> bool:
+    """
+    Service layer function to append log entries to a SpearJob identified by
+    its celery_job_id, for the async views. The append itself runs in a
+    transaction, which the async ORM does not support, so it is run through
+    sync_to_async. Returns False if the job does not exist.
+    """
+    job_id = await (
+        SpearJob.objects.filter(celery_job_id=celery_job_id)
+        .values_list("id", flat=True)
+        .afirst()
+    )
+    if job_id is None:
+        return False
+    await sync_to_async(SpearJobLogChunk.objects.append)(job_id=job_id, entries=entries)
+    return True
+
+
+@transaction.atomic
+def revoke_spear_job(
+    *,
+    spear_job_id: Optional[int] = None,
+    celery_job_id: Optional[str] = None,
+    terminate: bool = False,
+):
+    """
+    Service layer function to revoke a SpearJob, with its steps if it is a
+    job graph, and its Celery task (see revoke_spear_jobs).
+    Either spear_job_id or celery_job_id must be provided to identify the job.
+    Raises SpearJob.DoesNotExist, and SpearJobTransitionError if the job
+    already finished.
+    """
+    lookup = spear_job_lookup(spear_job_id=spear_job_id, celery_job_id=celery_job_id)
+    steps = {f"parent__{field}": value for field, value in lookup.items()}
+    revoke_spear_jobs(
+        jobs=SpearJob.objects.filter(Q(**lookup) | Q(**steps)), terminate=terminate
+    )
+    job = SpearJob.objects.get(**lookup)
+    if job.status != SpearJobStatus.REVOKED:
+        raise SpearJobTransitionError(job.pk, job.status, SpearJobStatus.REVOKED)
+    return job
+
+
+@transaction.atomic
+def revoke_spear_jobs(*, jobs: QuerySet, terminate: bool = False) -> list[str]:
+    """
+    Service layer function to revoke many SpearJobs at once, e.g. all jobs
+    of a patient or of a RayStation system. The jobs of the queryset that
+    did not finish are set REVOKED with one conditional UPDATE (see
+    transition_spear_jobs), no row is locked, and, once committed, the
+    Celery tasks of the jobs that UPDATE revoked are revoked with one
+    broadcast, terminated if they run and `terminate` is set (see
+    spear_job_api.revocation).
+    Returns the celery_job_ids of the revoked jobs.
+    """
+    pks = list(
+        jobs.filter(status__in=allowed_from(SpearJobStatus.REVOKED)).values_list(
+            "pk", flat=True
+        )
+    )
+    if not pks or not transition_spear_jobs(
+        SpearJob.objects.filter(pk__in=pks), status=SpearJobStatus.REVOKED
+    ):
+        return []
+    # the candidates now REVOKED, the others finished before the UPDATE
+    rows = list(
+        SpearJob.objects.filter(pk__in=pks, status=SpearJobStatus.REVOKED)
+        .order_by("pk")
+        .values_list("pk", "celery_job_id", "parent_id")
+    )
+    publish_job_events([status_event(pk, SpearJobStatus.REVOKED) for pk, _, _ in rows])
+    update_spear_job_graph_status(
+        parent_ids={parent_id for _, _, parent_id in rows if parent_id}
+    )
+    celery_job_ids = [celery_job_id for _, celery_job_id, _ in rows]
+    transaction.on_commit(lambda: revoke_tasks(celery_job_ids, terminate=terminate))
+    return celery_job_ids
+
+
+def load_spear_workflow_config(filename: str | None) -> dict:
+    """Return a copy of the config of a Spear workflow, see
+    workflows.workflow_registry. Raises FileNotFoundError for an unknown
+    workflow."""
+    return workflow_registry.get_config(filename)
+
+
+def list_workflow_files() -> list[str]:
+    """Return the sorted names of the Spear workflows."""
+    return workflow_registry.names()
@@ -0,0 +1,188 @@
+"""Queue statistics of the spear jobs, served from a summary table."""
+
+import datetime
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Aggregate, Count, DurationField, F, Min
+from django.utils import timezone
+from .models import SpearJob, SpearJobStatsSnapshot, SpearJobStatus
+
+# the summary table only ever holds this row
+SNAPSHOT_ID = 1
+
+
+def percentiles(values: list[float], *points: int) -> dict[str, float | None]:
+    """Return the nearest-rank percentiles of the values, e.g. {"p50": ...}."""
+    values = sorted(values)
+    result = {}
+    for point in points:
+        if not values:
+            result[f"p{point}"] = None
+            continue
+        rank = max(1, -(-point * len(values) // 100))  # ceil(point / 100 * n)
+        result[f"p{point}"] = values[rank - 1]
+    return result
+
+
+class PercentileDisc(Aggregate):
+    """Postgres' percentile_disc, the nearest-rank percentile of percentiles()."""
+
+    function = "percentile_disc"
+    template = "%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+
+    def __init__(self, expression, point: int, **extra):
+        super().__init__(expression, fraction=float(point) / 100, **extra)
+
+
+def duration_percentiles(jobs, durations: dict, *points: int) -> dict:
+    """Return the count and the percentiles of each duration over the jobs,
+    e.g. durations={"run_seconds": ("started_at", "completed_at")}.
+
+    On Postgres a single aggregate query computes them, other databases
+    (SQLite in development) stream the timestamps."""
+    if connection.vendor == "postgresql":
+        aggregates = {"count": Count("id")}
+        for name, (start, end) in durations.items():
+            for point in points:
+                aggregates[f"{name}_p{point}"] = PercentileDisc(
+                    F(end) - F(start), point, output_field=DurationField()
+                )
+        result = jobs.aggregate(**aggregates)
+        stats = {}
+        for name in durations:
+            stats[name] = {"count": result["count"]}
+            for point in points:
+                value = result[f"{name}_p{point}"]
+                stats[name][f"p{point}"] = (
+                    value.total_seconds() if value is not None else None
+                )
+        return stats
+
+    fields = sorted({field for pair in durations.values() for field in pair})
+    values = {name: [] for name in durations}
+    for row in jobs.values(*fields).iterator(chunk_size=5000):
+        for name, (start, end) in durations.items():
+            values[name].append((row[end] - row[start]).total_seconds())
+    return {
+        name: {"count": len(values[name]), **percentiles(values[name], *points)}
+        for name in durations
+    }
+
+
+def compute_job_stats(now: datetime.datetime | None = None) -> dict:
+    """Compute the queue statistics.
+
+    The counts per status, priority, server and RayStation system come from
+    a single GROUP BY over the four columns. The queue-wait and run duration
+    percentiles are computed by the database (one aggregate query) over the
+    jobs completed within the last SPEAR_JOB_STATS_WINDOW_HOURS, so their cost
+    is bounded by the recent throughput and not by the size of the table."""
+    now = now or timezone.now()
+    window = datetime.timedelta(
+        hours=getattr(settings, "SPEAR_JOB_STATS_WINDOW_HOURS", 24)
+    )
+
+    counts = defaultdict(lambda: defaultdict(int))
+    total = 0
+    groups = (
+        SpearJob.objects.values(
+            "status", "priority", "server_name", "raystation_system__system_name"
+        )
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    for group in groups:
+        total += group["count"]
+        counts["status"][group["status"]] += group["count"]
+        counts["priority"][str(group["priority"])] += group["count"]
+        counts["server_name"][group["server_name"] or ""] += group["count"]
+        counts["raystation_system"][group["raystation_system__system_name"]] += group[
+            "count"
+        ]
+
+    oldest_queued = SpearJob.objects.filter(status=SpearJobStatus.QUEUED).aggregate(
+        oldest=Min("created_at")
+    )["oldest"]
+
+    recent = SpearJob.objects.filter(
+        completed_at__gte=now - window, started_at__isnull=False
+    )
+    return {
+        "computed_at": now.isoformat(),
+        "total": total,
+        "counts": {
+            dimension: dict(counts[dimension])
+            for dimension in ["status", "priority", "server_name", "raystation_system"]
+        },
+        "oldest_queued_created_at": (
+            oldest_queued.isoformat() if oldest_queued else None
+        ),
+        "window_seconds": window.total_seconds(),
+        **duration_percentiles(
+            recent,
+            {
+                "queue_wait_seconds": ("created_at", "started_at"),
+                "run_seconds": ("started_at", "completed_at"),
+            },
+            50,
+            95,
+        ),
+    }
+
+
+def refresh_job_stats() -> SpearJobStatsSnapshot:
+    """Recompute the statistics and store them in the summary table."""
+    now = timezone.now()
+    snapshot, _ = SpearJobStatsSnapshot.objects.update_or_create(
+        id=SNAPSHOT_ID,
+        defaults={"computed_at": now, "data": compute_job_stats(now)},
+    )
+    return snapshot
+
+
+def claim_refresh(snapshot: SpearJobStatsSnapshot, now: datetime.datetime) -> bool:
+    """Claim the refresh of a stale snapshot: set its computed_at to now
+    unless another refresh changed it since it was read."""
+    return bool(
+        SpearJobStatsSnapshot.objects.filter(
+            id=SNAPSHOT_ID, computed_at=snapshot.computed_at
+        ).update(computed_at=now)
+    )
+
+
+def get_job_stats(max_age: float | None = None) -> dict:
+    """Return the stored statistics. The refresh_job_stats command keeps them
+    fresh; without it, a request finding them older than max_age seconds
+    (SPEAR_JOB_STATS_MAX_AGE by default) refreshes them. Only the request that
+    claims the snapshot (a compare-and-set of its computed_at) recomputes, the
+    concurrent ones serve the stale snapshot meanwhile. A refresh that fails
+    restores the computed_at it claimed. The age of the oldest
+    QUEUED job is relative to now, not to the snapshot."""
+    if max_age is None:
+        max_age = getattr(settings, "SPEAR_JOB_STATS_MAX_AGE", 10)
+    now = timezone.now()
+    snapshot = SpearJobStatsSnapshot.objects.filter(id=SNAPSHOT_ID).first()
+    if snapshot is None:
+        snapshot = refresh_job_stats()
+    elif (now - snapshot.computed_at).total_seconds() > max_age and claim_refresh(
+        snapshot, now
+    ):
+        try:
+            with transaction.atomic():
+                snapshot = refresh_job_stats()
+        except Exception:
+            # give the claim back, the next request retries the refresh
+            SpearJobStatsSnapshot.objects.filter(
+                id=SNAPSHOT_ID, computed_at=now
+            ).update(computed_at=snapshot.computed_at)
+            raise
+
+    data = dict(snapshot.data)
+    oldest_queued = data.pop("oldest_queued_created_at")
+    data["oldest_queued_age_seconds"] = (
+        (now - datetime.datetime.fromisoformat(oldest_queued)).total_seconds()
+        if oldest_queued
+        else None
+    )
+    return data
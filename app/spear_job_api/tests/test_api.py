@@ -1,3 +1,5 @@
+import tempfile
+from pathlib import Path
 from unittest.mock import patch, MagicMock
 from django.contrib.auth import get_user_model
 from django.urls import reverse
@@ -7,6 +9,8 @@ from rest_framework import status
 from rest_framework.test import APIClient
 from spear_job_api import models
 from spear_job_api.serializers import SpearJobCreateSerializer, SpearJobDetailSerializer
+from spear_job_api.services import record_spear_job_heartbeats
+from spear_job_api.workflows import WorkflowRegistry
 from django.utils import timezone
 import pytz
 import datetime
@@ -14,6 +18,12 @@ import datetime
 SPEAR_JOB_URL = reverse("spear_job_api:spearjob-list")
 # /api/spear-jobs/
 SPEAR_WORKFLOW_URL = reverse("spear_job_api:spearworkflow-list")
+SPEAR_JOB_BULK_UPDATE_URL = reverse("spear_job_api:spearjob-bulk-update")
+# /api/spear-jobs/bulk-update/
+SPEAR_JOB_STATS_URL = reverse("spear_job_api:spearjob-stats")
+# /api/spear-jobs/stats/
+SPEAR_JOB_HEARTBEAT_URL = reverse("spear_job_api:spearjob-heartbeat")
+# /api/spear-jobs/heartbeat/
 
 
 def spear_job_detail_url(spear_job_id: str):
@@ -28,6 +38,20 @@ def celery_job_id_url(celery_job_id: str):
     return reverse("spear_job_api:spearjob-by-celery-job-id", args=[celery_job_id])
 
 
+def celery_job_id_heartbeat_url(celery_job_id: str):
+    """Create and return a spear job heartbeat URL by celery job id."""
+    # /api/spear-jobs/by-celery/{celery_job_id}/heartbeat/
+    return reverse(
+        "spear_job_api:spearjob-heartbeat-by-celery-job-id", args=[celery_job_id]
+    )
+
+
+def spear_job_logs_url(spear_job_id: str):
+    """Create and return a spear job logs URL."""
+    # /api/spear-jobs/{spear_job_id}/logs/
+    return reverse("spear_job_api:spearjob-logs", args=[spear_job_id])
+
+
 def spear_workflow_detail_url(workflow_name: str):
     """Create and return a spear workflow detail URL."""
     # /api/spear-workflows/{workflow_name}/
@@ -130,6 +154,67 @@ class SpearJobApiTests(APITestCase):
         res = self.client.get(url)
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_partial_update_spear_job_by_celery_job_id(self):
+        """Test updating a spear job with patch on its celery job id"""
+        spear_job = create_spear_job(
+            patient_id="patient_009",
+            celery_job_id="d6ff3ae9-9cbe-4c77-1910-28bb22a3a1b8",
+            raystation_system=self.raystation_system,
+        )
+        url = celery_job_id_url(celery_job_id=spear_job.celery_job_id)
+        payload = {
+            "status": "RUNNING",
+            "worker_name": "worker_sp2",
+            "append_logs": ["Job started."],
+        }
+        res = self.client.patch(url, payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        spear_job.refresh_from_db()
+        self.assertEqual(spear_job.status, "RUNNING")
+        self.assertEqual(spear_job.server_name, "HPTC-RAY-SP02")
+        self.assertEqual(spear_job.get_logs(), "Job started.")
+
+        url = celery_job_id_url(celery_job_id="3b7cd972-f5cf-4f12-9705-6b78de3236b4")
+        res = self.client.patch(url, payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_partial_update_spear_job_if_match(self):
+        """Test an update with If-Match only applies to the current version"""
+        spear_job = create_spear_job(
+            patient_id="patient_010",
+            celery_job_id="e1ff3ae9-9cbe-4c77-1910-28bb22a3a1b9",
+            raystation_system=self.raystation_system,
+        )
+        url = spear_job_detail_url(spear_job_id=spear_job.id)
+        etag = self.client.get(url)["ETag"]
+        # a heartbeat changes the representation, not the version
+        record_spear_job_heartbeats(celery_job_ids=[spear_job.celery_job_id])
+        self.assertNotEqual(self.client.get(url)["ETag"], etag)
+
+        res = self.client.patch(
+            url, {"status": "QUEUED"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["version"], spear_job.version + 1)
+
+        # the job changed since the ETag was read
+        res = self.client.patch(
+            url, {"status": "RUNNING"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        res = self.client.patch(
+            celery_job_id_url(celery_job_id=spear_job.celery_job_id),
+            {"status": "RUNNING"},
+            format="json",
+            HTTP_IF_MATCH=f'"{spear_job.version + 1}"',
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        spear_job.refresh_from_db()
+        self.assertEqual(spear_job.status, "RUNNING")
+
+        res = self.client.patch(url, {}, format="json", HTTP_IF_MATCH="not-an-etag")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_partial_update_spear_job_prerun(self):
         """Test updating a spear job data with patch, changing status to RUNNING"""
         spear_job = create_spear_job(
@@ -159,7 +244,7 @@ class SpearJobApiTests(APITestCase):
         )
         self.assertEqual(spear_job.worker_name, "worker_sp1")
         self.assertEqual(spear_job.server_name, "HPTC-RAY-SP01")
-        self.assertEqual(spear_job.logs, "Job started.")
+        self.assertEqual(spear_job.get_logs(), "Job started.")
 
     def test_partial_update_spear_job_postrun_success(self):
         """Test updating a spear job data with patch, changing status to COMPLETED"""
@@ -187,7 +272,7 @@ class SpearJobApiTests(APITestCase):
             spear_job.completed_at,
             datetime.datetime(2023, 11, 11, 0, 0, 0, tzinfo=pytz.utc),
         )
-        self.assertEqual(spear_job.logs, "job completed successfully.")
+        self.assertEqual(spear_job.get_logs(), "job completed successfully.")
 
     def test_partial_update_spear_job_postrun(self):
         """Test updating a spear job data with patch, changing status to FAILURE"""
@@ -215,7 +300,7 @@ class SpearJobApiTests(APITestCase):
             spear_job.completed_at,
             datetime.datetime(2023, 12, 13, 0, 0, 0, tzinfo=pytz.utc),
         )
-        self.assertEqual(spear_job.logs, "log\njob failed.")
+        self.assertEqual(spear_job.get_logs(), "log\njob failed.")
 
     def test_partial_update_spear_job_append_logs(self):
         """Test updating a spear job data with patch,with append_logs or append_log"""
@@ -234,7 +319,7 @@ class SpearJobApiTests(APITestCase):
         res1 = self.client.patch(url, payload1)
         self.assertEqual(res1.status_code, status.HTTP_200_OK)
         spear_job.refresh_from_db()
-        self.assertEqual(spear_job.logs, "First log entry.")
+        self.assertEqual(spear_job.get_logs(), "First log entry.")
 
         payload2 = {
             "append_logs": ["Second log entry.", "Third log entry."],
@@ -243,7 +328,8 @@ class SpearJobApiTests(APITestCase):
         self.assertEqual(res2.status_code, status.HTTP_200_OK)
         spear_job.refresh_from_db()
         self.assertEqual(
-            spear_job.logs, "First log entry.\nSecond log entry.\nThird log entry."
+            spear_job.get_logs(),
+            "First log entry.\nSecond log entry.\nThird log entry.",
         )
 
         payload3 = {
@@ -253,10 +339,112 @@ class SpearJobApiTests(APITestCase):
         self.assertEqual(res3.status_code, status.HTTP_200_OK)
         spear_job.refresh_from_db()
         self.assertEqual(
-            spear_job.logs,
+            spear_job.get_logs(),
             "First log entry.\nSecond log entry.\nThird log entry.\nFourth log entry.",
         )
 
+    def test_stream_spear_job_logs(self):
+        """Test streaming the log of a spear job, optionally after a sequence"""
+        spear_job = create_spear_job(
+            patient_id="patient_008",
+            celery_job_id="c5ff3ae9-9cbe-4c77-1910-28bb22a3a1b7",
+            raystation_system=self.raystation_system,
+        )
+        models.SpearJobLogChunk.objects.append(
+            job_id=spear_job.id, entries=["line 1", "line 2", "line 3"]
+        )
+        url = spear_job_logs_url(spear_job_id=spear_job.id)
+
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(res.streaming_content), b"line 1\nline 2\nline 3\n")
+
+        res = self.client.get(url, {"after": 0})
+        self.assertEqual(b"".join(res.streaming_content), b"line 2\nline 3\n")
+
+        res = self.client.get(url, {"after": "x"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_spear_jobs(self):
+        """Test updating several spear jobs with one request"""
+        spear_job = create_spear_job(
+            patient_id="patient_012",
+            celery_job_id="e7ff3ae9-9cbe-4c77-1910-28bb22a3a1b9",
+            raystation_system=self.raystation_system,
+        )
+        payload = [
+            {
+                "celery_job_id": spear_job.celery_job_id,
+                "status": "COMPLETED",
+                "append_logs": ["job completed successfully."],
+            },
+            {"celery_job_id": "3b7cd972-f5cf-4f12-9705-6b78de3236b4"},
+        ]
+        res = self.client.post(SPEAR_JOB_BULK_UPDATE_URL, payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item["result"] for item in res.data], ["updated", "not_found"]
+        )
+        spear_job.refresh_from_db()
+        self.assertEqual(spear_job.status, "COMPLETED")
+        self.assertEqual(spear_job.get_logs(), "job completed successfully.")
+
+        res = self.client.post(SPEAR_JOB_BULK_UPDATE_URL, {}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_spear_job_heartbeat(self):
+        """Test recording heartbeats for one and for many spear jobs"""
+        spear_jobs = [
+            create_spear_job(
+                patient_id="patient_016",
+                celery_job_id=f"0aff3ae9-9cbe-4c77-1910-28bb22a3a1c{i}",
+                raystation_system=self.raystation_system,
+                status="RUNNING",
+            )
+            for i in range(2)
+        ]
+        heartbeat = datetime.datetime(2024, 5, 1, 0, 0, 0, tzinfo=pytz.utc)
+
+        url = celery_job_id_heartbeat_url(spear_jobs[0].celery_job_id)
+        res = self.client.post(url, {"latest_heartbeat": heartbeat.isoformat()})
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        spear_jobs[0].refresh_from_db()
+        self.assertEqual(spear_jobs[0].latest_heartbeat, heartbeat)
+
+        res = self.client.post(
+            SPEAR_JOB_HEARTBEAT_URL,
+            {"celery_job_ids": [job.celery_job_id for job in spear_jobs]},
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {"updated": 2})
+        for spear_job in spear_jobs:
+            spear_job.refresh_from_db()
+            self.assertGreater(spear_job.latest_heartbeat, heartbeat)
+
+        url = celery_job_id_heartbeat_url("3b7cd972-f5cf-4f12-9705-6b78de3236b4")
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.post(SPEAR_JOB_HEARTBEAT_URL, {}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_spear_job_stats(self):
+        """Test the queue statistics endpoint"""
+        create_spear_job(
+            patient_id="patient_015",
+            celery_job_id="f9ff3ae9-9cbe-4c77-1910-28bb22a3a1c2",
+            raystation_system=self.raystation_system,
+            status="QUEUED",
+        )
+        res = self.client.get(SPEAR_JOB_STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["total"], 1)
+        self.assertEqual(res.data["counts"]["status"], {"QUEUED": 1})
+        self.assertEqual(
+            res.data["counts"]["raystation_system"], {"TestRayStationSystem": 1}
+        )
+        self.assertIsNotNone(res.data["oldest_queued_age_seconds"])
+        self.assertEqual(res.data["queue_wait_seconds"]["count"], 0)
+
     def test_list_jobs(self):
         # create a couple of jobs in the DB...
         spear_job1 = create_spear_job(
@@ -278,45 +466,114 @@ class SpearJobApiTests(APITestCase):
         url = reverse("spear_job_api:spearjob-list")
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
-        self.assertIsInstance(resp.data, list)
-        self.assertEqual(len(resp.data), 2)
+        self.assertIsInstance(resp.data["results"], list)
+        self.assertEqual(len(resp.data["results"]), 2)
+        self.assertIsNone(resp.data["next"])
+        self.assertNotIn("logs", resp.data["results"][0])
+        self.assertNotIn("workflow_config", resp.data["results"][0])
+
+    def test_list_jobs_keyset_pagination(self):
+        """Test listing jobs page by page, newest first"""
+        created = datetime.datetime(2024, 1, 1, 0, 0, 0, tzinfo=pytz.utc)
+        for i in range(5):
+            # two jobs share each created_at to exercise the id tie breaker
+            with patch(
+                "django.utils.timezone.now",
+                return_value=created + datetime.timedelta(minutes=i // 2),
+            ):
+                create_spear_job(
+                    patient_id=f"patient_{i}",
+                    celery_job_id=f"a4ff3ae9-9cbe-4c77-1910-28bb22a3a1{i:02d}",
+                    raystation_system=self.raystation_system,
+                )
+
+        patient_ids = []
+        url = SPEAR_JOB_URL + "?page_size=2"
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(resp.data["results"]), 2)
+            patient_ids += [job["patient_id"] for job in resp.data["results"]]
+            url = resp.data["next"]
+
+        self.assertEqual(patient_ids, [f"patient_{i}" for i in reversed(range(5))])
+
+        resp = self.client.get(SPEAR_JOB_URL, {"cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_jobs_filters(self):
+        """Test filtering the job list on query parameters"""
+        other_system = models.RayStationSystem.objects.create(
+            system_name="OtherRayStationSystem", system_uid="UID8888"
+        )
+        create_spear_job(
+            patient_id="patient_013",
+            priority=2,
+            celery_job_id="f8ff3ae9-9cbe-4c77-1910-28bb22a3a1c0",
+            workflow_name="hn_workflow",
+            raystation_system=self.raystation_system,
+            status="RUNNING",
+            worker_name="worker_sp1",
+        )
+        create_spear_job(
+            patient_id="patient_014",
+            priority=8,
+            celery_job_id="f8ff3ae9-9cbe-4c77-1910-28bb22a3a1c1",
+            workflow_name="other_workflow",
+            raystation_system=other_system,
+            status="QUEUED",
+        )
+
+        def listed(params):
+            resp = self.client.get(SPEAR_JOB_URL, params)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            return [job["patient_id"] for job in resp.data["results"]]
+
+        self.assertEqual(listed({"status": "RUNNING"}), ["patient_013"])
+        self.assertEqual(
+            listed({"status": "RUNNING,QUEUED"}), ["patient_014", "patient_013"]
+        )
+        self.assertEqual(listed({"priority": "8"}), ["patient_014"])
+        self.assertEqual(listed({"server_name": "HPTC-RAY-SP01"}), ["patient_013"])
+        self.assertEqual(
+            listed({"raystation_system": "OtherRayStationSystem"}), ["patient_014"]
+        )
+        self.assertEqual(listed({"workflow_name": "hn_workflow"}), ["patient_013"])
+        self.assertEqual(listed({"created_after": "2999-01-01T00:00:00Z"}), [])
+
+        resp = self.client.get(SPEAR_JOB_URL, {"created_after": "yesterday"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(SPEAR_JOB_URL, {"priority": "high"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class SpearWorkflowApiTests(APITestCase):
     """Test Spear Workflow API requests"""
 
-    @patch("spear_job_api.services.resources.files")
-    def test_list_spear_workflows_success(self, mock_files):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.workflow_dir = Path(tmp_dir.name)
+        (self.workflow_dir / "workflow_a.json").write_text(
+            '{"workflow_key1": "workflow_value1", "workflow_key2": 2}'
+        )
+        (self.workflow_dir / "workflow_b.json").write_text("{}")
+        (self.workflow_dir / "not_a_workflow.txt").write_text("ignored")
+        registry = WorkflowRegistry(directory=self.workflow_dir, check_interval=0)
+        patcher = patch("spear_job_api.views.workflow_registry", registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_list_spear_workflows_success(self):
         """Test listing available spear workflows"""
-        mock_path1 = MagicMock()
-        mock_path1.suffix = ".json"
-        mock_path1.stem = "workflow_1"
-        mock_path2 = MagicMock()
-        mock_path2.suffix = ".json"
-        mock_path2.stem = "workflow_2"
-        mock_path3 = MagicMock()
-        mock_path3.suffix = ".txt"  # should be ignored
-        mock_path3.stem = "not_a_workflow"
-
-        mock_files.return_value.iterdir.return_value = [
-            mock_path1,
-            mock_path2,
-            mock_path3,
-        ]
-
         url = reverse("spear_job_api:spearworkflow-list")
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(["workflow_1", "workflow_2"], res.data)
+        self.assertEqual(["workflow_a", "workflow_b"], res.data)
 
-    @patch("spear_job_api.services.resources.read_text")
-    def test_retrieve_spear_workflow_success(self, mock_read_text):
+    def test_retrieve_spear_workflow_success(self):
         """Test retrieving a spear workflow configuration successfully"""
-        mock_read_text.return_value = (
-            '{"workflow_key1": "workflow_value1", "workflow_key2": 2}'
-        )
-
         workflow_name = "workflow_a"
         url = spear_workflow_detail_url(workflow_name=workflow_name)
         res = self.client.get(url)
@@ -325,11 +582,35 @@ class SpearWorkflowApiTests(APITestCase):
         self.assertEqual(
             res.data, {"workflow_key1": "workflow_value1", "workflow_key2": 2}
         )
-        mock_read_text.assert_called_once_with(
-            "spear_job_api.spear_workflows",
-            f"{workflow_name}.json",
-            encoding="utf-8",
-        )
+
+    def test_retrieve_spear_workflow_not_modified(self):
+        """Test a repeated request with the ETag gets 304 until the file changes"""
+        url = spear_workflow_detail_url(workflow_name="workflow_a")
+        res = self.client.get(url)
+        etag = res["ETag"]
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res["ETag"], etag)
+
+        (self.workflow_dir / "workflow_a.json").write_text('{"workflow_key1": 3}')
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res["ETag"], etag)
+        self.assertEqual(res.data, {"workflow_key1": 3})
+
+    def test_list_spear_workflows_not_modified(self):
+        """Test the workflow list supports conditional requests"""
+        url = reverse("spear_job_api:spearworkflow-list")
+        etag = self.client.get(url)["ETag"]
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        (self.workflow_dir / "workflow_c.json").write_text("{}")
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(["workflow_a", "workflow_b", "workflow_c"], res.data)
 
     def test_retrieve_spear_workflow_not_found(self):
         """Test retrieving a non-existent spear workflow returns 404"""
@@ -0,0 +1,133 @@
+import datetime
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from spear_job_api import models
+from spear_job_api.archive import archive_spear_jobs, find_spear_job
+
+
+class TestArchiveSpearJobs(TestCase):
+    def setUp(self):
+        self.raystation_system = models.RayStationSystem.objects.create(
+            system_name="TestSystem", system_uid="UID1234"
+        )
+        self.count = 0
+        self.old = timezone.now() - datetime.timedelta(days=40)
+
+    def create_job(self, status="COMPLETED", created_at=None, **fields):
+        self.count += 1
+        job = models.SpearJob.objects.create(
+            patient_id=f"patient_{self.count}",
+            celery_job_id=f"{self.count:08x}-0000-4000-8000-000000000000",
+            raystation_system=self.raystation_system,
+            status=status,
+            workflow_name="test_workflow",
+            workflow_config={"plan": self.count},
+            **fields,
+        )
+        # created_at is set on insert
+        models.SpearJob.objects.filter(pk=job.pk).update(
+            created_at=created_at or self.old
+        )
+        return job
+
+    def test_archive_old_finished_jobs(self):
+        """Test old finished jobs are moved with their logs, others stay"""
+        archived = [
+            self.create_job(status) for status in ("COMPLETED", "FAILED", "REVOKED")
+        ]
+        kept = [
+            self.create_job("RUNNING"),
+            self.create_job("COMPLETED", created_at=timezone.now()),
+        ]
+        models.SpearJobLogChunk.objects.append(
+            job_id=archived[0].pk, entries=["first", "second"]
+        )
+
+        result = archive_spear_jobs(days=30, batch_size=2)
+
+        self.assertEqual(result.jobs, 3)
+        self.assertEqual(result.log_chunks, 2)
+        self.assertCountEqual(
+            models.SpearJob.objects.values_list("pk", flat=True),
+            [job.pk for job in kept],
+        )
+        self.assertFalse(models.SpearJobLogChunk.objects.exists())
+        job = models.SpearJobArchive.objects.get(pk=archived[0].pk)
+        self.assertTrue(job.log_compressed)
+        self.assertEqual(job.get_logs(), "first\nsecond")
+        self.assertEqual(job.workflow_config, {"plan": archived[0].pk})
+        self.assertEqual(job.celery_job_id, archived[0].celery_job_id)
+        self.assertIsNone(
+            models.SpearJobArchive.objects.get(pk=archived[1].pk).log_data
+        )
+
+    def test_uncompressed_logs(self):
+        job = self.create_job(logs="legacy")
+        models.SpearJobLogChunk.objects.append(job_id=job.pk, entries=["new"])
+
+        archive_spear_jobs(days=30, compress=False)
+
+        archived = models.SpearJobArchive.objects.get(pk=job.pk)
+        self.assertFalse(archived.log_compressed)
+        self.assertEqual(bytes(archived.log_data), b"legacy\nnew")
+
+    def test_job_graphs_are_archived_with_their_steps(self):
+        """Test a graph is archived with its steps once they all finished"""
+        parent = self.create_job("FAILED")
+        done = self.create_job("COMPLETED", parent=parent, step_name="a")
+        waiting = self.create_job("QUEUED", parent=parent, step_name="b")
+
+        self.assertEqual(archive_spear_jobs(days=30).jobs, 0)
+
+        models.SpearJob.objects.filter(pk=waiting.pk).update(status="REVOKED")
+        self.assertEqual(archive_spear_jobs(days=30).jobs, 3)
+        self.assertFalse(models.SpearJob.objects.exists())
+        self.assertCountEqual(
+            models.SpearJobArchive.objects.get(pk=parent.pk).steps.values_list(
+                "pk", flat=True
+            ),
+            [done.pk, waiting.pk],
+        )
+
+    def test_find_spear_job(self):
+        """Test looking up jobs by id or celery id in both tables"""
+        archived = self.create_job()
+        current = self.create_job("RUNNING")
+        archive_spear_jobs(days=30)
+
+        self.assertIsInstance(
+            find_spear_job(spear_job_id=archived.pk), models.SpearJobArchive
+        )
+        self.assertIsInstance(
+            find_spear_job(celery_job_id=current.celery_job_id), models.SpearJob
+        )
+        with self.assertRaises(models.SpearJob.DoesNotExist):
+            find_spear_job(spear_job_id=current.pk + 1)
+
+    def test_api_retrieves_archived_jobs(self):
+        """Test the detail endpoints render archived jobs like current ones"""
+        job = self.create_job()
+        models.SpearJobLogChunk.objects.append(job_id=job.pk, entries=["done"])
+        client = APIClient()
+        client.force_authenticate(
+            get_user_model().objects.create_user("user@example.com", "testpass123")
+        )
+        url = reverse("spear_job_api:spearjob-detail", args=[job.pk])
+        before = client.get(url).json()
+
+        archive_spear_jobs(days=30)
+
+        for url in (
+            url,
+            reverse(
+                "spear_job_api:spearjob-by-celery-job-id", args=[job.celery_job_id]
+            ),
+            reverse("spear_job_api:async-spearjob-detail", args=[job.pk]),
+        ):
+            response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), before)
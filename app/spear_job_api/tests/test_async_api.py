@@ -0,0 +1,142 @@
+import datetime
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from spear_job_api import models
+
+CELERY_JOB_ID = "52a92938-8fc1-4b04-8ab0-0d2a6111e76b"
+UNKNOWN_CELERY_JOB_ID = "3b7cd972-f5cf-4f12-9705-6b78de3236b4"
+ASYNC_HEARTBEAT_URL = reverse("spear_job_api:async-spearjob-heartbeat")
+# /api/async/spear-jobs/heartbeat/
+
+
+def async_detail_url(spear_job_id: int):
+    # /api/async/spear-jobs/{spear_job_id}/
+    return reverse("spear_job_api:async-spearjob-detail", args=[spear_job_id])
+
+
+def async_celery_job_id_url(celery_job_id: str, name="by-celery-job-id"):
+    # /api/async/spear-jobs/by-celery/{celery_job_id}/[heartbeat/|logs/]
+    return reverse(f"spear_job_api:async-spearjob-{name}", args=[celery_job_id])
+
+
+class AsyncSpearJobApiTests(TestCase):
+    """Test the async endpoints match the SpearJobViewSet ones"""
+
+    def setUp(self):
+        self.job = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id=CELERY_JOB_ID,
+            workflow_name="test_workflow",
+            workflow_config={"plan": "A"},
+            raystation_system=models.RayStationSystem.objects.create(
+                system_name="TestSystem", system_uid="UID1234"
+            ),
+        )
+        models.SpearJobLogChunk.objects.append(
+            job_id=self.job.id, entries=["first", "second"]
+        )
+
+    async def test_retrieve(self):
+        """Test retrieving a job by id and by celery id"""
+        for url in (
+            async_detail_url(self.job.id),
+            async_celery_job_id_url(CELERY_JOB_ID),
+        ):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertEqual(data["logs"], "first\nsecond")
+            self.assertEqual(data["raystation_system_name"], "TestSystem")
+            self.assertEqual(data["workflow_config"], {"plan": "A"})
+
+    def test_retrieve_matches_sync_view(self):
+        """Test the async and the sync detail views render the same data"""
+        sync_response = self.client.get(
+            reverse("spear_job_api:spearjob-detail", args=[self.job.id])
+        )
+        async_response = self.client.get(async_detail_url(self.job.id))
+        self.assertEqual(async_response.json(), sync_response.json())
+
+    async def test_retrieve_not_found(self):
+        response = await self.async_client.get(
+            async_celery_job_id_url(UNKNOWN_CELERY_JOB_ID)
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_heartbeat(self):
+        """Test recording a heartbeat for many jobs"""
+        heartbeat = datetime.datetime(2025, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        response = await self.async_client.post(
+            ASYNC_HEARTBEAT_URL,
+            {
+                "celery_job_ids": [CELERY_JOB_ID, UNKNOWN_CELERY_JOB_ID],
+                "latest_heartbeat": heartbeat.isoformat(),
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"updated": 1})
+        await self.job.arefresh_from_db()
+        self.assertEqual(self.job.latest_heartbeat, heartbeat)
+
+    async def test_heartbeat_by_celery_job_id(self):
+        """Test recording a heartbeat defaults to the server time"""
+        response = await self.async_client.post(
+            async_celery_job_id_url(CELERY_JOB_ID, "heartbeat-by-celery-job-id"),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        await self.job.arefresh_from_db()
+        self.assertIsNotNone(self.job.latest_heartbeat)
+
+        response = await self.async_client.post(
+            async_celery_job_id_url(
+                UNKNOWN_CELERY_JOB_ID, "heartbeat-by-celery-job-id"
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_heartbeat_invalid(self):
+        response = await self.async_client.post(
+            ASYNC_HEARTBEAT_URL, {"celery_job_ids": []}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("celery_job_ids", response.json())
+
+        response = await self.async_client.post(
+            ASYNC_HEARTBEAT_URL, "not json", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_append_logs(self):
+        """Test appending log entries by celery id"""
+        url = async_celery_job_id_url(CELERY_JOB_ID, "append-logs-by-celery-job-id")
+        response = await self.async_client.post(
+            url,
+            {"append_log": "third", "append_logs": ["fourth", "fifth"]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            await self.job.aget_logs(), "first\nsecond\nthird\nfourth\nfifth"
+        )
+
+        response = await self.async_client.post(
+            url, {"append_logs": []}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = await self.async_client.post(
+            async_celery_job_id_url(
+                UNKNOWN_CELERY_JOB_ID, "append-logs-by-celery-job-id"
+            ),
+            {"append_log": "lost"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_method_not_allowed(self):
+        response = await self.async_client.post(async_detail_url(self.job.id))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -0,0 +1,175 @@
+import re
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from spear_job_api import models
+from spear_job_api.services import record_spear_job_heartbeats
+
+CELERY_JOB_ID = "52a92938-8fc1-4b04-8ab0-0d2a6111e76b"
+
+
+class SpearJobDetailReadTests(APITestCase):
+    """Test the partial and conditional reads of the detail endpoints"""
+
+    def setUp(self):
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("user@example.com", "testpass123")
+        )
+        self.job = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id=CELERY_JOB_ID,
+            workflow_name="test_workflow",
+            raystation_system=models.RayStationSystem.objects.create(
+                system_name="TestSystem", system_uid="UID1234"
+            ),
+        )
+        self.entries = ["first", "second entry", "", "fourth"]
+        models.SpearJobLogChunk.objects.append(job_id=self.job.pk, entries=self.entries)
+        self.url = reverse("spear_job_api:spearjob-detail", args=[self.job.pk])
+
+    def get(self, url=None, **params):
+        return self.client.get(url or self.url, params)
+
+    def test_fields(self):
+        res = self.get(fields="status,patient_id")
+        self.assertEqual(res.json(), {"status": "PENDING", "patient_id": "test_pid"})
+        res = self.get(fields="status,secret")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_log_offset_and_tail(self):
+        """Test entries are selected by sequence number, the empty entry is
+        not stored"""
+        res = self.get(log_offset=1, fields="logs")
+        self.assertEqual(
+            res.json(), {"logs": "second entry\nfourth", "log_next_offset": 3}
+        )
+        res = self.get(log_offset=3)
+        self.assertEqual((res.data["logs"], res.data["log_next_offset"]), ("", 3))
+        res = self.get(log_tail=2)
+        self.assertEqual(
+            (res.data["logs"], res.data["log_next_offset"]), ("second entry\nfourth", 3)
+        )
+        res = self.get(log_tail=0)
+        self.assertEqual((res.data["logs"], res.data["log_next_offset"]), ("", 3))
+
+    def test_legacy_logs_entry(self):
+        """Test the legacy logs column is the entry before the first chunk,
+        for offsets and tails alike"""
+        models.SpearJob.objects.filter(pk=self.job.pk).update(logs="legacy\nlines")
+
+        res = self.get(log_offset=0, fields="logs")
+        self.assertEqual(res.data["logs"], self.get().data["logs"])
+        self.assertEqual(res.data["log_next_offset"], 3)
+        res = self.get(log_offset=1, fields="logs")
+        self.assertEqual(res.data["logs"], "second entry\nfourth")
+        res = self.get(log_tail=3, fields="logs")
+        self.assertEqual(res.data["logs"], "first\nsecond entry\nfourth")
+        res = self.get(log_tail=4, fields="logs")
+        self.assertEqual(res.data["logs"], "legacy\nlines\nfirst\nsecond entry\nfourth")
+
+    def test_partial_reads_do_not_load_legacy_logs(self):
+        """Test the job is read without its legacy logs column for ?fields=
+        without logs and for log selections"""
+        models.SpearJob.objects.filter(pk=self.job.pk).update(logs="legacy\nlines")
+        # the column itself, not the LENGTH or SUBSTR of it
+        column = re.compile(r'(SELECT|,) "spear_job_api_spearjob"\."logs"(,| FROM)')
+        for params in [
+            {"fields": "status"},
+            {"log_tail": 2},
+            {"log_offset": 1},
+            {"log_range": "0-3"},
+        ]:
+            with CaptureQueriesContext(connection) as context:
+                res = self.get(**params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertFalse(
+                any(column.search(query["sql"]) for query in context.captured_queries),
+                params,
+            )
+
+    def test_log_range(self):
+        """Test character ranges match slices of the whole log, with and
+        without the legacy logs column"""
+        for legacy in (None, "legacy\nlines"):
+            models.SpearJob.objects.filter(pk=self.job.pk).update(logs=legacy)
+            text = self.get().data["logs"]
+            for start, end in [
+                (0, 0),
+                (0, 4),
+                (3, 9),
+                (5, 12),
+                (12, 30),
+                (0, None),
+                (7, None),
+                (40, 50),
+            ]:
+                log_range = f"{start}-{'' if end is None else end}"
+                res = self.get(log_range=log_range, fields="logs")
+                self.assertEqual(
+                    res.json(),
+                    {
+                        "logs": text[start : None if end is None else end + 1],
+                        "log_length": len(text),
+                    },
+                    f"{legacy=} {log_range=}",
+                )
+
+    def test_invalid_log_parameters(self):
+        for params in (
+            {"log_tail": "-1"},
+            {"log_offset": "x"},
+            {"log_range": "5-2"},
+            {"log_range": "a-"},
+            {"log_tail": "1", "log_offset": "1"},
+        ):
+            res = self.get(**params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_etag(self):
+        """Test an unchanged job is not modified, until it is updated, logs
+        or beats"""
+        by_celery_url = reverse(
+            "spear_job_api:spearjob-by-celery-job-id", args=[CELERY_JOB_ID]
+        )
+        async_url = reverse("spear_job_api:async-spearjob-detail", args=[self.job.pk])
+
+        def changes(change):
+            etag = self.get()["ETag"]
+            for url in (self.url, by_celery_url, async_url):
+                res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED, url)
+            change()
+            res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            return res.status_code == status.HTTP_200_OK
+
+        self.assertTrue(
+            changes(
+                lambda: models.SpearJobLogChunk.objects.append(
+                    job_id=self.job.pk, entries=["more"]
+                )
+            )
+        )
+        self.assertTrue(
+            changes(
+                lambda: self.client.patch(
+                    self.url, {"status": "RUNNING"}, format="json"
+                )
+            )
+        )
+        self.assertTrue(
+            changes(lambda: record_spear_job_heartbeats(celery_job_ids=[CELERY_JOB_ID]))
+        )
+        # another representation of the same version
+        etag = self.get()["ETag"]
+        res = self.client.get(self.url, {"log_tail": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_async_views_match(self):
+        async_url = reverse("spear_job_api:async-spearjob-detail", args=[self.job.pk])
+        for params in ({"log_tail": 2}, {"log_range": "3-9", "fields": "id,logs"}):
+            self.assertEqual(
+                self.client.get(async_url, params).json(), self.get(**params).json()
+            )
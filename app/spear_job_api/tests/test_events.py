@@ -0,0 +1,199 @@
+import json
+from unittest import mock
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from spear_job_api import models
+from spear_job_api.events import log_event, status_event
+from spear_job_api.services import update_spear_job
+
+CELERY_JOB_ID = "52a92938-8fc1-4b04-8ab0-0d2a6111e76b"
+
+
+class FakeSubscription:
+    """In-memory JobEventSubscription serving the events of `published`."""
+
+    published = []
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def get(self, timeout):
+        return self.published.pop(0) if self.published else None
+
+
+def parse_sse(chunks) -> list[tuple[str, str | None, dict]]:
+    """The (event, id, data) of the events of a stream, comments skipped."""
+    events = []
+    for block in "".join(chunks).split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in block.splitlines() if line[:1] != ":"
+        )
+        if fields:
+            events.append(
+                (fields["event"], fields.get("id"), json.loads(fields["data"]))
+            )
+    return events
+
+
+class TestPublishJobEvents(TestCase):
+    def setUp(self):
+        self.job = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id=CELERY_JOB_ID,
+            workflow_name="test_workflow",
+            raystation_system=models.RayStationSystem.objects.create(
+                system_name="TestSystem", system_uid="UID1234"
+            ),
+        )
+
+    @mock.patch("spear_job_api.events._publish")
+    def test_status_changes_and_logs_are_published(self, mock_publish):
+        """Test updates publish the status changes and log entries on commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            update_spear_job(
+                celery_job_id=CELERY_JOB_ID,
+                data={"status": "RUNNING", "append_logs": ["first", "second"]},
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            # unchanged status, nothing to publish
+            update_spear_job(celery_job_id=CELERY_JOB_ID, data={"status": "RUNNING"})
+
+        published = [
+            event for call in mock_publish.call_args_list for event in call.args[0]
+        ]
+        self.assertCountEqual(
+            published,
+            [
+                status_event(self.job.pk, "RUNNING"),
+                log_event(self.job.pk, 0, "first"),
+                log_event(self.job.pk, 1, "second"),
+            ],
+        )
+
+    @mock.patch("spear_job_api.events._publish")
+    def test_bulk_updates_are_published(self, mock_publish):
+        job = models.SpearJob.objects.get(pk=self.job.pk)
+        job.status = "QUEUED"
+        with self.captureOnCommitCallbacks(execute=True):
+            models.SpearJob.objects.bulk_update([job], ["status"])
+
+        mock_publish.assert_called_once_with([status_event(job.pk, "QUEUED")])
+
+
+@mock.patch("spear_job_api.async_views.JobEventSubscription", FakeSubscription)
+class TestJobEventStreams(TestCase):
+    def setUp(self):
+        self.job = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id=CELERY_JOB_ID,
+            status="RUNNING",
+            workflow_name="test_workflow",
+            raystation_system=models.RayStationSystem.objects.create(
+                system_name="TestSystem", system_uid="UID1234"
+            ),
+        )
+        models.SpearJobLogChunk.objects.append(
+            job_id=self.job.pk, entries=["first", "second"]
+        )
+        self.url = reverse("spear_job_api:async-spearjob-events", args=[self.job.pk])
+
+    async def read(self, response, limit=None):
+        chunks = []
+        async for chunk in response.streaming_content:
+            chunks.append(chunk.decode() if isinstance(chunk, bytes) else chunk)
+            if limit and len(chunks) == limit:
+                break
+        return parse_sse(chunks)
+
+    async def test_job_stream(self):
+        """Test the stream sends the backlog, then the live events until the
+        job is finished"""
+        await models.SpearJobLogChunk.objects.acreate(
+            job=self.job, sequence=2, text="third"
+        )
+        FakeSubscription.published = [
+            # already sent from the database
+            log_event(self.job.pk, 2, "third"),
+            None,
+            log_event(self.job.pk, 3, "fourth"),
+            status_event(self.job.pk, "COMPLETED"),
+        ]
+
+        response = await self.async_client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = await self.read(response)
+        self.assertEqual(
+            [
+                (event, id, data.get("status", data.get("text")))
+                for event, id, data in events
+            ],
+            [
+                ("status", None, "RUNNING"),
+                ("log", "0", "first"),
+                ("log", "1", "second"),
+                ("log", "2", "third"),
+                ("log", "3", "fourth"),
+                ("status", None, "COMPLETED"),
+            ],
+        )
+
+    async def test_resume_after_sequence(self):
+        """Test a client resuming gets the entries after its last event id"""
+        await models.SpearJobLogChunk.objects.acreate(
+            job=self.job, sequence=2, text="third"
+        )
+        FakeSubscription.published = [status_event(self.job.pk, "FAILED")]
+
+        response = await self.async_client.get(self.url, headers={"Last-Event-ID": "0"})
+
+        events = await self.read(response)
+        self.assertEqual(
+            [data.get("text") for _, _, data in events],
+            [None, "second", "third", None],
+        )
+
+    async def test_invalid_and_unknown_jobs(self):
+        response = await self.async_client.get(self.url, {"after": "x"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.get(
+            reverse("spear_job_api:async-spearjob-events", args=[self.job.pk + 1])
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_filtered_stream(self):
+        """Test the stream of a job set forwards the events of matching jobs"""
+        other = await models.SpearJob.objects.acreate(
+            patient_id="other_pid",
+            celery_job_id="3b7cd972-f5cf-4f12-9705-6b78de3236b4",
+            workflow_name="other_workflow",
+            raystation_system_id=self.job.raystation_system_id,
+        )
+        FakeSubscription.published = [
+            log_event(other.pk, 0, "other"),
+            log_event(self.job.pk, 2, "third"),
+            status_event(other.pk, "RUNNING"),
+            status_event(self.job.pk, "COMPLETED"),
+        ]
+
+        response = await self.async_client.get(
+            reverse("spear_job_api:async-spearjob-events-list"),
+            {"workflow_name": "test_workflow"},
+        )
+
+        events = await self.read(response, limit=5)
+        self.assertEqual(
+            events,
+            [
+                ("log", None, log_event(self.job.pk, 2, "third")),
+                ("status", None, status_event(self.job.pk, "COMPLETED")),
+            ],
+        )
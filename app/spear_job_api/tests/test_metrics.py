@@ -0,0 +1,90 @@
+import datetime
+from django.test import TestCase
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework import status
+from spear_job_api import models
+from spear_job_api.services import update_spear_job
+
+CELERY_JOB_ID = "52a92938-8fc1-4b04-8ab0-0d2a6111e76b"
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.job = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id=CELERY_JOB_ID,
+            workflow_name="test_workflow",
+            raystation_system=models.RayStationSystem.objects.create(
+                system_name="TestSystem", system_uid="UID1234"
+            ),
+        )
+
+    def test_metrics_endpoint(self):
+        """Test the metrics are served in the Prometheus text format"""
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"spear_api_request_duration_seconds", response.content)
+
+    def test_request_metrics(self):
+        """Test the duration and queries of a request are recorded per view"""
+        view = "spear_job_api:spearjob-list"
+        requests_before = sample(
+            "spear_api_request_duration_seconds_count",
+            view=view,
+            method="GET",
+            status="200",
+        )
+        queries_before = sample("spear_api_request_db_queries_sum", view=view)
+
+        self.client.get(reverse(view))
+
+        self.assertEqual(
+            sample(
+                "spear_api_request_duration_seconds_count",
+                view=view,
+                method="GET",
+                status="200",
+            ),
+            requests_before + 1,
+        )
+        self.assertEqual(
+            sample("spear_api_request_db_queries_sum", view=view), queries_before + 1
+        )
+
+    def test_job_duration_metrics(self):
+        """Test the queue wait and run time are observed once committed"""
+        labels = {"workflow": "test_workflow", "server": "HPTC-RAY-SP01"}
+        wait_before = sample("spear_job_queue_wait_seconds_count", **labels)
+        run_before = sample("spear_job_run_seconds_sum", **labels)
+        started_at = self.job.created_at + datetime.timedelta(seconds=30)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_spear_job(
+                celery_job_id=CELERY_JOB_ID,
+                data={
+                    "status": "RUNNING",
+                    "started_at": started_at,
+                    "worker_name": "worker_sp1",
+                },
+            )
+        self.assertEqual(
+            sample("spear_job_queue_wait_seconds_count", **labels), wait_before + 1
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_spear_job(
+                celery_job_id=CELERY_JOB_ID,
+                data={
+                    "status": "COMPLETED",
+                    "completed_at": started_at + datetime.timedelta(seconds=120),
+                },
+            )
+        self.assertAlmostEqual(
+            sample("spear_job_run_seconds_sum", **labels), run_before + 120
+        )
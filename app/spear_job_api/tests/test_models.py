@@ -1,8 +1,10 @@
 from django.test import TestCase
 from spear_job_api import models
+from spear_job_api.workflows import workflow_registry
 import pytz
 from unittest import mock
 import datetime
+import uuid
 
 
 class TestSpearJobModel(TestCase):
@@ -59,6 +61,148 @@ class TestSpearJobModel(TestCase):
         spear_job.save()
         self.assertEqual(spear_job.server_name, models.SpearServer.SP2)
 
+    def test_bulk_update_of_a_stale_copy_bumps_the_version(self):
+        """Test bulk_update increments the stored version, not the version
+        of the possibly stale copy it writes."""
+        spear_job = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id="abcd9999",
+            workflow_name="test_workflow",
+            raystation_system=models.RayStationSystem.objects.create(
+                system_name="TestSystem4", system_uid="UID3456"
+            ),
+        )
+        stale = models.SpearJob.objects.get(pk=spear_job.pk)
+        for status in ["QUEUED", "RUNNING"]:
+            spear_job.status = status
+            self.assertTrue(spear_job.compare_and_set(["status"]))
+
+        stale.server_name = models.SpearServer.SP1
+        models.SpearJob.objects.bulk_update([stale], ["server_name"])
+
+        self.assertEqual(stale.version, spear_job.version + 1)
+        spear_job.refresh_from_db()
+        self.assertEqual(spear_job.version, stale.version)
+
+
+class TestSpearWorkflowConfigModel(TestCase):
+    def setUp(self):
+        self.raystation_system = models.RayStationSystem.objects.create(
+            system_name="TestSystem4", system_uid="UID3456"
+        )
+        self.template = workflow_registry.get_config("hn_workflow")
+
+    def create_job(self, config, workflow_name="hn_workflow"):
+        return models.SpearJob(
+            patient_id="test_pid",
+            celery_job_id=uuid.uuid4().hex,
+            workflow_name=workflow_name,
+            workflow_config=config,
+            raystation_system=self.raystation_system,
+        )
+
+    def test_identical_configs_share_a_blob(self):
+        """Test jobs with the same config reference one stored blob."""
+        config = {"key": ["value", 1]}
+        first, second = models.SpearJob.objects.bulk_create(
+            [self.create_job(config, "test_workflow") for _ in range(2)]
+        )
+        third = self.create_job({"key": ["value", 1]}, "test_workflow")
+        third.save()
+
+        self.assertEqual(models.SpearWorkflowConfig.objects.count(), 1)
+        self.assertEqual(first.config_blob_id, third.config_blob_id)
+        self.assertIsNone(third.config_overrides)
+        job = models.SpearJob.objects.with_config().get(pk=second.pk)
+        self.assertEqual(job.workflow_config, config)
+
+    def test_overrides_of_the_workflow_template(self):
+        """Test a changed template config is stored as a merge patch."""
+        config = workflow_registry.get_config("hn_workflow")
+        config["General"]["Type"] = "Replanning"
+        del config["General"]["3D/4D"]
+        job = self.create_job(config)
+        job.save()
+
+        job = models.SpearJob.objects.get(pk=job.pk)
+        self.assertEqual(
+            job.config_overrides, {"General": {"Type": "Replanning", "3D/4D": None}}
+        )
+        self.assertEqual(job.config_blob.config, self.template)
+        self.assertEqual(job.workflow_config, config)
+
+        default = self.create_job(self.template)
+        default.save()
+        self.assertEqual(default.config_blob_id, job.config_blob_id)
+        self.assertIsNone(default.config_overrides)
+
+    def test_null_values_are_stored_whole(self):
+        """Test configs a merge patch cannot express are not split."""
+        config = self.template | {"General": None}
+        job = self.create_job(config)
+        job.save()
+
+        job = models.SpearJob.objects.get(pk=job.pk)
+        self.assertIsNone(job.config_overrides)
+        self.assertEqual(job.workflow_config, config)
+
+    def test_assign_new_config(self):
+        """Test assigning a config replaces the stored one on save."""
+        job = self.create_job({"key": "value"}, "test_workflow")
+        job.save()
+        job.workflow_config = None
+        job.save(update_fields=["workflow_config"])
+
+        job.refresh_from_db()
+        self.assertIsNone(job.config_blob_id)
+        self.assertIsNone(job.workflow_config)
+
+
+class TestSpearJobLogChunkModel(TestCase):
+    def setUp(self):
+        self.spear_job = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id="abcd5678",
+            workflow_name="test_workflow",
+            raystation_system=models.RayStationSystem.objects.create(
+                system_name="TestSystem3", system_uid="UID9012"
+            ),
+        )
+
+    def test_append_assigns_increasing_sequences(self):
+        """Test appending log entries numbers them per job in order."""
+        models.SpearJobLogChunk.objects.append(
+            job_id=self.spear_job.id, entries=["first", "second"]
+        )
+        models.SpearJobLogChunk.objects.append(
+            job_id=self.spear_job.id, entries=["", "third"]
+        )
+
+        chunks = models.SpearJobLogChunk.objects.filter(job=self.spear_job)
+        self.assertEqual(
+            list(chunks.values_list("sequence", "text")),
+            [(0, "first"), (1, "second"), (2, "third")],
+        )
+
+    def test_append_does_not_save_job(self):
+        """Test appending log entries does not write the SpearJob row."""
+        with mock.patch.object(models.SpearJob, "save") as mocked_save:
+            models.SpearJobLogChunk.objects.append(
+                job_id=self.spear_job.id, entries=["entry"]
+            )
+        mocked_save.assert_not_called()
+
+    def test_get_logs_joins_legacy_logs_and_chunks(self):
+        """Test the legacy logs column is read before the log chunks."""
+        self.assertIsNone(self.spear_job.get_logs())
+        self.spear_job.logs = "legacy line"
+        self.spear_job.save()
+        models.SpearJobLogChunk.objects.append(
+            job_id=self.spear_job.id, entries=["new line"]
+        )
+
+        self.assertEqual(self.spear_job.get_logs(), "legacy line\nnew line")
+
 
 class TestRayStationSystemModel(TestCase):
     def test_create_raystation_system(self):
@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from spear_job_api import models
+
+
+def create_spear_jobs(raystation_system, count: int, start: int = 0):
+    """Create and return `count` spear jobs, each with a few log chunks."""
+    jobs = []
+    for i in range(start, start + count):
+        job = models.SpearJob.objects.create(
+            patient_id=f"patient_{i}",
+            celery_job_id=f"{i:08x}-0000-4000-8000-000000000000",
+            workflow_name="test_workflow",
+            workflow_config={"plan": "A"},
+            raystation_system=raystation_system,
+        )
+        models.SpearJobLogChunk.objects.append(job_id=job.id, entries=["a", "b"])
+        jobs.append(job)
+    return jobs
+
+
+class QueryCountAssertionsMixin:
+    """Assertions on the number of queries a request takes."""
+
+    def count_queries(self, request) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def assertQueriesDoNotGrow(self, request, add_rows, expected=None):
+        """Assert `request` takes the same number of queries before and after
+        `add_rows` is called (no N+1), and exactly `expected` if given."""
+        before = self.count_queries(request)
+        add_rows()
+        after = self.count_queries(request)
+        self.assertEqual(
+            before, after, "number of queries grows with the number of rows"
+        )
+        if expected is not None:
+            self.assertEqual(after, expected)
+
+
+class SpearJobQueryCountTests(QueryCountAssertionsMixin, APITestCase):
+    """Test the job views do not issue a query per job or per relation"""
+
+    def setUp(self):
+        self.raystation_systems = [
+            models.RayStationSystem.objects.create(
+                system_name=f"System {i}", system_uid=f"UID{i}"
+            )
+            for i in range(3)
+        ]
+        self.jobs = create_spear_jobs(self.raystation_systems[0], 3)
+
+    def add_jobs(self):
+        for i, raystation_system in enumerate(self.raystation_systems):
+            create_spear_jobs(raystation_system, 5, start=100 + 10 * i)
+
+    def test_list_queries(self):
+        """Test listing jobs takes one query whatever the number of jobs"""
+        url = reverse("spear_job_api:spearjob-list")
+        self.assertQueriesDoNotGrow(lambda: self.client.get(url), self.add_jobs, 1)
+
+    def test_retrieve_queries(self):
+        """Test retrieving a job joins its system and reads its log once"""
+        url = reverse("spear_job_api:spearjob-detail", args=[self.jobs[0].id])
+        self.assertQueriesDoNotGrow(lambda: self.client.get(url), self.add_jobs, 2)
+
+    def test_by_celery_job_id_queries(self):
+        """Test retrieving a job by celery id joins its system and reads its log once"""
+        url = reverse(
+            "spear_job_api:spearjob-by-celery-job-id",
+            args=[self.jobs[0].celery_job_id],
+        )
+        self.assertQueriesDoNotGrow(lambda: self.client.get(url), self.add_jobs, 2)
+
+    def test_admin_changelist_queries(self):
+        """Test the admin job changelist does not query the system per row"""
+        superuser = get_user_model().objects.create_superuser(
+            "admin", "admin@example.com", "testpass123"
+        )
+        self.client.force_login(superuser)
+        url = reverse("admin:spear_job_api_spearjob_changelist")
+        self.assertQueriesDoNotGrow(lambda: self.client.get(url), self.add_jobs)
+
+    def test_admin_change_form_widgets(self):
+        """Test the admin job change form does not list the other jobs"""
+        superuser = get_user_model().objects.create_superuser(
+            "admin", "admin@example.com", "testpass123"
+        )
+        self.client.force_login(superuser)
+        url = reverse("admin:spear_job_api_spearjob_change", args=[self.jobs[0].pk])
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertContains(res, "vForeignKeyRawIdAdminField")
+        self.assertContains(res, "vManyToManyRawIdAdminField")
@@ -0,0 +1,151 @@
+from unittest import mock
+from celery import current_app
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from spear_job_api import models, services
+from spear_job_api.revocation import revoke_tasks, revoked_key
+
+
+@mock.patch.object(current_app.control, "revoke")
+class TestRevokeTasks(TestCase):
+    @override_settings(SPEAR_JOB_REVOKED_TTL=60)
+    @mock.patch("spear_job_api.revocation._redis")
+    def test_revoked_ids_expire(self, mock_redis, mock_revoke):
+        """Test the ids are added to Redis with a TTL and broadcast"""
+        pipeline = mock_redis.return_value.pipeline.return_value
+
+        revoke_tasks(["a", "b"], terminate=True)
+
+        pipeline.set.assert_has_calls(
+            [
+                mock.call(revoked_key("a"), 1, ex=60),
+                mock.call(revoked_key("b"), 1, ex=60),
+            ]
+        )
+        pipeline.execute.assert_called_once()
+        mock_revoke.assert_called_once_with(["a", "b"], terminate=True)
+
+    @override_settings(SPEAR_JOB_REVOKED_URL="")
+    def test_without_redis(self, mock_revoke):
+        revoke_tasks(["a"])
+        mock_revoke.assert_called_once_with(["a"], terminate=False)
+
+
+@mock.patch("spear_job_api.services.revoke_tasks")
+class TestRevokeSpearJobs(TestCase):
+    def setUp(self):
+        self.raystation_system = models.RayStationSystem.objects.create(
+            system_name="TestSystem", system_uid="UID1234"
+        )
+        self.count = 0
+
+    def create_job(self, status="QUEUED", patient_id="patient", **fields):
+        self.count += 1
+        return models.SpearJob.objects.create(
+            patient_id=patient_id,
+            celery_job_id=f"{self.count:08x}-0000-4000-8000-000000000000",
+            raystation_system=self.raystation_system,
+            status=status,
+            **fields,
+        )
+
+    def test_revoke_jobs_of_a_patient(self, mock_revoke_tasks):
+        """Test the unfinished jobs are revoked, and their tasks once
+        committed, finished ones and other patients are left alone"""
+        revoked = [self.create_job(), self.create_job("RUNNING")]
+        completed = self.create_job("COMPLETED")
+        other = self.create_job(patient_id="other")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            celery_job_ids = services.revoke_spear_jobs(
+                jobs=models.SpearJob.objects.filter(patient_id="patient"),
+                terminate=True,
+            )
+
+        self.assertEqual(celery_job_ids, [job.celery_job_id for job in revoked])
+        mock_revoke_tasks.assert_called_once_with(celery_job_ids, terminate=True)
+        self.assertEqual(
+            dict(models.SpearJob.objects.values_list("pk", "status")),
+            {
+                revoked[0].pk: "REVOKED",
+                revoked[1].pk: "REVOKED",
+                completed.pk: "COMPLETED",
+                other.pk: "QUEUED",
+            },
+        )
+
+    def test_revoke_job_graph(self, mock_revoke_tasks):
+        """Test revoking a job graph revokes its unfinished steps"""
+        parent = self.create_job("RUNNING")
+        done = self.create_job("COMPLETED", parent=parent, step_name="a")
+        waiting = self.create_job("QUEUED", parent=parent, step_name="b")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            job = services.revoke_spear_job(celery_job_id=parent.celery_job_id)
+
+        self.assertEqual(job.status, "REVOKED")
+        self.assertCountEqual(
+            mock_revoke_tasks.call_args.args[0],
+            [parent.celery_job_id, waiting.celery_job_id],
+        )
+        done.refresh_from_db()
+        self.assertEqual(done.status, "COMPLETED")
+
+    def test_finished_job_is_not_revoked(self, mock_revoke_tasks):
+        job = self.create_job("COMPLETED")
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(
+            services.SpearJobTransitionError
+        ):
+            services.revoke_spear_job(spear_job_id=job.pk)
+        mock_revoke_tasks.assert_not_called()
+
+
+@mock.patch("spear_job_api.services.revoke_tasks")
+class TestRevokeApi(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("user@example.com", "testpass123")
+        )
+        self.raystation_system = models.RayStationSystem.objects.create(
+            system_name="TestSystem", system_uid="UID1234"
+        )
+        self.job = models.SpearJob.objects.create(
+            patient_id="patient",
+            celery_job_id="52a92938-8fc1-4b04-8ab0-0d2a6111e76b",
+            raystation_system=self.raystation_system,
+            status="RUNNING",
+        )
+
+    def test_revoke(self, mock_revoke_tasks):
+        url = reverse("spear_job_api:spearjob-revoke", args=[self.job.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(url, {"terminate": True}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "REVOKED")
+        mock_revoke_tasks.assert_called_once_with(
+            [self.job.celery_job_id], terminate=True
+        )
+
+        res = self.client.post(url, format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.post(
+            reverse("spear_job_api:spearjob-revoke", args=[self.job.pk + 1])
+        )
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_revoke(self, mock_revoke_tasks):
+        url = reverse("spear_job_api:spearjob-bulk-revoke")
+        res = self.client.post(url, {}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                url, {"raystation_system": "TestSystem"}, format="json"
+            )
+        self.assertEqual(res.json(), {"revoked": [self.job.celery_job_id]})
+        mock_revoke_tasks.assert_called_once_with(
+            [self.job.celery_job_id], terminate=False
+        )
@@ -1,11 +1,17 @@
+from django.db import connection
+from django.db.models import F
 from django.test import TestCase
-from unittest.mock import patch, MagicMock
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
 from spear_job_api import models
 from spear_job_api import services
 from rest_framework import serializers
 import pytz
 from unittest import mock
 import datetime
+import tempfile
+from pathlib import Path
+from spear_job_api.workflows import WorkflowRegistry
 
 
 class TestSpearJobServices(TestCase):
@@ -42,6 +48,21 @@ class TestSpearJobServices(TestCase):
             self.assertEqual(spear_job.created_at, mocked_time)
             self.assertEqual(spear_job.status, "PENDING")
 
+    def test_create_spear_job_default_workflow_config(self):
+        """Test a job created without a config gets its workflow's default config."""
+        data = {
+            "patient_id": "11223344",
+            "celery_job_id": "7a4b5a64-ec4e-4a0f-a3e6-1c8dc3c977fb",
+            "workflow_name": "hn_workflow",
+            "raystation_system": self.raystation_system.system_name,
+        }
+
+        spear_job = services.create_spear_job(data=data)
+
+        self.assertEqual(
+            spear_job.workflow_config["General"]["ProtocolName"], "hn_workflow"
+        )
+
     def test_create_spear_job_validation_error(self):
         """Test creation of a spear job with invalid data raises ValidationError."""
         data = {
@@ -62,6 +83,60 @@ class TestSpearJobServices(TestCase):
         self.assertIn("raystation_system", errors)
         self.assertIn("priority", errors)
 
+    def test_bulk_create_spear_jobs(self):
+        """Test creating many spear jobs with a constant number of queries."""
+        models.RayStationSystem.objects.create(
+            system_name="OtherSystem", system_uid="UID5678"
+        )
+        data = [
+            {
+                "patient_id": f"patient_{i}",
+                "celery_job_id": f"7a4b5a64-ec4e-4a0f-a3e6-1c8dc3c977{i:02d}",
+                "workflow_name": "service_workflow",
+                "raystation_system": ["TestSystem", "OtherSystem"][i % 2],
+                "priority": 3,
+                "status": "QUEUED",
+            }
+            for i in range(20)
+        ]
+
+        # savepoint, system lookup, insert, release savepoint
+        with self.assertNumQueries(4):
+            jobs = services.bulk_create_spear_jobs(data=data)
+
+        self.assertEqual(len(jobs), 20)
+        self.assertEqual(models.SpearJob.objects.filter(status="QUEUED").count(), 20)
+        self.assertEqual(
+            models.SpearJob.objects.filter(
+                raystation_system__system_name="OtherSystem"
+            ).count(),
+            10,
+        )
+
+    def test_bulk_create_spear_jobs_validation_error(self):
+        """Test an invalid item fails the whole batch with per-item errors."""
+        data = [
+            {
+                "patient_id": "11223344",
+                "celery_job_id": "7a4b5a64-ec4e-4a0f-a3e6-1c8dc3c977fb",
+                "raystation_system": "TestSystem",
+            },
+            {
+                "patient_id": "11223344",
+                "celery_job_id": "invalid-uuid",
+                "raystation_system": "NonExistentSystem",
+            },
+        ]
+
+        with self.assertRaises(serializers.ValidationError) as context:
+            services.bulk_create_spear_jobs(data=data)
+
+        errors = context.exception.detail
+        self.assertEqual(errors[0], {})
+        self.assertIn("celery_job_id", errors[1])
+        self.assertIn("raystation_system", errors[1])
+        self.assertFalse(models.SpearJob.objects.exists())
+
     def test_update_spear_job_from_spear_id_success(self):
         """Test successful update of a spear job via service layer."""
         spear_job = models.SpearJob.objects.create(
@@ -86,7 +161,7 @@ class TestSpearJobServices(TestCase):
         )
 
         self.assertEqual(updated_job.status, "RUNNING")
-        self.assertEqual(updated_job.logs, "Job started.")
+        self.assertEqual(updated_job.get_logs(), "Job started.")
         self.assertEqual(updated_job.worker_name, "Worker1")
 
     def test_update_spear_job_from_celery_id_success(self):
@@ -113,7 +188,9 @@ class TestSpearJobServices(TestCase):
         )
 
         self.assertEqual(updated_job.status, "COMPLETED")
-        self.assertEqual(updated_job.logs, "Job started.\nJob completed successfully.")
+        self.assertEqual(
+            updated_job.get_logs(), "Job started.\nJob completed successfully."
+        )
         self.assertEqual(updated_job.worker_name, "Worker1")
 
     def test_update_spear_job_no_identifier_error(self):
@@ -155,6 +232,133 @@ class TestSpearJobServices(TestCase):
         errors = context.exception.detail
         self.assertIn("status", errors)
 
+    def test_bulk_update_spear_jobs(self):
+        """Test updating several spear jobs in one call with a result per item."""
+        for celery_job_id in ["aaaa1111", "bbbb2222"]:
+            models.SpearJob.objects.create(
+                patient_id="11223344",
+                celery_job_id=celery_job_id,
+                raystation_system=self.raystation_system,
+                status="QUEUED",
+            )
+        started_at = datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=pytz.utc)
+        items = [
+            {
+                "celery_job_id": "aaaa1111",
+                "status": "RUNNING",
+                "started_at": started_at.isoformat(),
+                "worker_name": "worker_sp2",
+                "append_logs": ["Job started."],
+            },
+            {"celery_job_id": "bbbb2222", "append_log": "Still queued."},
+            {"celery_job_id": "aaaa1111", "append_logs": ["Step 1 done."]},
+            {"celery_job_id": "cccc3333", "status": "RUNNING"},
+            {"celery_job_id": "bbbb2222", "status": "INVALID_STATUS"},
+        ]
+
+        results = services.bulk_update_spear_jobs(items=items)
+
+        self.assertEqual(
+            [result["result"] for result in results],
+            ["updated", "updated", "updated", "not_found", "invalid"],
+        )
+        self.assertIn("status", results[4]["errors"])
+        job_a = models.SpearJob.objects.get(celery_job_id="aaaa1111")
+        self.assertEqual(job_a.status, "RUNNING")
+        self.assertEqual(job_a.started_at, started_at)
+        self.assertEqual(job_a.server_name, models.SpearServer.SP2)
+        self.assertEqual(job_a.get_logs(), "Job started.\nStep 1 done.")
+        job_b = models.SpearJob.objects.get(celery_job_id="bbbb2222")
+        self.assertEqual(job_b.status, "QUEUED")
+        self.assertEqual(job_b.get_logs(), "Still queued.")
+
+    def test_bulk_update_uses_conditional_updates(self):
+        """Test a bulk update changes the statuses with conditional UPDATEs,
+        without locking or saving the jobs, and applies the items of a job in
+        their order."""
+        for celery_job_id, job_status in [
+            ("aaaa1111", "QUEUED"),
+            ("bbbb2222", "QUEUED"),
+            ("cccc3333", "COMPLETED"),
+            ("dddd4444", "RUNNING"),
+        ]:
+            models.SpearJob.objects.create(
+                patient_id="11223344",
+                celery_job_id=celery_job_id,
+                raystation_system=self.raystation_system,
+                status=job_status,
+            )
+        versions = dict(models.SpearJob.objects.values_list("celery_job_id", "version"))
+        started_at = datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=pytz.utc)
+        completed_at = datetime.datetime(2024, 1, 1, 13, 0, 0, tzinfo=pytz.utc)
+        items = [
+            {
+                "celery_job_id": "aaaa1111",
+                "status": "RUNNING",
+                "started_at": started_at,
+            },
+            {"celery_job_id": "bbbb2222", "status": "RUNNING"},
+            {"celery_job_id": "cccc3333", "status": "RUNNING"},
+            {"celery_job_id": "dddd4444", "status": "RUNNING", "worker_name": "w_sp1"},
+            {
+                "celery_job_id": "aaaa1111",
+                "status": "COMPLETED",
+                "completed_at": completed_at,
+            },
+        ]
+
+        with mock.patch.object(models.SpearJob, "save") as mock_save:
+            with CaptureQueriesContext(connection) as context:
+                results = services.bulk_update_spear_jobs(items=items)
+        mock_save.assert_not_called()
+        self.assertFalse(
+            any("FOR UPDATE" in query["sql"] for query in context.captured_queries)
+        )
+
+        self.assertEqual(
+            [result["result"] for result in results],
+            ["updated", "updated", "rejected", "updated", "updated"],
+        )
+        self.assertIn("COMPLETED to RUNNING", results[2]["errors"]["status"][0])
+        jobs = {job.celery_job_id: job for job in models.SpearJob.objects.all()}
+        self.assertEqual(jobs["aaaa1111"].status, "COMPLETED")
+        self.assertEqual(jobs["aaaa1111"].started_at, started_at)
+        self.assertEqual(jobs["aaaa1111"].completed_at, completed_at)
+        self.assertEqual(jobs["aaaa1111"].version, versions["aaaa1111"] + 2)
+        self.assertEqual(jobs["bbbb2222"].status, "RUNNING")
+        self.assertIsNone(jobs["bbbb2222"].started_at)
+        self.assertEqual(jobs["cccc3333"].version, versions["cccc3333"])
+        # a repeated status only sets the fields
+        self.assertEqual(jobs["dddd4444"].server_name, models.SpearServer.SP1)
+        self.assertEqual(jobs["dddd4444"].version, versions["dddd4444"] + 1)
+
+    def test_record_spear_job_heartbeats(self):
+        """Test heartbeats are recorded with one UPDATE and no save()."""
+        for celery_job_id in ["aaaa1111", "bbbb2222", "cccc3333"]:
+            models.SpearJob.objects.create(
+                patient_id="11223344",
+                celery_job_id=celery_job_id,
+                raystation_system=self.raystation_system,
+                status="RUNNING",
+            )
+        heartbeat = datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=pytz.utc)
+
+        with mock.patch.object(models.SpearJob, "save") as mock_save:
+            with self.assertNumQueries(1):
+                updated = services.record_spear_job_heartbeats(
+                    celery_job_ids=["aaaa1111", "bbbb2222", "dddd4444"],
+                    latest_heartbeat=heartbeat,
+                )
+        mock_save.assert_not_called()
+
+        self.assertEqual(updated, 2)
+        self.assertEqual(
+            models.SpearJob.objects.filter(latest_heartbeat=heartbeat).count(), 2
+        )
+        self.assertIsNone(
+            models.SpearJob.objects.get(celery_job_id="cccc3333").latest_heartbeat
+        )
+
     def test_revoke_spear_job_by_from_spear_id_success(self):
         """Test successful revocation of a spear job via service layer."""
         spear_job = models.SpearJob.objects.create(
@@ -187,6 +391,86 @@ class TestSpearJobServices(TestCase):
         )
         self.assertEqual(revoked_job.status, "REVOKED")
 
+    def test_update_spear_job_retries_on_concurrent_update(self):
+        """Test a compare-and-set losing to a concurrent update is retried on
+        the new version, without overwriting the concurrent change"""
+        spear_job = models.SpearJob.objects.create(
+            patient_id="11223344",
+            celery_job_id="7a4b5a64-ec4e-4a0f-a3e6-1c8dc3c977fb",
+            workflow_name="initial_workflow",
+            raystation_system=self.raystation_system,
+        )
+        compare_and_set = models.SpearJob.compare_and_set
+        versions = []
+
+        def concurrent_update(job, fields):
+            versions.append(job.version)
+            if len(versions) == 1:
+                models.SpearJob.objects.filter(pk=job.pk).update(
+                    workflow_name="other_workflow", version=F("version") + 1
+                )
+            return compare_and_set(job, fields)
+
+        with mock.patch.object(
+            models.SpearJob,
+            "compare_and_set",
+            autospec=True,
+            side_effect=concurrent_update,
+        ):
+            updated_job = services.update_spear_job(
+                spear_job_id=spear_job.id, data={"worker_name": "worker_sp1"}
+            )
+
+        self.assertEqual(versions, [1, 2])
+        spear_job.refresh_from_db()
+        self.assertEqual(spear_job.server_name, "HPTC-RAY-SP01")
+        self.assertEqual(spear_job.workflow_name, "other_workflow")
+        self.assertEqual(spear_job.version, updated_job.version)
+
+    def test_heartbeat_keeps_the_version(self):
+        """Test a heartbeat does not make a compare-and-set update fail"""
+        spear_job = models.SpearJob.objects.create(
+            patient_id="11223344",
+            celery_job_id="7a4b5a64-ec4e-4a0f-a3e6-1c8dc3c977fb",
+            raystation_system=self.raystation_system,
+        )
+        services.record_spear_job_heartbeats(celery_job_ids=[spear_job.celery_job_id])
+        updated_job = services.update_spear_job(
+            spear_job_id=spear_job.id,
+            data={"worker_name": "worker_sp1"},
+            expected_version=spear_job.version,
+        )
+        self.assertEqual(updated_job.version, spear_job.version + 1)
+        self.assertIsNotNone(updated_job.latest_heartbeat)
+
+    def test_update_spear_job_conflicts(self):
+        """Test an update expecting an old version, or losing every attempt,
+        raises SpearJobConflict and writes nothing"""
+        spear_job = models.SpearJob.objects.create(
+            patient_id="11223344",
+            celery_job_id="7a4b5a64-ec4e-4a0f-a3e6-1c8dc3c977fb",
+            workflow_name="initial_workflow",
+            raystation_system=self.raystation_system,
+        )
+        with self.assertRaises(services.SpearJobConflict):
+            services.update_spear_job(
+                spear_job_id=spear_job.id,
+                data={"status": "RUNNING", "append_log": "started"},
+                expected_version=spear_job.version - 1,
+            )
+        with mock.patch.object(
+            models.SpearJob, "compare_and_set", return_value=False
+        ) as mock_compare_and_set, self.assertRaises(services.SpearJobConflict):
+            services.update_spear_job(
+                spear_job_id=spear_job.id, data={"worker_name": "worker_sp1"}
+            )
+
+        self.assertEqual(mock_compare_and_set.call_count, services.UPDATE_MAX_ATTEMPTS)
+        spear_job.refresh_from_db()
+        self.assertEqual(spear_job.status, "PENDING")
+        self.assertIsNone(spear_job.worker_name)
+        self.assertIsNone(spear_job.get_logs())
+
     def test_revoke_spear_job_no_identifier_error(self):
         """Test that revoking a spear job without an identifier raises ValueError."""
         with self.assertRaises(ValueError) as context:
@@ -198,56 +482,42 @@ class TestSpearJobServices(TestCase):
 
 
 class TestSpearWorkflowConfigLoading(TestCase):
-    @patch("spear_job_api.services.resources.files")
-    def test_list_workflow_files(self, mock_files):
-        # Create fake Path objects
-        fake_path_1 = MagicMock()
-        fake_path_1.stem = "test_workflow_1"
-        fake_path_1.suffix = ".json"
-
-        fake_path_2 = MagicMock()
-        fake_path_2.stem = "test_workflow_2"
-        fake_path_2.suffix = ".json"
-
-        fake_non_json = MagicMock()
-        fake_non_json.stem = "non_workflow_file"
-        fake_non_json.suffix = ".txt"
-
-        # Mock pkg.iterdir()
-        fake_pkg = MagicMock()
-        fake_pkg.iterdir.return_value = [fake_path_2, fake_non_json, fake_path_1]
-
-        mock_files.return_value = fake_pkg
-
-        result = services.list_workflow_files()
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        workflow_dir = Path(tmp_dir.name)
+        (workflow_dir / "workflow_b.json").write_text(
+            '{"workflow_key1": "workflow_value1", "workflow_key2": 2}'
+        )
+        (workflow_dir / "workflow_a.json").write_text("{}")
+        (workflow_dir / "non_workflow_file.txt").write_text("ignored")
+        registry = WorkflowRegistry(directory=workflow_dir, check_interval=0)
+        patcher = patch("spear_job_api.services.workflow_registry", registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
-        self.assertEqual(result, ["test_workflow_1", "test_workflow_2"])
+    def test_list_workflow_files(self):
+        self.assertEqual(services.list_workflow_files(), ["workflow_a", "workflow_b"])
 
     def test_load_spear_workflow_config_no_filename(self):
         """Test loading workflow config with no filename raises FileNotFoundError."""
-        with self.assertRaises(FileNotFoundError) as context:
+        with self.assertRaises(FileNotFoundError):
             services.load_spear_workflow_config(filename=None)
 
     def test_load_spear_workflow_config_file_not_found(self):
         """Test loading workflow config with non-existent filename raises FileNotFoundError."""
-        with self.assertRaises(FileNotFoundError) as context:
+        with self.assertRaises(FileNotFoundError):
             services.load_spear_workflow_config(filename="non_existent_workflow")
 
-    @patch("spear_job_api.services.resources.read_text")
-    def test_load_spear_workflow_config_success(self, mock_read_text):
+    def test_load_spear_workflow_config_success(self):
         """Test successful loading of a workflow config."""
-        mock_read_text.return_value = (
-            '{"workflow_key1": "workflow_value1", "workflow_key2": 2}'
-        )
-
         config = services.load_spear_workflow_config("workflow_b")
 
-        mock_read_text.assert_called_once_with(
-            "spear_job_api.spear_workflows",
-            "workflow_b.json",
-            encoding="utf-8",
-        )
-
         self.assertEqual(
             config, {"workflow_key1": "workflow_value1", "workflow_key2": 2}
         )
+        # a copy, the registry's config is shared
+        config["workflow_key2"] = 3
+        self.assertEqual(
+            services.load_spear_workflow_config("workflow_b")["workflow_key2"], 2
+        )
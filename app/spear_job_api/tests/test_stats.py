@@ -0,0 +1,153 @@
+import datetime
+from unittest import mock
+from django.test import TestCase
+from django.utils import timezone
+from spear_job_api import models, stats
+
+
+class TestSpearJobStats(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.systems = [
+            models.RayStationSystem.objects.create(
+                system_name=f"System {i}", system_uid=f"UID{i}"
+            )
+            for i in range(2)
+        ]
+
+    def create_job(self, i, minutes_ago, **params):
+        with mock.patch(
+            "django.utils.timezone.now",
+            return_value=self.now - datetime.timedelta(minutes=minutes_ago),
+        ):
+            return models.SpearJob.objects.create(
+                patient_id=f"patient_{i}",
+                celery_job_id=f"{i:08x}",
+                raystation_system=self.systems[i % 2],
+                **params,
+            )
+
+    def test_percentiles(self):
+        """Test nearest-rank percentiles."""
+        self.assertEqual(
+            stats.percentiles(list(range(1, 101)), 50, 95), {"p50": 50, "p95": 95}
+        )
+        self.assertEqual(stats.percentiles([3.0], 50, 95), {"p50": 3.0, "p95": 3.0})
+        self.assertEqual(stats.percentiles([], 50), {"p50": None})
+
+    def test_compute_job_stats(self):
+        """Test counts per dimension and duration percentiles."""
+        self.create_job(0, 30, status="QUEUED", priority=2)
+        self.create_job(1, 10, status="QUEUED", priority=2)
+        self.create_job(
+            2,
+            60,
+            status="RUNNING",
+            priority=5,
+            worker_name="worker_sp1",
+            started_at=self.now - datetime.timedelta(minutes=50),
+        )
+        for i, wait in enumerate([1, 2, 3, 4], start=3):
+            self.create_job(
+                i,
+                120,
+                status="COMPLETED",
+                priority=5,
+                worker_name="worker_sp2",
+                started_at=self.now - datetime.timedelta(minutes=120 - wait),
+                completed_at=self.now - datetime.timedelta(minutes=60),
+            )
+        # completed before the stats window, no durations
+        self.create_job(
+            7,
+            3000,
+            status="COMPLETED",
+            started_at=self.now - datetime.timedelta(minutes=2999),
+            completed_at=self.now - datetime.timedelta(minutes=2990),
+        )
+
+        with self.assertNumQueries(3):
+            data = stats.compute_job_stats(self.now)
+
+        self.assertEqual(data["total"], 8)
+        self.assertEqual(
+            data["counts"]["status"], {"QUEUED": 2, "RUNNING": 1, "COMPLETED": 5}
+        )
+        self.assertEqual(data["counts"]["priority"], {"2": 2, "5": 6})
+        self.assertEqual(
+            data["counts"]["server_name"],
+            {"": 3, "HPTC-RAY-SP01": 1, "HPTC-RAY-SP02": 4},
+        )
+        self.assertEqual(
+            data["counts"]["raystation_system"], {"System 0": 4, "System 1": 4}
+        )
+        self.assertEqual(
+            data["oldest_queued_created_at"],
+            (self.now - datetime.timedelta(minutes=30)).isoformat(),
+        )
+        self.assertEqual(
+            data["queue_wait_seconds"], {"count": 4, "p50": 120.0, "p95": 240.0}
+        )
+        self.assertEqual(data["run_seconds"]["count"], 4)
+        self.assertEqual(data["run_seconds"]["p95"], 59 * 60.0)
+
+    def test_get_job_stats_serves_snapshot(self):
+        """Test the stats are computed once per max age and served from the table."""
+        self.create_job(0, 30, status="QUEUED")
+
+        data = stats.get_job_stats(max_age=60)
+        self.assertEqual(data["total"], 1)
+        self.assertAlmostEqual(data["oldest_queued_age_seconds"], 30 * 60, delta=5)
+
+        self.create_job(1, 10, status="QUEUED")
+        with mock.patch("spear_job_api.stats.compute_job_stats") as mock_compute:
+            data = stats.get_job_stats(max_age=60)
+        mock_compute.assert_not_called()
+        self.assertEqual(data["total"], 1)
+
+        self.assertEqual(stats.get_job_stats(max_age=0)["total"], 2)
+
+    def test_stale_snapshot_is_refreshed_once(self):
+        """Test one request claims the refresh of a stale snapshot, the others
+        serve the stale snapshot meanwhile"""
+        self.create_job(0, 30, status="QUEUED")
+        stats.get_job_stats(max_age=60)
+        self.create_job(1, 10, status="QUEUED")
+
+        snapshot = models.SpearJobStatsSnapshot.objects.get()
+        self.assertTrue(stats.claim_refresh(snapshot, self.now))
+        self.assertFalse(stats.claim_refresh(snapshot, self.now))
+
+        with mock.patch(
+            "spear_job_api.stats.claim_refresh", return_value=False
+        ), mock.patch("spear_job_api.stats.compute_job_stats") as mock_compute:
+            data = stats.get_job_stats(max_age=0)
+        mock_compute.assert_not_called()
+        self.assertEqual(data["total"], 1)
+
+        self.assertEqual(stats.get_job_stats(max_age=0)["total"], 2)
+
+    def test_failed_refresh_gives_the_claim_back(self):
+        """Test a refresh that fails restores the computed_at it claimed, so
+        the next request retries it"""
+        self.create_job(0, 30, status="QUEUED")
+        stats.get_job_stats(max_age=60)
+        computed_at = models.SpearJobStatsSnapshot.objects.get().computed_at
+        self.create_job(1, 10, status="QUEUED")
+
+        with mock.patch(
+            "spear_job_api.stats.compute_job_stats", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                stats.get_job_stats(max_age=0)
+        self.assertEqual(
+            models.SpearJobStatsSnapshot.objects.get().computed_at, computed_at
+        )
+
+        self.assertEqual(stats.get_job_stats(max_age=0)["total"], 2)
+
+    def test_percentile_sql(self):
+        query = models.SpearJob.objects.annotate(
+            p95=stats.PercentileDisc("priority", 95)
+        ).query
+        self.assertIn("percentile_disc(0.95) WITHIN GROUP (ORDER BY", str(query))
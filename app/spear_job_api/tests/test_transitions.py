@@ -0,0 +1,206 @@
+import importlib.util
+from pathlib import Path
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from spear_job_api import models, services
+from spear_job_api.events import status_event
+from spear_job_api.transitions import (
+    REQUEUE_TRANSITIONS,
+    TRANSITIONS,
+    SpearJobTransitionError,
+    allowed_from,
+    can_transition,
+)
+
+CELERY_JOB_ID = "52a92938-8fc1-4b04-8ab0-0d2a6111e76b"
+
+
+def create_job(**fields) -> models.SpearJob:
+    return models.SpearJob.objects.create(
+        patient_id="test_pid",
+        celery_job_id=CELERY_JOB_ID,
+        workflow_name="test_workflow",
+        raystation_system=models.RayStationSystem.objects.create(
+            system_name="TestSystem", system_uid="UID1234"
+        ),
+        **fields,
+    )
+
+
+class TestTransitionTable(TestCase):
+    def test_allowed_from_matches_the_table(self):
+        for current in models.SpearJobStatus.values:
+            for status_ in models.SpearJobStatus.values:
+                self.assertEqual(
+                    current in allowed_from(status_),
+                    current != status_ and status_ in TRANSITIONS[current],
+                )
+                requeue = status_ in REQUEUE_TRANSITIONS.get(current, ())
+                self.assertEqual(
+                    current in allowed_from(status_, allow_requeue=True),
+                    current in allowed_from(status_) or requeue,
+                )
+                if current == status_:
+                    self.assertTrue(can_transition(current, status_))
+
+    def test_requeue_is_internal(self):
+        """Test a job only goes back to the queue with allow_requeue"""
+        for current, targets in REQUEUE_TRANSITIONS.items():
+            for status_ in targets:
+                self.assertFalse(can_transition(current, status_))
+                self.assertTrue(can_transition(current, status_, allow_requeue=True))
+
+    def test_worker_table_matches(self):
+        """Test the copy of the table the workers check their updates with"""
+        path = (
+            Path(settings.BASE_DIR).parent
+            / "celery_worker"
+            / "spear_queue"
+            / "transitions.py"
+        )
+        if not path.exists():
+            self.skipTest("the worker is not checked out next to the app")
+        spec = importlib.util.spec_from_file_location("worker_transitions", path)
+        worker = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(worker)
+        self.assertEqual(
+            worker.TRANSITIONS,
+            {
+                current: tuple(str(status_) for status_ in targets)
+                for current, targets in TRANSITIONS.items()
+            },
+        )
+
+    def test_finished_jobs_do_not_run_again(self):
+        for finished in ("COMPLETED", "FAILED", "REVOKED"):
+            self.assertFalse(can_transition(finished, "RUNNING"))
+        self.assertEqual(TRANSITIONS["COMPLETED"], ())
+
+
+class TestTransitionSpearJobs(TestCase):
+    def setUp(self):
+        self.job = create_job(status="RUNNING")
+
+    def test_status_change_is_one_conditional_update(self):
+        """Test a status update writes the job with one UPDATE, without
+        reading it first, and publishes the change"""
+        with mock.patch(
+            "spear_job_api.services.publish_job_events"
+        ) as mock_publish, self.assertNumQueries(2):
+            # the conditional UPDATE, then the job is read back
+            job = services.transition_spear_job(
+                lookup={"pk": self.job.pk},
+                status="COMPLETED",
+                fields={"worker_name": "worker_sp2"},
+            )
+
+        self.assertEqual(job.status, "COMPLETED")
+        self.assertEqual(job.server_name, "HPTC-RAY-SP02")
+        self.assertEqual(job.version, self.job.version + 1)
+        mock_publish.assert_called_once_with([status_event(job.pk, "COMPLETED")])
+
+    def test_late_status_is_rejected(self):
+        """Test a late RUNNING of a completed job changes nothing"""
+        models.SpearJob.objects.filter(pk=self.job.pk).update(status="COMPLETED")
+
+        with self.assertRaises(SpearJobTransitionError):
+            services.update_spear_job(
+                celery_job_id=CELERY_JOB_ID,
+                data={"status": "RUNNING", "worker_name": "worker_sp1"},
+            )
+
+        job = models.SpearJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.status, job.worker_name), ("COMPLETED", None))
+
+    def test_repeated_status_sets_the_fields(self):
+        job = services.update_spear_job(
+            celery_job_id=CELERY_JOB_ID,
+            data={"status": "RUNNING", "worker_name": "worker_sp1"},
+        )
+        self.assertEqual((job.status, job.server_name), ("RUNNING", "HPTC-RAY-SP01"))
+
+    def test_worker_without_server_keeps_the_routed_server(self):
+        models.SpearJob.objects.filter(pk=self.job.pk).update(
+            server_name="HPTC-RAY-SP02"
+        )
+        job = services.update_spear_job(
+            celery_job_id=CELERY_JOB_ID,
+            data={"status": "COMPLETED", "worker_name": "worker_x"},
+        )
+        self.assertEqual(job.server_name, "HPTC-RAY-SP02")
+
+    def test_transition_many_jobs(self):
+        """Test only the jobs the change is allowed for are updated"""
+        other = models.SpearJob.objects.create(
+            patient_id="test_pid",
+            celery_job_id="3b7cd972-f5cf-4f12-9705-6b78de3236b4",
+            status="COMPLETED",
+            raystation_system_id=self.job.raystation_system_id,
+        )
+        changed = services.transition_spear_jobs(
+            models.SpearJob.objects.filter(patient_id="test_pid"), status="FAILED"
+        )
+        self.assertEqual(changed, 1)
+        self.assertEqual(
+            dict(models.SpearJob.objects.values_list("pk", "status")),
+            {self.job.pk: "FAILED", other.pk: "COMPLETED"},
+        )
+
+
+class TestTransitionsApi(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("user@example.com", "testpass123")
+        )
+        self.job = create_job(status="RUNNING")
+        self.url = reverse(
+            "spear_job_api:spearjob-by-celery-job-id", args=[CELERY_JOB_ID]
+        )
+
+    def test_celery_states_are_mapped(self):
+        res = self.client.patch(self.url, {"status": "SUCCESS"}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "COMPLETED")
+
+        res = self.client.patch(self.url, {"status": "RUNNING"}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+
+    def test_retry_of_a_revoked_job_is_rejected(self):
+        """Test a late RETRY of a worker does not requeue a revoked job"""
+        models.SpearJob.objects.filter(pk=self.job.pk).update(status="REVOKED")
+        res = self.client.patch(self.url, {"status": "RETRY"}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        res = self.client.patch(
+            reverse("spear_job_api:spearjob-detail", args=[self.job.pk]),
+            {"status": "QUEUED"},
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "REVOKED")
+
+    def test_bulk_update_rejects_illegal_transitions(self):
+        res = self.client.post(
+            reverse("spear_job_api:spearjob-bulk-update"),
+            [
+                {"celery_job_id": CELERY_JOB_ID, "status": "FAILURE"},
+                {"celery_job_id": CELERY_JOB_ID, "status": "RUNNING"},
+            ],
+            format="json",
+        )
+        self.assertEqual(
+            [item["result"] for item in res.json()], ["updated", "rejected"]
+        )
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "FAILED")
+
+    def test_transitions_endpoint(self):
+        res = self.client.get(reverse("spear_job_api:spearjob-transitions"))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["transitions"]["COMPLETED"], [])
+        self.assertEqual(res.data["celery_states"]["SUCCESS"], "COMPLETED")
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+from django.test import TestCase
+from spear_job_api.workflows import WorkflowRegistry, workflow_registry
+
+
+class TestWorkflowRegistry(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.workflow_dir = Path(tmp_dir.name)
+        self.workflow_file = self.workflow_dir / "workflow_a.json"
+        self.workflow_file.write_text('{"key": 1}')
+        self.registry = WorkflowRegistry(directory=self.workflow_dir, check_interval=0)
+
+    def test_get_parses_each_file_once(self):
+        """Test a workflow file is read and parsed once while it is unchanged."""
+        self.assertEqual(self.registry.get("workflow_a").config, {"key": 1})
+
+        with patch("spear_job_api.workflows.json.loads") as mock_loads:
+            with patch.object(Path, "read_bytes") as mock_read_bytes:
+                self.registry.get("workflow_a")
+                self.registry.names()
+        mock_read_bytes.assert_not_called()
+        mock_loads.assert_not_called()
+
+    def test_changed_file_is_reloaded_with_new_etag(self):
+        """Test a changed file is parsed again and gets a new ETag."""
+        etag = self.registry.get("workflow_a").etag
+
+        self.workflow_file.write_text('{"key": 22}')
+
+        template = self.registry.get("workflow_a")
+        self.assertEqual(template.config, {"key": 22})
+        self.assertNotEqual(template.etag, etag)
+
+    def test_touched_file_keeps_etag(self):
+        """Test a file with a new mtime but the same content keeps its ETag."""
+        template = self.registry.get("workflow_a")
+        stat = self.workflow_file.stat()
+        os.utime(self.workflow_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        touched = self.registry.get("workflow_a")
+        self.assertEqual(touched.etag, template.etag)
+        self.assertIs(touched.config, template.config)
+
+    def test_check_interval_throttles_stat(self):
+        """Test the files are not checked again within the check interval."""
+        registry = WorkflowRegistry(directory=self.workflow_dir, check_interval=60)
+        registry.names()
+        (self.workflow_dir / "workflow_b.json").write_text("{}")
+
+        self.assertEqual(registry.names(), ["workflow_a"])
+        registry.refresh(force=True)
+        self.assertEqual(registry.names(), ["workflow_a", "workflow_b"])
+
+    def test_unknown_workflow(self):
+        """Test getting an unknown workflow raises FileNotFoundError."""
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get("non_existent_workflow")
+
+    def test_get_config_returns_a_copy(self):
+        """Test callers cannot modify the cached config."""
+        config = self.registry.get_config("workflow_a")
+        config["key"] = "changed"
+        self.assertEqual(self.registry.get("workflow_a").config, {"key": 1})
+
+    def test_packaged_workflows(self):
+        """Test the default registry serves the packaged workflow files."""
+        self.assertIn("hn_workflow", workflow_registry.names())
+        config = workflow_registry.get("hn_workflow").config
+        self.assertEqual(config["General"]["ProtocolName"], "hn_workflow")
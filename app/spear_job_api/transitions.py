@@ -0,0 +1,114 @@
+"""The life cycle of a spear job: the status changes that are allowed.
+
+TRANSITIONS maps every status to the statuses a job may change to from it.
+A job is created PENDING (scheduled, see spear_queue.scheduler, or created
+through the API) or QUEUED, runs and finishes COMPLETED, FAILED or REVOKED.
+Nothing leaves COMPLETED. Repeating the current status is always allowed,
+the update is then idempotent.
+
+REQUEUE_TRANSITIONS puts a job back in the queue: the stale job reaper
+requeues a RUNNING job as PENDING or QUEUED (spear_queue.reaper), a failed
+or revoked step of a job graph is retried as QUEUED
+(spear_queue.graphs.retry_spear_job_graph). Only these internal paths pass
+allow_requeue, the API and the workers cannot requeue a job, so a late
+update of a worker does not bring a finished job back.
+
+The status updates of the service layer are single conditional UPDATEs
+(services.transition_spear_jobs) filtering on allowed_from(status), so an
+illegal or out-of-order update, like a late RUNNING of a job that already
+COMPLETED, changes nothing and is rejected without reading the job first.
+The derived status of a job graph parent (services.update_spear_job_graph_status)
+is not a transition.
+
+The update serializers also accept Celery task states, CELERY_STATES maps
+them to job statuses. The tables and the mapping are served at
+/api/spear-jobs/transitions/, the workers check their updates against a
+copy of TRANSITIONS (celery_worker/spear_queue/transitions.py).
+"""
+
+from .models import SpearJobStatus
+
+# to COMPLETED or FAILED without RUNNING: the start and the end of a short
+# task are coalesced into one update by the worker's status reporter
+_STARTED = (
+    SpearJobStatus.RUNNING,
+    SpearJobStatus.COMPLETED,
+    SpearJobStatus.FAILED,
+    SpearJobStatus.REVOKED,
+)
+
+TRANSITIONS: dict[str, tuple[str, ...]] = {
+    # jobs created through the API (not enqueued by spear_queue) stay
+    # PENDING until a worker runs them
+    SpearJobStatus.PENDING: (SpearJobStatus.QUEUED, *_STARTED),
+    SpearJobStatus.QUEUED: _STARTED,
+    SpearJobStatus.RUNNING: (
+        SpearJobStatus.COMPLETED,
+        SpearJobStatus.FAILED,
+        SpearJobStatus.REVOKED,
+    ),
+    SpearJobStatus.COMPLETED: (),
+    SpearJobStatus.FAILED: (),
+    SpearJobStatus.REVOKED: (),
+}
+
+REQUEUE_TRANSITIONS: dict[str, tuple[str, ...]] = {
+    SpearJobStatus.RUNNING: (SpearJobStatus.PENDING, SpearJobStatus.QUEUED),
+    SpearJobStatus.FAILED: (SpearJobStatus.QUEUED,),
+    SpearJobStatus.REVOKED: (SpearJobStatus.QUEUED,),
+}
+
+# Celery task state -> job status, Celery's PENDING (an unknown task) is
+# left out, it would shadow the job status
+CELERY_STATES: dict[str, str] = {
+    "RECEIVED": SpearJobStatus.QUEUED,
+    "STARTED": SpearJobStatus.RUNNING,
+    # the task is queued again by Celery, the job only leaves RUNNING for a
+    # final status: a retry is not a status change of a started job
+    "RETRY": SpearJobStatus.QUEUED,
+    "SUCCESS": SpearJobStatus.COMPLETED,
+    "FAILURE": SpearJobStatus.FAILED,
+    "REJECTED": SpearJobStatus.FAILED,
+    "REVOKED": SpearJobStatus.REVOKED,
+}
+
+
+def _targets(current: str, allow_requeue: bool) -> tuple[str, ...]:
+    targets = TRANSITIONS.get(current, ())
+    if allow_requeue:
+        targets += REQUEUE_TRANSITIONS.get(current, ())
+    return targets
+
+
+# (status, allow_requeue) -> the statuses the change is allowed from
+_ALLOWED_FROM: dict[tuple[str, bool], list[str]] = {
+    (status, allow_requeue): sorted(
+        current for current in TRANSITIONS if status in _targets(current, allow_requeue)
+    )
+    for status in SpearJobStatus.values
+    for allow_requeue in (False, True)
+}
+
+
+class SpearJobTransitionError(Exception):
+    """A status change the job life cycle does not allow."""
+
+    def __init__(self, job_id: int, current: str, status: str):
+        super().__init__(
+            f"Spear job {job_id} cannot change from {current} to {status}."
+        )
+        self.job_id = job_id
+        self.current = current
+        self.status = status
+
+
+def allowed_from(status: str, *, allow_requeue: bool = False) -> list[str]:
+    """The statuses a job may change to `status` from, `status` itself
+    excluded. The REQUEUE_TRANSITIONS are included with allow_requeue."""
+    return _ALLOWED_FROM[status, allow_requeue]
+
+
+def can_transition(current: str, status: str, *, allow_requeue: bool = False) -> bool:
+    """Whether a job may change from `current` to `status`, with the
+    REQUEUE_TRANSITIONS if allow_requeue."""
+    return current == status or status in _targets(current, allow_requeue)
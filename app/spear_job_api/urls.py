@@ -1,8 +1,8 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 
 
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register("spear-jobs", views.SpearJobViewSet, basename="spearjob")
@@ -10,4 +10,30 @@ router.register("spear-workflows", views.SpearWorkflowViewSet, basename="spearwo
 
 app_name = "spear_job_api"
 
-urlpatterns = [path("", include(router.urls))]
+# async versions of the endpoints the workers call the most
+async_urlpatterns = [
+    path("<int:id>/", async_views.retrieve, name="async-spearjob-detail"),
+    path("<int:id>/events/", async_views.job_events, name="async-spearjob-events"),
+    path("events/", async_views.events, name="async-spearjob-events-list"),
+    path("heartbeat/", async_views.heartbeat, name="async-spearjob-heartbeat"),
+    re_path(
+        r"^by-celery/(?P<celery_job_id>[0-9a-f-]+)/$",
+        async_views.retrieve_by_celery_job_id,
+        name="async-spearjob-by-celery-job-id",
+    ),
+    re_path(
+        r"^by-celery/(?P<celery_job_id>[0-9a-f-]+)/heartbeat/$",
+        async_views.heartbeat_by_celery_job_id,
+        name="async-spearjob-heartbeat-by-celery-job-id",
+    ),
+    re_path(
+        r"^by-celery/(?P<celery_job_id>[0-9a-f-]+)/logs/$",
+        async_views.append_logs_by_celery_job_id,
+        name="async-spearjob-append-logs-by-celery-job-id",
+    ),
+]
+
+urlpatterns = [
+    path("", include(router.urls)),
+    path("async/spear-jobs/", include(async_urlpatterns)),
+]
@@ -6,22 +6,49 @@ from rest_framework.response import Response
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import serializers as rest_framework_serializers
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db import transaction
+from django.utils.http import parse_etags
 from .serializers import (
+    SpearJobBatchHeartbeatSerializer,
     SpearJobCreateSerializer,
     SpearJobDetailSerializer,
+    SpearJobHeartbeatSerializer,
+    SpearJobBulkRevokeSerializer,
+    SpearJobListSerializer,
+    SpearJobRevokeSerializer,
     SpearJobUpdateSerializer,
 )
+from .filters import SpearJobFilterBackend
+from .pagination import SpearJobKeysetPagination
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from . import models
+from .archive import find_spear_job
+from .detail import (
+    defer_logs,
+    if_match_version,
+    job_etag,
+    parse_log_selection,
+    read_logs,
+)
 from .services import (
+    SpearJobConflict,
+    bulk_update_spear_jobs,
     create_spear_job,
+    record_spear_job_heartbeats,
+    revoke_spear_job,
+    revoke_spear_jobs,
     update_spear_job,
-    list_workflow_files,
-    load_spear_workflow_config,
 )
+from .stats import get_job_stats
+from .transitions import (
+    CELERY_STATES,
+    REQUEUE_TRANSITIONS,
+    TRANSITIONS,
+    SpearJobTransitionError,
+)
+from .workflows import workflow_registry
 
 
 class SpearJobViewSet(
@@ -35,56 +62,286 @@ class SpearJobViewSet(
 
     queryset = models.SpearJob.objects.all()
     lookup_field = "id"
+    bulk_update_max_items = 1000
+    pagination_class = SpearJobKeysetPagination
+    filter_backends = [SpearJobFilterBackend]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "list":
+            return queryset.for_list()
+        return queryset.with_config()
 
     action_serializer_classes = {
         "create": SpearJobCreateSerializer,
         "update": SpearJobUpdateSerializer,
         "partial_update": SpearJobUpdateSerializer,
         "retrieve": SpearJobDetailSerializer,
-        "list": SpearJobDetailSerializer,
+        "list": SpearJobListSerializer,
         "by_celery_job_id": SpearJobDetailSerializer,
     }
 
     def get_serializer_class(self):
         return self.action_serializer_classes.get(self.action, SpearJobDetailSerializer)
 
+    def render_job(self, request, **lookup):
+        """Render the job with the lookup (see find_spear_job) for the detail
+        endpoints, with the partial and conditional reads of
+        spear_job_api.detail."""
+        fields = SpearJobDetailSerializer.parse_fields(request.query_params)
+        selection = parse_log_selection(request.query_params)
+        try:
+            job = find_spear_job(**lookup, defer_logs=defer_logs(fields, selection))
+        except models.SpearJob.DoesNotExist:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        def get_data():
+            context = self.get_serializer_context() | {"fields": fields}
+            extra = {}
+            if fields is None or "logs" in fields:
+                context["logs"], extra = read_logs(job, selection)
+            return SpearJobDetailSerializer(job, context=context).data | extra
+
+        etag = job_etag(job, request.query_params)
+        return conditional_response(request, etag, get_data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a Spear job by its id, archived jobs included."""
+        try:
+            spear_job_id = int(kwargs["id"])
+        except ValueError:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return self.render_job(request, spear_job_id=spear_job_id)
+
     def perform_create(self, serializer):
         """Create a Spear job using the service layer."""
         create_spear_job(data=self.request.data)
 
     @action(
         detail=False,
-        methods=["get"],
+        methods=["get", "patch"],
         url_path="by-celery/(?P<celery_job_id>[0-9a-f-]+)",
     )
     def by_celery_job_id(self, request, celery_job_id=None):
-        """Retrieve a Spear job by its celery job ID."""
+        """Retrieve or partially update a Spear job by its celery job ID.
+
+        Workers only know the celery task id, so they report status here."""
+        if request.method == "PATCH":
+            return self.update_job(request, celery_job_id=celery_job_id)
+        return self.render_job(request, celery_job_id=celery_job_id)
+
+    @action(detail=True, methods=["get"], url_path="logs")
+    def logs(self, request, id=None):
+        """Stream the log of a Spear job as plain text, one entry per line.
+
+        Pass ?after=<sequence> to only receive the entries logged after the
+        given log chunk sequence number."""
+        job = self.get_object()
+        after = request.query_params.get("after")
+        try:
+            after_sequence = int(after) if after is not None else None
+        except ValueError:
+            return Response(
+                {"detail": "'after' must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if after_sequence is None:
+            entries = job.iter_logs()
+        else:
+            entries = models.SpearJobLogChunk.objects.iter_text(
+                job_id=job.pk, after_sequence=after_sequence
+            )
+        return StreamingHttpResponse(
+            (f"{entry}\n" for entry in entries),
+            content_type="text/plain; charset=utf-8",
+        )
+
+    @action(detail=False, methods=["post"], url_path="heartbeat")
+    def heartbeat(self, request):
+        """Record a heartbeat for many Spear jobs, identified by celery_job_ids,
+        with a single UPDATE and without locking or saving the jobs."""
+        serializer = SpearJobBatchHeartbeatSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = record_spear_job_heartbeats(**serializer.validated_data)
+        return Response({"updated": updated})
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="by-celery/(?P<celery_job_id>[0-9a-f-]+)/heartbeat",
+    )
+    def heartbeat_by_celery_job_id(self, request, celery_job_id=None):
+        """Record a heartbeat for a Spear job by its celery job ID."""
+        serializer = SpearJobHeartbeatSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not record_spear_job_heartbeats(
+            celery_job_ids=[celery_job_id], **serializer.validated_data
+        ):
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=["get"], url_path="stats")
+    def stats(self, request):
+        """Queue statistics: counts per status, priority, server and RayStation
+        system, the age of the oldest QUEUED job and the p50/p95 queue-wait and
+        run durations of the recently completed jobs.
+
+        Served from a summary table that is refreshed by the refresh_job_stats
+        command, or by one request once it is older than
+        SPEAR_JOB_STATS_MAX_AGE seconds."""
+        return Response(get_job_stats())
+
+    @action(detail=True, methods=["post"], url_path="revoke")
+    def revoke(self, request, id=None):
+        """Revoke a Spear job, with its steps if it is a job graph, and its
+        Celery task: a queued task is dropped before it runs, a running one
+        is killed with {"terminate": true}."""
+        serializer = SpearJobRevokeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            job = revoke_spear_job(spear_job_id=int(id), **serializer.validated_data)
+        except (ValueError, models.SpearJob.DoesNotExist):
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        except SpearJobTransitionError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(SpearJobUpdateSerializer(job).data)
+
+    @action(detail=False, methods=["post"], url_path="revoke")
+    def bulk_revoke(self, request):
+        """Revoke the unfinished Spear jobs of a patient, of a RayStation
+        system and/or with the given celery_job_ids, and their Celery tasks,
+        in one request. The response lists the celery_job_ids revoked."""
+        serializer = SpearJobBulkRevokeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        jobs = models.SpearJob.objects.all()
+        if "patient_id" in data:
+            jobs = jobs.filter(patient_id=data["patient_id"])
+        if "raystation_system" in data:
+            jobs = jobs.filter(raystation_system__system_name=data["raystation_system"])
+        if "celery_job_ids" in data:
+            jobs = jobs.filter(celery_job_id__in=data["celery_job_ids"])
+        revoked = revoke_spear_jobs(jobs=jobs, terminate=data["terminate"])
+        return Response({"revoked": revoked})
+
+    @action(detail=False, methods=["get"], url_path="transitions")
+    def transitions(self, request):
+        """The job life cycle: the statuses each status may change to through
+        the API, the requeues only the reaper and the job graph retry make,
+        and the job status of the Celery task states the workers may report."""
+        return Response(
+            {
+                "transitions": {
+                    current: list(targets) for current, targets in TRANSITIONS.items()
+                },
+                "requeue_transitions": {
+                    current: list(targets)
+                    for current, targets in REQUEUE_TRANSITIONS.items()
+                },
+                "celery_states": CELERY_STATES,
+            }
+        )
+
+    @action(detail=False, methods=["post"], url_path="bulk-update")
+    def bulk_update(self, request):
+        """Update many Spear jobs, identified by celery_job_id, in one request.
+
+        The body is a list of items with a celery_job_id and the fields to
+        update. The response holds a result per item: updated, not_found,
+        invalid (with the validation errors) or rejected (a status change
+        the job life cycle does not allow)."""
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {"detail": "Expected a list of items."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > self.bulk_update_max_items:
+            return Response(
+                {"detail": f"At most {self.bulk_update_max_items} items are allowed."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(bulk_update_spear_jobs(items=items))
+
+    def update(self, request, *args, **kwargs):
+        """Update a Spear job (PUT, or PATCH through partial_update)."""
         try:
-            job = models.SpearJob.objects.get(celery_job_id=celery_job_id)
+            spear_job_id = int(kwargs["id"])
+        except ValueError:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return self.update_job(
+            request, partial=kwargs.get("partial", False), spear_job_id=spear_job_id
+        )
+
+    def update_job(self, request, partial=True, **lookup):
+        """Update a job through the service layer, without row locks.
+
+        With an If-Match header (an ETag of the job or "VERSION") the job is
+        only updated if it did not change since, else the response is 412.
+        A status change the job life cycle does not allow (see
+        spear_job_api.transitions), or a job that kept changing under
+        concurrent updates, gives a 409."""
+        expected_version = if_match_version(request.headers.get("If-Match"))
+        try:
+            job = update_spear_job(
+                data=request.data,
+                expected_version=expected_version,
+                partial=partial,
+                **lookup,
+            )
         except models.SpearJob.DoesNotExist:
             return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        except SpearJobTransitionError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except SpearJobConflict as exc:
+            return Response(
+                {"detail": str(exc)},
+                status=(
+                    status.HTTP_412_PRECONDITION_FAILED
+                    if expected_version is not None
+                    else status.HTTP_409_CONFLICT
+                ),
+            )
+        return Response(SpearJobUpdateSerializer(job).data)
+
+
+def not_modified(request, etag: str) -> bool:
+    """Return True if the request's If-None-Match matches the ETag."""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    # weak comparison, as for GET requests
+    return "*" in etags or etag.removeprefix("W/") in {
+        tag.removeprefix("W/") for tag in etags
+    }
 
-        serializer = self.get_serializer(job)
-        return Response(serializer.data)
 
-    @transaction.atomic
-    def partial_update(self, request, *args, **kwargs):
-        # ensure row lock during append to avoid lost updates
-        self.get_object()  # fetches instance; DB transaction + save()
-        return super().partial_update(request, *args, **kwargs)
+def conditional_response(request, etag: str, get_data) -> Response:
+    """Return 304 if the client has the current version, else the data."""
+    if not_modified(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(get_data())
+    response["ETag"] = etag
+    return response
 
 
 class SpearWorkflowViewSet(viewsets.ViewSet):
-    """ViewSet to list available Spear workflows."""
+    """ViewSet to list available Spear workflows.
+
+    The workflows are served from the in-process workflow registry and
+    support conditional requests with If-None-Match."""
 
     lookup_field = "workflow_name"
     lookup_url_kwarg = "workflow_name"
 
     def list(self, request):
         """List available Spear workflows."""
-
-        workflows = list_workflow_files()
-        return Response(workflows)
+        return conditional_response(
+            request, workflow_registry.list_etag, workflow_registry.names
+        )
 
     def retrieve(self, request, workflow_name=None):
         """
@@ -92,10 +349,10 @@ class SpearWorkflowViewSet(viewsets.ViewSet):
         Example: GET /spearworkflows/workflow_a/
         """
         try:
-            config = load_spear_workflow_config(workflow_name)
+            template = workflow_registry.get(workflow_name)
         except FileNotFoundError:
             return Response(
                 {"detail": f"Workflow '{workflow_name}' not found."},
                 status=status.HTTP_404_NOT_FOUND,
             )
-        return Response(config)
+        return conditional_response(request, template.etag, lambda: template.config)
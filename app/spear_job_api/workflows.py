@@ -0,0 +1,129 @@
+"""In-process registry of the Spear workflow templates."""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from importlib import resources
+from pathlib import Path
+
+
+@dataclass(frozen=True)
+class WorkflowTemplate:
+    """A parsed workflow template file."""
+
+    name: str
+    config: dict
+    etag: str
+    mtime_ns: int
+    size: int
+
+
+class WorkflowRegistry:
+    """Load and parse the workflow JSON files once and serve them from memory.
+
+    The files are stat()ed at most every `check_interval` seconds. A file is
+    only read again if its mtime or size changed, and only parsed again (with
+    a new ETag) if its content hash changed. Added and removed files are
+    picked up by the same check.
+    """
+
+    def __init__(
+        self,
+        package: str = "spear_job_api.spear_workflows",
+        *,
+        directory: Path | None = None,
+        check_interval: float = 1.0,
+    ):
+        self.package = package
+        self._directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._templates: dict[str, WorkflowTemplate] = {}
+        self._list_etag = ""
+        self._checked_at: float | None = None
+
+    @property
+    def directory(self) -> Path:
+        if self._directory is None:
+            self._directory = Path(str(resources.files(self.package)))
+        return self._directory
+
+    def refresh(self, force: bool = False) -> None:
+        """Reload the templates whose file changed since the last check."""
+        now = time.monotonic()
+        if (
+            not force
+            and self._checked_at is not None
+            and now - self._checked_at < self.check_interval
+        ):
+            return
+
+        with self._lock:
+            templates = {}
+            for path in self.directory.iterdir():
+                if path.suffix.lower() != ".json":
+                    continue
+                stat = path.stat()
+                cached = self._templates.get(path.stem)
+                if (
+                    cached is not None
+                    and cached.mtime_ns == stat.st_mtime_ns
+                    and cached.size == stat.st_size
+                ):
+                    templates[path.stem] = cached
+                    continue
+                templates[path.stem] = self._load(path, stat, cached)
+
+            self._templates = templates
+            self._list_etag = self._make_etag("\n".join(sorted(templates)).encode())
+            self._checked_at = now
+
+    def _load(self, path: Path, stat, cached: WorkflowTemplate | None):
+        raw = path.read_bytes()
+        etag = self._make_etag(raw)
+        if cached is not None and cached.etag == etag:
+            # touched but not changed, keep the parsed config
+            config = cached.config
+        else:
+            config = json.loads(raw.decode("utf-8"))
+        return WorkflowTemplate(
+            name=path.stem,
+            config=config,
+            etag=etag,
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+        )
+
+    @staticmethod
+    def _make_etag(raw: bytes) -> str:
+        return f'"{hashlib.sha256(raw).hexdigest()[:32]}"'
+
+    def names(self) -> list[str]:
+        """Return the sorted workflow names."""
+        self.refresh()
+        return sorted(self._templates)
+
+    @property
+    def list_etag(self) -> str:
+        """ETag of the list of workflow names."""
+        self.refresh()
+        return self._list_etag
+
+    def get(self, name: str | None) -> WorkflowTemplate:
+        """Return the template of a workflow. The config is shared, do not
+        modify it. Raises FileNotFoundError for an unknown workflow."""
+        self.refresh()
+        try:
+            return self._templates[name]
+        except KeyError:
+            raise FileNotFoundError(f"Workflow '{name}' not found.")
+
+    def get_config(self, name: str | None) -> dict:
+        """Return a copy of the default config of a workflow."""
+        return copy.deepcopy(self.get(name).config)
+
+
+workflow_registry = WorkflowRegistry()
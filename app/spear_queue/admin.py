@@ -1,3 +1,18 @@
 from django.contrib import admin
+from . import models
 
-# Register your models here.
+
+class SpearJobOutboxEntryAdmin(admin.ModelAdmin):
+    list_display = ("job", "created_at", "attempts", "next_attempt_at", "last_error")
+    list_select_related = ["job"]
+    readonly_fields = (
+        "job",
+        "payload",
+        "created_at",
+        "attempts",
+        "next_attempt_at",
+        "last_error",
+    )
+
+
+admin.site.register(models.SpearJobOutboxEntry, SpearJobOutboxEntryAdmin)
@@ -0,0 +1,315 @@
+"""Throughput benchmarks of the spear job API and of the enqueue path.
+
+Every scenario is an operation run `ops` times by `concurrency` threads, each
+with its own database connection and test client, against the configured
+database. Use a file SQLite or a Postgres database, the in-memory SQLite
+database is not shared between threads.
+
+The contention scenario sends the heartbeats, log appends and status updates
+of all threads to one job, the updates race on its version (see
+spear_job_api.services.update_spear_job_fields): a 409 counts as an error.
+"""
+
+import itertools
+import json
+import logging
+import subprocess
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from spear_job_api.models import RayStationSystem, SpearJob
+from spear_job_api.services import bulk_create_spear_jobs
+from spear_job_api.stats import percentiles
+from spear_queue.outbox import relay_all
+from spear_queue.tasks import bulk_enqueue_spear_jobs, enqueue_spear_job
+
+logger = logging.getLogger(__name__)
+
+BULK_SIZE = 100
+
+
+@dataclass
+class ScenarioResult:
+    """Result of a scenario, durations are in milliseconds."""
+
+    ops: int
+    errors: int
+    ops_per_sec: float
+    p50_ms: float | None
+    p95_ms: float | None
+    p99_ms: float | None
+    queries_per_op: float
+
+
+class BenchmarkContext:
+    """The jobs and the RayStation system the scenarios work on."""
+
+    def __init__(self, jobs: int):
+        self.raystation_system = RayStationSystem.objects.create(
+            system_name=f"benchmark-{uuid.uuid4()}", system_uid=str(uuid.uuid4())
+        )
+        self.jobs = SpearJob.objects.bulk_create(
+            SpearJob(
+                patient_id=f"benchmark_{i}",
+                celery_job_id=str(uuid.uuid4()),
+                status="RUNNING",
+                workflow_name="benchmark",
+                workflow_config={"key": "value"},
+                raystation_system=self.raystation_system,
+            )
+            for i in range(jobs)
+        )
+        self._local = threading.local()
+
+    @property
+    def producer(self):
+        """A producer on an in-process broker, the enqueue scenarios measure
+        our code and not RabbitMQ."""
+        if not hasattr(self._local, "producer"):
+            app = enqueue_spear_job.app
+            self._local.producer = app.amqp.Producer(
+                app.connection_for_write("memory://")
+            )
+        return self._local.producer
+
+    @property
+    def client(self) -> Client:
+        if not hasattr(self._local, "client"):
+            self._local.client = Client(HTTP_HOST="localhost")
+        return self._local.client
+
+    def job(self, i: int) -> SpearJob:
+        return self.jobs[i % len(self.jobs)]
+
+    def payload(self, i: int) -> dict:
+        return {
+            "patient_id": f"benchmark_{i}",
+            "priority": i % 10 + 1,
+            "raystation_system": self.raystation_system.system_name,
+            "workflow_name": "benchmark",
+            "workflow_config": {"key": "value"},
+        }
+
+    def cleanup(self) -> None:
+        # cascades to the jobs, their log chunks and outbox entries
+        self.raystation_system.delete()
+
+
+def _create(context, i):
+    return context.client.post(
+        "/api/spear-jobs/",
+        context.payload(i) | {"celery_job_id": str(uuid.uuid4())},
+        content_type="application/json",
+    ).status_code
+
+
+def _bulk_create(context, i):
+    bulk_create_spear_jobs(
+        data=[
+            context.payload(i) | {"celery_job_id": str(uuid.uuid4())}
+            for _ in range(BULK_SIZE)
+        ]
+    )
+
+
+def _append_log(context, i):
+    return context.client.patch(
+        f"/api/spear-jobs/by-celery/{context.job(i).celery_job_id}/",
+        {"append_log": f"benchmark log entry {i}"},
+        content_type="application/json",
+    ).status_code
+
+
+def _heartbeat(context, i):
+    return context.client.post(
+        f"/api/spear-jobs/by-celery/{context.job(i).celery_job_id}/heartbeat/",
+        content_type="application/json",
+    ).status_code
+
+
+def _contention(context, i):
+    # heartbeats, log appends and status updates racing on the same job
+    if i % 3 == 0:
+        return _heartbeat(context, 0)
+    if i % 3 == 1:
+        return _append_log(context, 0)
+    return context.client.patch(
+        f"/api/spear-jobs/by-celery/{context.job(0).celery_job_id}/",
+        {"status": "RUNNING", "worker_name": f"benchmark_sp1_{i}"},
+        content_type="application/json",
+    ).status_code
+
+
+def _list(context, i):
+    return context.client.get("/api/spear-jobs/?page_size=100").status_code
+
+
+def _by_celery(context, i):
+    return context.client.get(
+        f"/api/spear-jobs/by-celery/{context.job(i).celery_job_id}/"
+    ).status_code
+
+
+def _enqueue(context, i, count=1):
+    # one patient per job, identical payloads would be deduplicated
+    bulk_enqueue_spear_jobs([context.payload(i * count + j) for j in range(count)])
+    relay_all(producer=context.producer)
+
+
+def _bulk_enqueue(context, i):
+    _enqueue(context, i, BULK_SIZE)
+
+
+# name -> operation, an operation returns an HTTP status code or None
+SCENARIOS = {
+    "create": _create,
+    "bulk-create": _bulk_create,
+    "append-log": _append_log,
+    "heartbeat": _heartbeat,
+    "contention": _contention,
+    "list": _list,
+    "by-celery": _by_celery,
+    "enqueue": _enqueue,
+    "bulk-enqueue": _bulk_enqueue,
+}
+
+
+def run_scenario(operation, context, *, ops: int, concurrency: int) -> ScenarioResult:
+    """Run `operation` `ops` times over `concurrency` threads."""
+    counter = itertools.count()
+    lock = threading.Lock()
+    durations, queries, errors = [], [0], [0]
+
+    def worker():
+        local_durations, local_queries, local_errors = [], 0, 0
+        while (i := next(counter)) < ops:
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                try:
+                    status = operation(context, i)
+                    failed = status is not None and status >= 400
+                except Exception:
+                    logger.debug("Benchmark operation failed", exc_info=True)
+                    failed = True
+                local_durations.append((time.perf_counter() - start) * 1000)
+            local_queries += len(captured.captured_queries)
+            local_errors += failed
+        with lock:
+            durations.extend(local_durations)
+            queries[0] += local_queries
+            errors[0] += local_errors
+
+    def thread_worker():
+        try:
+            worker()
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        # in the calling thread, e.g. inside a test transaction
+        worker()
+    else:
+        threads = [threading.Thread(target=thread_worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    points = percentiles(durations, 50, 95, 99)
+    return ScenarioResult(
+        ops=ops,
+        errors=errors[0],
+        ops_per_sec=ops / elapsed if elapsed else 0.0,
+        p50_ms=points["p50"],
+        p95_ms=points["p95"],
+        p99_ms=points["p99"],
+        queries_per_op=queries[0] / ops if ops else 0.0,
+    )
+
+
+def run_suite(
+    scenarios: list[str], *, ops: int, concurrency: int, jobs: int = 100
+) -> dict:
+    """Run the scenarios and return the results with the run metadata."""
+    context = BenchmarkContext(jobs)
+    try:
+        results = {
+            name: asdict(
+                run_scenario(SCENARIOS[name], context, ops=ops, concurrency=concurrency)
+            )
+            for name in scenarios
+        }
+    finally:
+        context.cleanup()
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "database": connection.vendor,
+            "ops": ops,
+            "concurrency": concurrency,
+            "bulk_size": BULK_SIZE,
+        },
+        "results": results,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_baseline(path: str, suite: dict) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(suite, file, indent=2)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def compare(baseline: dict, suite: dict, *, threshold: float = 10.0) -> dict:
+    """Compare the results of a run with a baseline, per scenario.
+
+    Returns the relative change (%) of ops/sec, p99 and queries per op of the
+    scenarios present in both, and whether it is a regression: ops/sec lower
+    or p99 higher by more than `threshold` percent, or more queries per op."""
+
+    def change(old, new):
+        if not old or new is None:
+            return None
+        return (new - old) / old * 100
+
+    comparison = {}
+    for name, result in suite["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        ops_change = change(old["ops_per_sec"], result["ops_per_sec"])
+        p99_change = change(old["p99_ms"], result["p99_ms"])
+        comparison[name] = {
+            "ops_per_sec": ops_change,
+            "p99_ms": p99_change,
+            "queries_per_op": result["queries_per_op"] - old["queries_per_op"],
+            "regression": (
+                (ops_change is not None and ops_change < -threshold)
+                or (p99_change is not None and p99_change > threshold)
+                or result["queries_per_op"] > old["queries_per_op"]
+            ),
+        }
+    return comparison
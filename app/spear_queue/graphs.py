@@ -0,0 +1,240 @@
+"""Job graphs: spear jobs made of steps with dependencies.
+
+A job graph is a parent SpearJob, which is not a celery task itself, and one
+SpearJob per step (with `parent` and `step_name` set, and the steps it
+depends on in `depends_on`). Every step is an enqueue_spear_job task with
+its own celery_job_id, so the workers report the status of every step and
+the status of the parent is derived from them (see
+spear_job_api.services.update_spear_job_graph_status).
+
+The steps are dispatched as one Celery canvas, a chain of the dependency
+levels where the steps of a level run in parallel (a group, so a chord with
+the next level). A step therefore starts once the whole previous level is
+done, which is exact for chains and fork/join graphs such as
+Load Patient -> independent processing steps -> planning.
+
+A failed graph is retried with retry_spear_job_graph once none of its steps
+runs, which dispatches the steps that did not complete only. Run the stale
+job reaper with the fail action for graphs: a requeued step is published on
+its own, without its dependents.
+"""
+
+import logging
+from typing import Any
+from celery import chain, group, uuid
+from django.db import transaction
+from rest_framework import serializers
+from spear_job_api.models import SpearJob, SpearJobLogChunk, SpearJobStatus
+from spear_job_api.revocation import revoke_tasks
+from spear_job_api.services import (
+    bulk_create_spear_jobs,
+    update_spear_job_graph_status,
+)
+from spear_job_api.transitions import can_transition
+from spear_queue.models import SpearJobOutboxEntry
+from spear_queue.reaper import job_payload
+from spear_queue.tasks import enqueue_spear_job
+
+logger = logging.getLogger(__name__)
+
+# outbox entries of job graphs carry the ids of the steps to dispatch
+STEPS_KEY = "steps"
+
+
+def dependency_levels(dependencies: dict[Any, set]) -> list[list]:
+    """Group the steps in levels, a step is one level after the deepest of
+    the steps it depends on. Raises serializers.ValidationError on unknown
+    dependencies and cycles."""
+    for step, depends_on in dependencies.items():
+        unknown = depends_on - dependencies.keys()
+        if unknown:
+            raise serializers.ValidationError(
+                {"steps": f"Step '{step}' depends on unknown steps {sorted(unknown)}."}
+            )
+    levels, placed = [], set()
+    while len(placed) < len(dependencies):
+        level = [
+            step
+            for step, depends_on in dependencies.items()
+            if step not in placed and depends_on <= placed
+        ]
+        if not level:
+            raise serializers.ValidationError(
+                {"steps": "The step dependencies contain a cycle."}
+            )
+        levels.append(level)
+        placed.update(level)
+    return levels
+
+
+def step_config(workflow_config: dict | None, step: dict) -> dict | None:
+    """The workflow config of a step: its own, or else the section of the
+    workflow config named after the step (e.g. "Load Patient" of
+    hn_workflow) with the General section, or else the whole config."""
+    if step.get("workflow_config") is not None:
+        return step["workflow_config"]
+    if workflow_config and step["name"] in workflow_config:
+        return {
+            "General": workflow_config.get("General"),
+            step["name"]: workflow_config[step["name"]],
+        }
+    return workflow_config
+
+
+@transaction.atomic
+def enqueue_spear_job_graph(payload: dict[str, Any]) -> SpearJob:
+    """Register a job graph and queue it in the outbox.
+
+    The payload is an enqueue_spear_job payload with a list of "steps", each
+    with a unique "name", the names of the steps it "depends_on" and
+    optionally its own "workflow_config". Raises
+    serializers.ValidationError if the payload or the graph is invalid.
+    """
+    steps = payload.get(STEPS_KEY)
+    if not isinstance(steps, list) or not steps:
+        raise serializers.ValidationError({"steps": "A job graph needs steps."})
+    names = [step.get("name") for step in steps]
+    if not all(names) or len(set(names)) != len(names):
+        raise serializers.ValidationError({"steps": "Every step needs a unique name."})
+    dependency_levels({step["name"]: set(step.get("depends_on", [])) for step in steps})
+
+    data = {key: value for key, value in payload.items() if key != STEPS_KEY}
+    parent = bulk_create_spear_jobs(
+        data=[data | {"celery_job_id": uuid(), "status": SpearJobStatus.QUEUED}]
+    )[0]
+    jobs = bulk_create_spear_jobs(
+        data=[
+            data
+            | {
+                "celery_job_id": uuid(),
+                "status": SpearJobStatus.QUEUED,
+                "workflow_config": step_config(parent.workflow_config, step),
+            }
+            for step in steps
+        ]
+    )
+    by_name = {}
+    for job, step in zip(jobs, steps):
+        job.parent = parent
+        job.step_name = step["name"]
+        by_name[job.step_name] = job
+    SpearJob.objects.bulk_update(jobs, ["parent", "step_name"])
+    SpearJob.depends_on.through.objects.bulk_create(
+        SpearJob.depends_on.through(
+            from_spearjob_id=by_name[step["name"]].pk,
+            to_spearjob_id=by_name[name].pk,
+        )
+        for step in steps
+        for name in step.get("depends_on", [])
+    )
+    SpearJobOutboxEntry.objects.create(
+        job=parent, payload={STEPS_KEY: [job.pk for job in jobs]}
+    )
+    logger.info(f"Enqueued job graph {parent.pk} with {len(jobs)} steps")
+    return parent
+
+
+def step_signature(step: SpearJob):
+    return enqueue_spear_job.si(payload=job_payload(step)).set(
+        task_id=str(step.celery_job_id), priority=step.priority
+    )
+
+
+def graph_canvas(steps: list[SpearJob]):
+    """The Celery canvas running the steps in dependency order. Dependencies
+    on steps that are not in `steps` (completed before) are satisfied."""
+    by_id = {step.pk: step for step in steps}
+    levels = dependency_levels(
+        {
+            step.pk: {dep.pk for dep in step.depends_on.all() if dep.pk in by_id}
+            for step in steps
+        }
+    )
+    return chain(
+        *(
+            (
+                step_signature(by_id[level[0]])
+                if len(level) == 1
+                else group(step_signature(by_id[pk]) for pk in level)
+            )
+            for level in levels
+        )
+    )
+
+
+def publish_spear_job_graph(step_ids: list[int], producer=None) -> None:
+    """Publish the canvas of the steps of a job graph."""
+    steps = list(
+        SpearJob.objects.with_config()
+        .prefetch_related("depends_on")
+        .filter(pk__in=step_ids)
+        .order_by("pk")
+    )
+    graph_canvas(steps).apply_async(producer=producer)
+
+
+@transaction.atomic
+def retry_spear_job_graph(parent_id: int) -> list[SpearJob]:
+    """Queue the steps of a failed or revoked job graph that did not complete
+    again, under new task ids. Returns the retried steps. The old tasks of
+    the steps that were still queued are revoked, so they do not run too.
+
+    Raises ValueError if the graph is still queued or running, or done, or
+    if one of its steps still runs (a graph fails with its first failed
+    step)."""
+    parent = SpearJob.objects.select_for_update().get(pk=parent_id)
+    if parent.status not in (SpearJobStatus.FAILED, SpearJobStatus.REVOKED):
+        raise ValueError(
+            f"Job graph {parent_id} is {parent.status}, only failed or revoked "
+            "graphs are retried."
+        )
+    steps = list(parent.steps.select_for_update().order_by("pk"))
+    running = [
+        step.step_name for step in steps if step.status == SpearJobStatus.RUNNING
+    ]
+    if running:
+        raise ValueError(
+            f"Job graph {parent_id} still runs the steps {running}, retry it "
+            "once they are done."
+        )
+    steps = [
+        step
+        for step in steps
+        # a requeue the API does not allow, see spear_job_api.transitions
+        if can_transition(step.status, SpearJobStatus.QUEUED, allow_requeue=True)
+    ]
+    queued_task_ids = [
+        step.celery_job_id for step in steps if step.status == SpearJobStatus.QUEUED
+    ]
+    log_entries = {}
+    for step in steps:
+        log_entries[step.pk] = [
+            f"Retried after {step.status}, previous task id {step.celery_job_id}"
+        ]
+        step.celery_job_id = uuid()
+        step.status = SpearJobStatus.QUEUED
+        step.started_at = None
+        step.completed_at = None
+        step.latest_heartbeat = None
+        step.worker_name = None
+        step.server_name = ""
+    SpearJob.objects.bulk_update(
+        steps,
+        [
+            "celery_job_id",
+            "status",
+            "started_at",
+            "completed_at",
+            "latest_heartbeat",
+            "worker_name",
+            "server_name",
+        ],
+    )
+    SpearJobLogChunk.objects.append_many(log_entries)
+    update_spear_job_graph_status(parent_ids=[parent.pk])
+    SpearJobOutboxEntry.objects.update_or_create(
+        job=parent, defaults={"payload": {STEPS_KEY: [step.pk for step in steps]}}
+    )
+    transaction.on_commit(lambda: revoke_tasks(queued_task_ids))
+    logger.info(f"Retrying {len(steps)} steps of job graph {parent.pk}")
+    return steps
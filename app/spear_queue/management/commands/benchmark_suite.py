@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand, CommandError
+from spear_queue.benchmarks import (
+    SCENARIOS,
+    compare,
+    load_baseline,
+    run_suite,
+    save_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the spear job API and the enqueue path (in-memory broker), "
+        "optionally saving the results as a baseline or comparing with one"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenarios",
+            nargs="+",
+            choices=list(SCENARIOS),
+            default=list(SCENARIOS),
+        )
+        parser.add_argument(
+            "--ops", type=int, default=500, help="Operations per scenario"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=4, help="Concurrent threads"
+        )
+        parser.add_argument(
+            "--jobs", type=int, default=100, help="Number of jobs to spread over"
+        )
+        parser.add_argument("--save", help="Save the results to this JSON file")
+        parser.add_argument("--compare", help="Compare with this baseline JSON file")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=10.0,
+            help="Regression threshold for ops/sec and p99 (percent)",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error if a scenario regressed",
+        )
+
+    def handle(self, *args, **kwargs):
+        suite = run_suite(
+            kwargs["scenarios"],
+            ops=kwargs["ops"],
+            concurrency=kwargs["concurrency"],
+            jobs=kwargs["jobs"],
+        )
+        meta = suite["meta"]
+        self.stdout.write(
+            f"commit {meta['commit']} | {meta['database']} | {meta['ops']} ops "
+            f"| concurrency {meta['concurrency']}"
+        )
+        self.stdout.write(
+            f"{'scenario':<13} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'queries':>8} {'errors':>7}"
+        )
+        for name, result in suite["results"].items():
+            self.stdout.write(
+                f"{name:<13} {result['ops_per_sec']:9.1f} {result['p50_ms']:8.2f} "
+                f"{result['p95_ms']:8.2f} {result['p99_ms']:8.2f} "
+                f"{result['queries_per_op']:8.1f} {result['errors']:7d}"
+            )
+
+        if kwargs["save"]:
+            save_baseline(kwargs["save"], suite)
+            self.stdout.write(f"Saved the results to {kwargs['save']}")
+
+        if kwargs["compare"]:
+            baseline = load_baseline(kwargs["compare"])
+            comparison = compare(baseline, suite, threshold=kwargs["threshold"])
+            self.stdout.write(f"Compared with commit {baseline['meta']['commit']}")
+            for name, change in comparison.items():
+                line = (
+                    f"{name:<13} ops/s {self._percent(change['ops_per_sec'])} "
+                    f"| p99 {self._percent(change['p99_ms'])} "
+                    f"| queries {change['queries_per_op']:+.1f}"
+                )
+                if change["regression"]:
+                    self.stdout.write(self.style.ERROR(f"{line} REGRESSION"))
+                else:
+                    self.stdout.write(line)
+            regressions = [
+                name for name, change in comparison.items() if change["regression"]
+            ]
+            if regressions and kwargs["fail_on_regression"]:
+                raise CommandError(f"Regressions in: {', '.join(regressions)}")
+
+    @staticmethod
+    def _percent(value):
+        return "n/a" if value is None else f"{value:+.1f}%"
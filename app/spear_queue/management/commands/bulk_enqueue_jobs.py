@@ -0,0 +1,56 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+from spear_queue.tasks import bulk_enqueue_spear_jobs
+
+
+class Command(BaseCommand):
+    help = "Enqueue spear jobs in bulk from a JSONL file, one payload per line"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", type=str, help="Path of the JSONL file")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of jobs registered and published per batch",
+        )
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs["batch_size"]
+        start = time.perf_counter()
+        enqueued = 0
+        batch = []
+        first_line = 1
+        with open(kwargs["file"], encoding="utf-8") as jsonl:
+            for line_number, line in enumerate(jsonl, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except json.JSONDecodeError as exc:
+                    raise CommandError(f"Line {line_number} is not valid JSON: {exc}")
+                if len(batch) >= batch_size:
+                    enqueued += self._enqueue(batch, first_line, enqueued)
+                    batch = []
+                    first_line = line_number + 1
+            if batch:
+                enqueued += self._enqueue(batch, first_line, enqueued)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Enqueued {enqueued} jobs in {time.perf_counter() - start:.2f}s"
+            )
+        )
+
+    def _enqueue(self, batch, first_line, enqueued):
+        try:
+            jobs = bulk_enqueue_spear_jobs(batch)
+        except serializers.ValidationError as exc:
+            raise CommandError(
+                f"Invalid payloads in the batch starting at line {first_line} "
+                f"({enqueued} jobs were enqueued before): {exc.detail}"
+            )
+        self.stdout.write(f"Enqueued batch of {len(jobs)} jobs")
+        return len(jobs)
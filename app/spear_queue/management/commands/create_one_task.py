@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from spear_queue.tasks import enqueue_spear_job
+from spear_queue.tasks import enqueue_spear_job_payload
 
 
 class Command(BaseCommand):
@@ -25,10 +25,6 @@ class Command(BaseCommand):
             "workflow_name": workflow_name,
             "workflow_config": {"key1": "value1", "key2": 2},
         }
-        enqueue_spear_job.apply_async(
-            kwargs={
-                "payload": payload,
-            },
-        )
+        enqueue_spear_job_payload(payload)
 
-        self.stdout.write(self.style.SUCCESS("Task added to queue"))
+        self.stdout.write(self.style.SUCCESS("Task added to the outbox"))
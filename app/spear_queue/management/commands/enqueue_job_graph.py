@@ -0,0 +1,31 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+from spear_queue.graphs import enqueue_spear_job_graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Enqueue a job graph from a JSON file: an enqueue_spear_job payload "
+        'with "steps", e.g. [{"name": "Load Patient"}, {"name": "Planning", '
+        '"depends_on": ["Load Patient"]}]'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", type=str, help="Path of the JSON file")
+
+    def handle(self, *args, **kwargs):
+        with open(kwargs["file"], encoding="utf-8") as file:
+            try:
+                payload = json.load(file)
+            except json.JSONDecodeError as exc:
+                raise CommandError(f"The file is not valid JSON: {exc}")
+        try:
+            parent = enqueue_spear_job_graph(payload)
+        except serializers.ValidationError as exc:
+            raise CommandError(f"Invalid job graph: {exc.detail}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Enqueued job graph {parent.pk} with {parent.steps.count()} steps"
+            )
+        )
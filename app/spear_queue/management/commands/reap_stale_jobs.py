@@ -0,0 +1,54 @@
+import time
+from django.core.management.base import BaseCommand
+from spear_queue.reaper import ACTIONS, FAIL, reap_stale_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Fail or requeue the RUNNING spear jobs that stopped sending heartbeats, "
+        "once or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--action",
+            choices=ACTIONS,
+            default=FAIL,
+            help="Mark the stale jobs FAILED or requeue them, their tasks are revoked",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of jobs locked and updated per transaction",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Maximum number of batches per run (default: until none is left)",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep reaping every INTERVAL seconds (0: reap once)",
+        )
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs["interval"]
+        while True:
+            start = time.perf_counter()
+            result = reap_stale_jobs(
+                action=kwargs["action"],
+                batch_size=kwargs["batch_size"],
+                max_batches=kwargs["max_batches"],
+            )
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"Reaped {len(result)} stale jobs ({len(result.failed)} failed, "
+                f"{len(result.requeued)} requeued) in {elapsed:.3f}s"
+            )
+            if not interval:
+                break
+            time.sleep(max(0.0, interval - elapsed))
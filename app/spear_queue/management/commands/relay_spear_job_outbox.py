@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from spear_queue.outbox import relay_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish the queued spear jobs of the outbox to the broker, once or "
+        "polling every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of jobs locked and published per transaction",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep polling the outbox every INTERVAL seconds (0: relay once)",
+        )
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs["interval"]
+        while True:
+            start = time.perf_counter()
+            published = relay_all(batch_size=kwargs["batch_size"])
+            elapsed = time.perf_counter() - start
+            if published or not interval:
+                self.stdout.write(f"Published {published} jobs in {elapsed:.3f}s")
+            if not interval:
+                break
+            time.sleep(max(0.0, interval - elapsed))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from spear_job_api.models import SpearJob
+from spear_queue.graphs import retry_spear_job_graph
+
+
+class Command(BaseCommand):
+    help = "Queue the steps of a failed job graph that did not complete again"
+
+    def add_arguments(self, parser):
+        parser.add_argument("parent_id", type=int, help="Id of the parent job")
+
+    def handle(self, *args, **kwargs):
+        try:
+            steps = retry_spear_job_graph(kwargs["parent_id"])
+        except SpearJob.DoesNotExist:
+            raise CommandError(f"Job {kwargs['parent_id']} does not exist")
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Retrying steps: {', '.join(step.step_name for step in steps)}"
+            )
+        )
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from spear_queue.scheduler import schedule_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue the PENDING spear jobs chosen by the fair-share scheduler for "
+        "the free worker slots, once or polling every --interval seconds. "
+        "Run a single scheduler, concurrent ones could both fill the same "
+        "free slots"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep scheduling every INTERVAL seconds (0: schedule once)",
+        )
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs["interval"]
+        while True:
+            start = time.perf_counter()
+            jobs = schedule_jobs()
+            elapsed = time.perf_counter() - start
+            if jobs or not interval:
+                self.stdout.write(f"Scheduled {len(jobs)} jobs in {elapsed:.3f}s")
+            if not interval:
+                break
+            time.sleep(max(0.0, interval - elapsed))
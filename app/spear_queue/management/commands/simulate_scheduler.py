@@ -0,0 +1,80 @@
+import json
+from django.core.management.base import BaseCommand
+from spear_queue.simulation import (
+    HOUR,
+    POLICIES,
+    TRACES,
+    generate_trace,
+    simulate,
+    summarize,
+)
+
+
+def minutes(seconds):
+    return "-" if seconds is None else f"{seconds / 60:.1f}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate the scheduling policies on a synthetic arrival trace and "
+        "report the wait times (minutes) and slot share per RayStation "
+        "system, the fairness (Jain's index of the shares) and the throughput"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trace", choices=list(TRACES), default="flood")
+        parser.add_argument(
+            "--policies", nargs="+", choices=POLICIES, default=list(POLICIES)
+        )
+        parser.add_argument("--slots", type=int, default=2)
+        parser.add_argument(
+            "--hours", type=float, default=24, help="Duration of the arrivals"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--weights",
+            type=json.loads,
+            default={},
+            help="Fair-share weights, e.g. '{\"system_a\": 2}'",
+        )
+        parser.add_argument(
+            "--aging-seconds",
+            type=float,
+            default=600,
+            help="Waiting time per priority level gained (0: no aging)",
+        )
+
+    def handle(self, *args, **kwargs):
+        jobs = generate_trace(
+            TRACES[kwargs["trace"]],
+            duration=kwargs["hours"] * HOUR,
+            seed=kwargs["seed"],
+        )
+        self.stdout.write(f"{len(jobs)} jobs, {kwargs['slots']} slots")
+        for policy in kwargs["policies"]:
+            summary = summarize(
+                simulate(
+                    jobs,
+                    policy=policy,
+                    slots=kwargs["slots"],
+                    weights=kwargs["weights"],
+                    aging_seconds=kwargs["aging_seconds"],
+                )
+            )
+            self.stdout.write(
+                f"\n{policy}: fairness {summary['fairness']:.3f}, "
+                f"throughput {summary['throughput']:.2f} jobs/h, "
+                f"max wait {minutes(summary['max_wait'])}, "
+                f"low priority p95 wait {minutes(summary['low_priority_p95_wait'])}"
+            )
+            self.stdout.write(
+                f"  {'system':<12} {'jobs':>5} {'mean':>8} {'p50':>8} "
+                f"{'p95':>8} {'share':>6}"
+            )
+            for key, stats in summary["keys"].items():
+                share = "-" if stats["share"] is None else f"{stats['share']:.2f}"
+                self.stdout.write(
+                    f"  {key:<12} {stats['jobs']:>5} {minutes(stats['mean_wait']):>8} "
+                    f"{minutes(stats['p50_wait']):>8} {minutes(stats['p95_wait']):>8} "
+                    f"{share:>6}"
+                )
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("spear_job_api", "0008_spearjob_heartbeat_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpearJobOutboxEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payload", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True, null=True)),
+                (
+                    "job",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="outbox_entry",
+                        to="spear_job_api.spearjob",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Spear Job Outbox Entry",
+                "verbose_name_plural": "Spear Job Outbox",
+            },
+        ),
+    ]
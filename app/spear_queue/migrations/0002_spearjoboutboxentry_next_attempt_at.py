@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spear_queue", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="spearjoboutboxentry",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
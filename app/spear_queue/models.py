@@ -1,3 +1,26 @@
 from django.db import models
+from spear_job_api.models import SpearJob
 
-# Create your models here.
+
+class SpearJobOutboxEntry(models.Model):
+    """A SpearJob whose enqueue_spear_job message still has to be published.
+
+    Entries are created in the same transaction as their job and deleted by
+    the outbox relay once the broker confirmed the message. The relay does
+    not take an entry before next_attempt_at, see spear_queue.outbox."""
+
+    job = models.OneToOneField(
+        SpearJob, on_delete=models.CASCADE, related_name="outbox_entry"
+    )
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Spear Job Outbox Entry"
+        verbose_name_plural = "Spear Job Outbox"
+
+    def __str__(self):
+        return f"Outbox entry of job {self.job_id}"
@@ -0,0 +1,192 @@
+"""Relay of the spear job outbox to the broker."""
+
+import logging
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from spear_job_api.metrics import (
+    PUBLISH_DURATION,
+    PUBLISH_FAILURES,
+    RELAY_BATCH_DURATION,
+)
+from spear_job_api.models import SpearJob, SpearJobLogChunk, SpearJobStatus
+from spear_job_api.services import transition_spear_jobs, update_spear_job_graph_status
+from spear_queue.graphs import STEPS_KEY, publish_spear_job_graph
+from spear_queue.models import SpearJobOutboxEntry
+from spear_queue.routing import Router
+from spear_queue.tasks import enqueue_spear_job, publish_spear_job
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """The wait before the next publish of an entry that failed `attempts`
+    times: SPEAR_OUTBOX_RETRY_DELAY doubled per attempt, capped at
+    SPEAR_OUTBOX_RETRY_MAX_DELAY."""
+    return timedelta(
+        seconds=min(
+            settings.SPEAR_OUTBOX_RETRY_MAX_DELAY,
+            settings.SPEAR_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1),
+        )
+    )
+
+
+def claim_entries(batch_size: int, now: datetime) -> list[SpearJobOutboxEntry]:
+    """Claim a batch of the due entries for SPEAR_OUTBOX_CLAIM_SECONDS.
+
+    The entries are locked with SKIP LOCKED only as long as it takes to move
+    their next_attempt_at past the claim, so the other relays skip them
+    without waiting for the publishes. A relay that dies leaves its claimed
+    entries to be taken again once the claim expired."""
+    with transaction.atomic():
+        entries = list(
+            SpearJobOutboxEntry.objects.select_related("job")
+            .select_for_update(skip_locked=True, of=("self",))
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .order_by("id")[:batch_size]
+        )
+        SpearJobOutboxEntry.objects.filter(
+            id__in=[entry.id for entry in entries]
+        ).update(
+            next_attempt_at=now + timedelta(seconds=settings.SPEAR_OUTBOX_CLAIM_SECONDS)
+        )
+    return entries
+
+
+def relay_outbox(*, batch_size: int = 500, producer=None) -> int:
+    """Publish one batch of outbox entries. Return the number published.
+
+    The batch is claimed (see claim_entries), so several relays can run side
+    by side, and published outside of any transaction over one producer
+    connection. The broker confirms every message (see
+    broker_transport_options in app.celery) before its entry is deleted. A
+    failed publish does not stop the batch: the entry stays in the outbox and
+    is retried after retry_delay(attempts); after SPEAR_OUTBOX_MAX_ATTEMPTS
+    its jobs are marked FAILED and the entry is removed. A relay that dies
+    between the confirm and the delete publishes its batch again, so
+    delivery is at least once.
+    A producer of the caller is used instead of one of the app pool if given.
+    Every job is published to the queue chosen by the Router (see
+    spear_queue.routing), its server_name is set to the server it is routed to
+    before it is published (see route_entries).
+    The entry of a job graph publishes the canvas of its steps (see
+    spear_queue.graphs).
+    """
+    start = time.perf_counter()
+    entries = claim_entries(batch_size, timezone.now())
+    if not entries:
+        return 0
+
+    routes = route_entries(entries)
+    published, failed = [], []
+    with enqueue_spear_job.app.producer_or_acquire(producer) as producer:
+        for entry in entries:
+            graph = STEPS_KEY in entry.payload
+            queue = routes.get(entry.id)
+            try:
+                with PUBLISH_DURATION.time():
+                    if graph:
+                        publish_spear_job_graph(
+                            entry.payload[STEPS_KEY], producer=producer
+                        )
+                    else:
+                        publish_spear_job(
+                            entry.job, entry.payload, producer=producer, queue=queue
+                        )
+            except Exception as exc:
+                PUBLISH_FAILURES.inc()
+                entry.attempts += 1
+                entry.last_error = repr(exc)
+                failed.append(entry)
+                logger.error(
+                    f"Publishing job {entry.job_id} failed ({entry.attempts} "
+                    f"attempts): {exc!r}"
+                )
+                continue
+            published.append(entry.id)
+
+    with transaction.atomic():
+        SpearJobOutboxEntry.objects.filter(id__in=published).delete()
+        _retry_or_fail(failed, timezone.now())
+    RELAY_BATCH_DURATION.observe(time.perf_counter() - start)
+    logger.info(f"Published {len(published)} spear jobs from the outbox")
+    return len(published)
+
+
+def route_entries(entries: list[SpearJobOutboxEntry]) -> dict[int, str]:
+    """Route the jobs of the entries (see spear_queue.routing) and set their
+    server_name before they are published. Returns the queue per entry id,
+    job graphs are not routed.
+
+    A job a worker picked up already (a publish repeated after a relay died)
+    keeps the server_name of its worker."""
+    router = Router([entry.job for entry in entries])
+    routes, servers = {}, {}
+    for entry in entries:
+        if STEPS_KEY in entry.payload:
+            continue
+        server, routes[entry.id] = router.route(entry.job)
+        if server:
+            servers.setdefault(server, []).append(entry.job_id)
+    with transaction.atomic():
+        for server, job_ids in servers.items():
+            SpearJob.objects.filter(
+                Q(worker_name__isnull=True) | Q(worker_name=""), pk__in=job_ids
+            ).update(server_name=server, version=F("version") + 1)
+    return routes
+
+
+def _retry_or_fail(entries: list[SpearJobOutboxEntry], now: datetime) -> None:
+    max_attempts = settings.SPEAR_OUTBOX_MAX_ATTEMPTS
+    retried = [entry for entry in entries if entry.attempts < max_attempts]
+    dead = [entry for entry in entries if entry.attempts >= max_attempts]
+    for entry in retried:
+        entry.next_attempt_at = now + retry_delay(entry.attempts)
+    SpearJobOutboxEntry.objects.bulk_update(
+        retried, ["attempts", "last_error", "next_attempt_at"]
+    )
+    if not dead:
+        return
+
+    # the steps of a job graph are published by the entry of their parent,
+    # whose status follows theirs
+    job_errors = {}
+    for entry in dead:
+        for job_id in entry.payload.get(STEPS_KEY, [entry.job_id]):
+            job_errors[job_id] = entry.last_error
+    transition_spear_jobs(
+        SpearJob.objects.filter(pk__in=job_errors),
+        status=SpearJobStatus.FAILED,
+        fields={"completed_at": now},
+    )
+    SpearJobLogChunk.objects.append_many(
+        {
+            job_id: [
+                f"Marked FAILED after {max_attempts} failed "
+                f"publishes to the broker: {error}"
+            ]
+            for job_id, error in job_errors.items()
+        }
+    )
+    update_spear_job_graph_status(
+        parent_ids=[entry.job_id for entry in dead if STEPS_KEY in entry.payload]
+    )
+    SpearJobOutboxEntry.objects.filter(id__in=[entry.id for entry in dead]).delete()
+    logger.error(
+        f"Marked {len(job_errors)} spear jobs FAILED, their publish failed "
+        f"{max_attempts} times"
+    )
+
+
+def relay_all(*, batch_size: int = 500, producer=None) -> int:
+    """Publish batches until the outbox has no due entries left or a batch
+    had failed publishes."""
+    total = 0
+    while True:
+        published = relay_outbox(batch_size=batch_size, producer=producer)
+        total += published
+        if published < batch_size:
+            return total
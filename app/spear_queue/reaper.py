@@ -0,0 +1,192 @@
+"""Reap RUNNING spear jobs whose worker stopped sending heartbeats."""
+
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+from celery import uuid
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from spear_job_api.models import SpearJob, SpearJobLogChunk, SpearJobStatus
+from spear_job_api.revocation import revoke_tasks
+from spear_job_api.services import update_spear_job_graph_status
+from spear_job_api.transitions import can_transition
+from spear_queue.models import SpearJobOutboxEntry
+
+logger = logging.getLogger(__name__)
+
+FAIL = "fail"
+REQUEUE = "requeue"
+ACTIONS = (FAIL, REQUEUE)
+
+
+@dataclass
+class ReapResult:
+    """Celery task ids of the reaped jobs."""
+
+    failed: list[str] = field(default_factory=list)
+    requeued: list[str] = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.failed) + len(self.requeued)
+
+
+def stale_before(cutoff: datetime) -> Q:
+    """Jobs whose last sign of life is older than `cutoff`. A job that never
+    sent a heartbeat is judged by its start (or creation) time."""
+    return Q(latest_heartbeat__lt=cutoff) | Q(
+        Q(started_at__lt=cutoff) | Q(started_at__isnull=True, created_at__lt=cutoff),
+        latest_heartbeat__isnull=True,
+    )
+
+
+def stale_jobs_filter(now: datetime) -> Q:
+    """Filter of the RUNNING jobs that missed their heartbeat timeout.
+
+    SPEAR_JOB_HEARTBEAT_TIMEOUT applies to every workflow that has no entry
+    in SPEAR_JOB_HEARTBEAT_TIMEOUTS. Every branch filters on status and
+    latest_heartbeat, so the query is a range scan of the heartbeat index."""
+    timeouts = settings.SPEAR_JOB_HEARTBEAT_TIMEOUTS
+    default = timedelta(seconds=settings.SPEAR_JOB_HEARTBEAT_TIMEOUT)
+    stale = stale_before(now - default) & ~Q(workflow_name__in=list(timeouts))
+    for workflow_name, timeout in timeouts.items():
+        stale |= Q(workflow_name=workflow_name) & stale_before(
+            now - timedelta(seconds=timeout)
+        )
+    return Q(status=SpearJobStatus.RUNNING) & stale
+
+
+def reap_stale_jobs(
+    *,
+    action: str = FAIL,
+    batch_size: int = 100,
+    max_batches: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> ReapResult:
+    """Mark the stale RUNNING jobs FAILED, or put them back in the queue.
+
+    Jobs are handled in batches of `batch_size`, each batch in its own short
+    transaction that locks only its rows (rows locked by a concurrent update
+    are skipped and picked up by the next run).
+
+    The celery tasks of the reaped jobs are revoked (and terminated if they
+    are still running somewhere), so a redelivery of their message, e.g. the
+    unacked message of a dead worker, is discarded. Requeued jobs get a new
+    task id and go through the outbox again. With SPEAR_SCHEDULER_ENABLED
+    they are put back PENDING and wait for a worker slot like new jobs.
+    The result lists the task ids the jobs had when they were reaped."""
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action '{action}', expected one of {ACTIONS}")
+    now = now or timezone.now()
+    stale = stale_jobs_filter(now)
+    result = ReapResult()
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        with transaction.atomic():
+            jobs = list(
+                SpearJob.objects.with_config()
+                .select_for_update(skip_locked=True, of=("self",))
+                .filter(stale)
+                # the parents of job graphs run no task, their steps are reaped
+                .exclude(steps__isnull=False)
+                .order_by("latest_heartbeat", "id")[:batch_size]
+            )
+            if not jobs:
+                break
+            reaped_ids = {job.pk: job.celery_job_id for job in jobs}
+            if action == FAIL:
+                _fail(jobs, now)
+            else:
+                jobs = _reset(jobs)
+            update_spear_job_graph_status(
+                parent_ids={job.parent_id for job in jobs if job.parent_id}
+            )
+
+        celery_job_ids = [reaped_ids[job.pk] for job in jobs]
+        revoke_tasks(celery_job_ids, terminate=True)
+        if action == FAIL:
+            result.failed += celery_job_ids
+        else:
+            result.requeued += celery_job_ids
+        logger.warning(f"Reaped {len(jobs)} stale spear jobs ({action})")
+        if len(jobs) < batch_size:
+            break
+    return result
+
+
+def job_payload(job: SpearJob) -> dict:
+    """The enqueue_spear_job payload of a registered job."""
+    return {
+        "patient_id": job.patient_id,
+        "priority": job.priority,
+        "raystation_system": job.raystation_system.system_name,
+        "workflow_name": job.workflow_name,
+        "workflow_config": job.workflow_config,
+    }
+
+
+def _last_seen(job: SpearJob) -> str:
+    last_seen = job.latest_heartbeat or job.started_at
+    return last_seen.isoformat() if last_seen else "never"
+
+
+def _fail(jobs: list[SpearJob], now: datetime) -> None:
+    for job in jobs:
+        job.status = SpearJobStatus.FAILED
+        job.completed_at = now
+    SpearJob.objects.bulk_update(jobs, ["status", "completed_at"])
+    SpearJobLogChunk.objects.append_many(
+        {
+            job.id: [
+                f"Marked FAILED by the stale job reaper, last heartbeat: {_last_seen(job)}"
+            ]
+            for job in jobs
+        }
+    )
+
+
+def _reset(jobs: list[SpearJob]) -> list[SpearJob]:
+    """Requeue the jobs under new task ids, returns those the life cycle
+    allows it for."""
+    scheduled = settings.SPEAR_SCHEDULER_ENABLED
+    status = SpearJobStatus.PENDING if scheduled else SpearJobStatus.QUEUED
+    # a requeue the API does not allow, see spear_job_api.transitions
+    jobs = [
+        job for job in jobs if can_transition(job.status, status, allow_requeue=True)
+    ]
+    log_entries = {
+        job.id: [
+            f"Requeued by the stale job reaper, last heartbeat: {_last_seen(job)}"
+            f" on {job.worker_name}, previous task id {job.celery_job_id}"
+        ]
+        for job in jobs
+    }
+    for job in jobs:
+        job.celery_job_id = uuid()
+        job.status = status
+        job.started_at = None
+        job.latest_heartbeat = None
+        job.worker_name = None
+        job.server_name = ""
+    SpearJob.objects.bulk_update(
+        jobs,
+        [
+            "celery_job_id",
+            "status",
+            "started_at",
+            "latest_heartbeat",
+            "worker_name",
+            "server_name",
+        ],
+    )
+    SpearJobLogChunk.objects.append_many(log_entries)
+    if not scheduled:
+        SpearJobOutboxEntry.objects.bulk_create(
+            [SpearJobOutboxEntry(job=job, payload=job_payload(job)) for job in jobs],
+            ignore_conflicts=True,
+        )
+    return jobs
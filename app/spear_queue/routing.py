@@ -0,0 +1,103 @@
+"""Routing of the spear job messages to the per-server queues.
+
+Every Spear server has its own queue (see server_queue), consumed by the
+workers running on that server next to the shared spear_tasks queue, which
+the workers of all servers consume.
+
+With SPEAR_ROUTING_POLICY "shared" every job goes to the shared queue and
+the first free worker takes it. With "least-loaded" the outbox relay routes
+a job to the server with the lowest load (QUEUED and RUNNING jobs routed to
+or running on it) relative to its slots in SPEAR_SERVER_SLOTS. Jobs of the
+SPEAR_PINNED_WORKFLOWS go to the server that ran the latest job of the same
+patient, which has the patient loaded already. A saturated server (as many
+jobs as slots) gets no more jobs, when all are saturated the job goes to the
+shared queue.
+"""
+
+from typing import Iterable, Optional
+from django.conf import settings
+from django.db.models import Count
+from spear_job_api.models import SpearJob, SpearJobStatus, SpearServer
+
+SHARED = "shared"
+LEAST_LOADED = "least-loaded"
+POLICIES = (SHARED, LEAST_LOADED)
+SHARED_QUEUE = "spear_tasks"
+
+
+def server_queue(server: str) -> str:
+    """The queue of a Spear server, declared in app.celery and celerytask."""
+    return f"{SHARED_QUEUE}.{server}"
+
+
+def server_loads() -> dict[str, int]:
+    """The number of QUEUED or RUNNING jobs per Spear server."""
+    loads = dict.fromkeys(SpearServer.values, 0)
+    loads.update(
+        SpearJob.objects.filter(
+            status__in=[SpearJobStatus.QUEUED, SpearJobStatus.RUNNING],
+            server_name__in=SpearServer.values,
+        )
+        .order_by()
+        .values("server_name")
+        .annotate(count=Count("id"))
+        .values_list("server_name", "count")
+    )
+    return loads
+
+
+def patient_servers(jobs: Iterable[SpearJob]) -> dict[tuple[str, int], str]:
+    """The server of the latest started job per (patient, RayStation system)
+    of the given jobs."""
+    jobs = list(jobs)
+    if not jobs:
+        return {}
+    servers = {}
+    latest_first = (
+        SpearJob.objects.filter(
+            patient_id__in={job.patient_id for job in jobs},
+            server_name__in=SpearServer.values,
+            started_at__isnull=False,
+        )
+        .exclude(pk__in=[job.pk for job in jobs])
+        .order_by("-started_at")
+        .values_list("patient_id", "raystation_system_id", "server_name")
+    )
+    for patient_id, raystation_system_id, server_name in latest_first:
+        servers.setdefault((patient_id, raystation_system_id), server_name)
+    return servers
+
+
+class Router:
+    """Route the jobs of one outbox batch, keeping track of the load it adds
+    to the servers."""
+
+    def __init__(self, jobs: list[SpearJob], policy: Optional[str] = None):
+        self.policy = policy or settings.SPEAR_ROUTING_POLICY
+        if self.policy not in POLICIES:
+            raise ValueError(
+                f"Unknown routing policy '{self.policy}', expected one of {POLICIES}"
+            )
+        if self.policy == SHARED:
+            return
+        self.slots = settings.SPEAR_SERVER_SLOTS
+        self.loads = server_loads()
+        self.pinned = patient_servers(
+            job for job in jobs if job.workflow_name in settings.SPEAR_PINNED_WORKFLOWS
+        )
+
+    def saturated(self, server: str) -> bool:
+        return self.loads[server] >= self.slots.get(server, 1)
+
+    def route(self, job: SpearJob) -> tuple[str, str]:
+        """Return the server ("" if any) and the queue of a job."""
+        if self.policy == SHARED:
+            return "", SHARED_QUEUE
+        server = self.pinned.get((job.patient_id, job.raystation_system_id))
+        if server is None or self.saturated(server):
+            available = [s for s in self.loads if not self.saturated(s)]
+            if not available:
+                return "", SHARED_QUEUE
+            server = min(available, key=lambda s: self.loads[s] / self.slots.get(s, 1))
+        self.loads[server] += 1
+        return server, server_queue(server)
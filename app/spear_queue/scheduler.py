@@ -0,0 +1,182 @@
+"""Fair-share scheduling of the PENDING spear jobs.
+
+With SPEAR_SCHEDULER_ENABLED, submitted jobs stay PENDING instead of being
+published right away. The scheduler (see the schedule_spear_jobs command)
+moves them to QUEUED and into the outbox only as long as there are free
+worker slots, so the broker queue stays short and the order in which jobs
+start is decided here:
+
+- the jobs are grouped in virtual queues by RayStation system or workflow
+  (SPEAR_SCHEDULER_SHARE_BY),
+- the next slot goes to the virtual queue with the fewest active (QUEUED or
+  RUNNING) jobs relative to its weight (SPEAR_SCHEDULER_WEIGHTS), so a
+  queue flooded with jobs only gets its share of the workers,
+- within a virtual queue the job with the highest priority goes first, a
+  waiting job gains one priority level every SPEAR_SCHEDULER_AGING_SECONDS
+  so low priority jobs are not postponed forever.
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Hashable, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from spear_job_api.models import SpearJob, SpearJobStatus
+from spear_queue.models import SpearJobOutboxEntry
+from spear_queue.reaper import job_payload
+
+logger = logging.getLogger(__name__)
+
+MAX_PRIORITY = 10
+SHARE_BY_FIELDS = {
+    "raystation_system": "raystation_system__system_name",
+    "workflow": "workflow_name",
+}
+
+
+@dataclass
+class Candidate:
+    """A job waiting in a virtual queue, `created_at` in seconds."""
+
+    key: Hashable
+    id: Any
+    priority: int
+    created_at: float
+
+
+def effective_priority(candidate: Candidate, now: float, aging_seconds: float):
+    """The priority of a job raised by one level per `aging_seconds` waited."""
+    if aging_seconds <= 0:
+        return candidate.priority
+    waited = max(now - candidate.created_at, 0.0)
+    return min(candidate.priority + waited / aging_seconds, MAX_PRIORITY)
+
+
+def select_jobs(
+    candidates: list[Candidate],
+    *,
+    active: dict[Hashable, int],
+    slots: int,
+    now: float,
+    weights: Optional[dict[Hashable, float]] = None,
+    aging_seconds: float = 0.0,
+) -> list[Candidate]:
+    """Pick the jobs to start in `slots` free worker slots, in order.
+
+    `active` is the number of QUEUED or RUNNING jobs per virtual queue. Every
+    slot goes to the virtual queue with the lowest active / weight (ties to
+    the queue whose next job waits the longest), which hands out its job
+    with the highest effective priority (ties to the oldest job)."""
+    weights = weights or {}
+    queues: dict[Hashable, list[Candidate]] = {}
+    for candidate in candidates:
+        queues.setdefault(candidate.key, []).append(candidate)
+    for queue in queues.values():
+        # popped from the end
+        queue.sort(
+            key=lambda c: (effective_priority(c, now, aging_seconds), -c.created_at)
+        )
+
+    active = dict(active)
+    selected = []
+    while queues and len(selected) < slots:
+        key = min(
+            queues,
+            key=lambda k: (
+                active.get(k, 0) / weights.get(k, 1.0),
+                queues[k][-1].created_at,
+            ),
+        )
+        selected.append(queues[key].pop())
+        active[key] = active.get(key, 0) + 1
+        if not queues[key]:
+            del queues[key]
+    return selected
+
+
+def share_by_field() -> str:
+    return SHARE_BY_FIELDS[settings.SPEAR_SCHEDULER_SHARE_BY]
+
+
+def pending_candidates(field: str, limit: int) -> list[Candidate]:
+    """The PENDING jobs that can win a slot, at most 2 * `limit` per queue:
+    those with the highest priority and the oldest ones (with aging, the
+    best job of a queue is one of them)."""
+    pending = SpearJob.objects.filter(status=SpearJobStatus.PENDING)
+    keys = pending.order_by().values_list(field, flat=True).distinct()
+    rows = {}
+    for key in keys:
+        queue = pending.filter(**{field: key})
+        for ordering in (("-priority", "created_at"), ("created_at",)):
+            for row in queue.order_by(*ordering).values(
+                "id", field, "priority", "created_at"
+            )[:limit]:
+                rows[row["id"]] = row
+    return [
+        Candidate(
+            key=row[field],
+            id=row["id"],
+            priority=row["priority"],
+            created_at=row["created_at"].timestamp(),
+        )
+        for row in rows.values()
+    ]
+
+
+def active_counts(field: str) -> dict[Hashable, int]:
+    """The number of QUEUED or RUNNING jobs per virtual queue, the parents
+    of job graphs do not take a slot (their steps do)."""
+    return dict(
+        SpearJob.objects.filter(
+            status__in=[SpearJobStatus.QUEUED, SpearJobStatus.RUNNING]
+        )
+        .exclude(steps__isnull=False)
+        .order_by()
+        .values(field)
+        .annotate(count=Count("id"))
+        .values_list(field, "count")
+    )
+
+
+def schedule_jobs(*, now: Optional[datetime] = None) -> list[SpearJob]:
+    """Move the PENDING jobs chosen for the free worker slots to QUEUED and
+    into the outbox. Returns the scheduled jobs."""
+    now = now or timezone.now()
+    field = share_by_field()
+    active = active_counts(field)
+    slots = settings.SPEAR_WORKER_SLOTS - sum(active.values())
+    if slots <= 0:
+        return []
+
+    selected = select_jobs(
+        pending_candidates(field, slots),
+        active=active,
+        slots=slots,
+        now=now.timestamp(),
+        weights=settings.SPEAR_SCHEDULER_WEIGHTS,
+        aging_seconds=settings.SPEAR_SCHEDULER_AGING_SECONDS,
+    )
+    if not selected:
+        return []
+    order = {candidate.id: i for i, candidate in enumerate(selected)}
+
+    with transaction.atomic():
+        # jobs revoked or scheduled by someone else meanwhile are left out
+        jobs = list(
+            SpearJob.objects.with_config()
+            .select_for_update(skip_locked=True, of=("self",))
+            .filter(pk__in=order, status=SpearJobStatus.PENDING)
+        )
+        jobs.sort(key=lambda job: order[job.pk])
+        for job in jobs:
+            job.status = SpearJobStatus.QUEUED
+        SpearJob.objects.bulk_update(jobs, ["status"])
+        SpearJobOutboxEntry.objects.bulk_create(
+            SpearJobOutboxEntry(job=job, payload=job_payload(job)) for job in jobs
+        )
+    if jobs:
+        logger.info(f"Scheduled {len(jobs)} spear jobs for {slots} free slots")
+    return jobs
@@ -0,0 +1,235 @@
+"""Simulation of the scheduling policies on synthetic arrival traces.
+
+Jobs of a trace arrive over time in virtual queues (RayStation systems) and
+run for a random time in one of `slots` worker slots. The policies decide
+which waiting job starts when a slot frees up:
+
+- fifo: the oldest job first,
+- priority: the highest priority first, then the oldest (a broker priority
+  queue, i.e. the behaviour without the scheduler),
+- fair-share: spear_queue.scheduler.select_jobs.
+
+Everything runs in simulated time, no database or broker is involved.
+"""
+
+import heapq
+import random
+from dataclasses import dataclass
+from typing import Hashable, Optional
+from spear_job_api.stats import percentiles
+from spear_queue.scheduler import Candidate, select_jobs
+
+HOUR = 3600.0
+
+
+@dataclass
+class Source:
+    """A virtual queue submitting jobs in a Poisson process of `rate` jobs per
+    hour, with a priority drawn from `priorities` and an exponential run
+    time of mean `run_time` seconds. A `burst` of jobs is submitted at the
+    start of the trace."""
+
+    key: Hashable
+    rate: float
+    priorities: tuple[int, ...] = (5,)
+    run_time: float = 600.0
+    burst: int = 0
+
+
+@dataclass
+class SimulatedJob:
+    key: Hashable
+    priority: int
+    arrival: float
+    run_time: float
+    start: Optional[float] = None
+
+    @property
+    def wait(self) -> float:
+        return self.start - self.arrival
+
+
+@dataclass
+class Simulation:
+    """The simulated jobs, with their start time, and per virtual queue the
+    slot time it received and was entitled to (its weighted share of the
+    slots used by the queues with waiting jobs) while it had waiting jobs."""
+
+    jobs: list[SimulatedJob]
+    received: dict[Hashable, float]
+    entitled: dict[Hashable, float]
+
+
+# name -> sources, for 2 worker slots
+TRACES = {
+    # three systems with the same load, 90% utilisation in total
+    "steady": [
+        Source("system_a", rate=3.6),
+        Source("system_b", rate=3.6),
+        Source("system_c", rate=3.6),
+    ],
+    # system_a floods the queue with high priority jobs, the others submit
+    # at a steady rate
+    "flood": [
+        Source("system_a", rate=2.0, priorities=(8, 9, 10), burst=60),
+        Source("system_b", rate=2.0, priorities=(3, 4, 5)),
+        Source("system_c", rate=2.0, priorities=(3, 4, 5)),
+    ],
+    # system_a submits most of the jobs, with mixed priorities, its low
+    # priority jobs starve without aging
+    "overload": [
+        Source("system_a", rate=7.0, priorities=tuple(range(1, 11)), run_time=720.0),
+        Source("system_b", rate=2.0, priorities=(5,), run_time=720.0),
+    ],
+}
+POLICIES = ("fifo", "priority", "fair-share")
+
+
+def generate_trace(
+    sources: list[Source], *, duration: float, seed: int = 0
+) -> list[SimulatedJob]:
+    """The jobs submitted by the sources within `duration` seconds."""
+    rng = random.Random(seed)
+    jobs = []
+    for source in sources:
+
+        def job(arrival):
+            return SimulatedJob(
+                key=source.key,
+                priority=rng.choice(source.priorities),
+                arrival=arrival,
+                run_time=rng.expovariate(1 / source.run_time),
+            )
+
+        jobs += [job(0.0) for _ in range(source.burst)]
+        arrival = rng.expovariate(source.rate / HOUR)
+        while arrival < duration:
+            jobs.append(job(arrival))
+            arrival += rng.expovariate(source.rate / HOUR)
+    jobs.sort(key=lambda job: job.arrival)
+    return jobs
+
+
+def _select(policy, waiting, active, slots, now, weights, aging_seconds):
+    if policy == "fifo":
+        return sorted(waiting, key=lambda i: waiting[i].arrival)[:slots]
+    if policy == "priority":
+        return sorted(
+            waiting, key=lambda i: (-waiting[i].priority, waiting[i].arrival)
+        )[:slots]
+    selected = select_jobs(
+        [
+            Candidate(key=job.key, id=i, priority=job.priority, created_at=job.arrival)
+            for i, job in waiting.items()
+        ],
+        active=active,
+        slots=slots,
+        now=now,
+        weights=weights,
+        aging_seconds=aging_seconds,
+    )
+    return [candidate.id for candidate in selected]
+
+
+def simulate(
+    jobs: list[SimulatedJob],
+    *,
+    policy: str,
+    slots: int,
+    weights: Optional[dict[Hashable, float]] = None,
+    aging_seconds: float = 600.0,
+) -> Simulation:
+    """Run the jobs through `slots` worker slots."""
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy '{policy}', expected one of {POLICIES}")
+    jobs = [SimulatedJob(**{**vars(job), "start": None}) for job in jobs]
+    arrivals = iter(enumerate(jobs))
+    next_arrival = next(arrivals, None)
+    waiting: dict[int, SimulatedJob] = {}
+    running: list[tuple[float, int]] = []  # (end, job index) heap
+    active: dict[Hashable, int] = {}
+    weights = weights or {}
+    received: dict[Hashable, float] = {}
+    entitled: dict[Hashable, float] = {}
+
+    now = 0.0
+    while next_arrival is not None or waiting or running:
+        previous, now = now, min(
+            running[0][0] if running else float("inf"),
+            next_arrival[1].arrival if next_arrival else float("inf"),
+        )
+        _account(waiting, active, weights, now - previous, received, entitled)
+        while running and running[0][0] <= now:
+            _end, i = heapq.heappop(running)
+            active[jobs[i].key] -= 1
+        while next_arrival and next_arrival[1].arrival <= now:
+            waiting[next_arrival[0]] = next_arrival[1]
+            next_arrival = next(arrivals, None)
+
+        free = slots - len(running)
+        if free > 0 and waiting:
+            for i in _select(
+                policy, waiting, active, free, now, weights, aging_seconds
+            ):
+                job = waiting.pop(i)
+                job.start = now
+                active[job.key] = active.get(job.key, 0) + 1
+                heapq.heappush(running, (now + job.run_time, i))
+    return Simulation(jobs=jobs, received=received, entitled=entitled)
+
+
+def _account(waiting, active, weights, elapsed, received, entitled):
+    backlogged = {job.key for job in waiting.values()}
+    if not backlogged or not elapsed:
+        return
+    used = sum(active.get(key, 0) for key in backlogged)
+    total_weight = sum(weights.get(key, 1.0) for key in backlogged)
+    for key in backlogged:
+        received[key] = received.get(key, 0.0) + active.get(key, 0) * elapsed
+        entitled[key] = (
+            entitled.get(key, 0.0)
+            + used * weights.get(key, 1.0) / total_weight * elapsed
+        )
+
+
+def jain_index(values: list[float]) -> float:
+    """Jain's fairness index, 1 when all values are equal, 1/n at worst."""
+    squares = sum(value * value for value in values)
+    if not squares:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+def summarize(simulation: Simulation) -> dict:
+    """Wait times (seconds) and share of the slots per virtual queue, the
+    fairness of the shares and the throughput (jobs per hour) of a
+    simulation."""
+    jobs = simulation.jobs
+    per_key: dict[Hashable, list[float]] = {}
+    for job in jobs:
+        per_key.setdefault(job.key, []).append(job.wait)
+    keys = {}
+    for key, waits in sorted(per_key.items()):
+        points = percentiles(waits, 50, 95)
+        keys[key] = {
+            "jobs": len(waits),
+            "mean_wait": sum(waits) / len(waits),
+            "p50_wait": points["p50"],
+            "p95_wait": points["p95"],
+            "share": (
+                simulation.received.get(key, 0.0) / simulation.entitled[key]
+                if simulation.entitled.get(key)
+                else None
+            ),
+        }
+    low_priority = [job.wait for job in jobs if job.priority <= 3]
+    makespan = max((job.start + job.run_time for job in jobs), default=0.0)
+    return {
+        "keys": keys,
+        "fairness": jain_index(
+            [key["share"] for key in keys.values() if key["share"] is not None]
+        ),
+        "max_wait": max((job.wait for job in jobs), default=0.0),
+        "low_priority_p95_wait": percentiles(low_priority, 95)["p95"],
+        "throughput": len(jobs) / makespan * HOUR if makespan else 0.0,
+    }
@@ -1,12 +1,25 @@
+import hashlib
+import json
 import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.utils import timezone
-import celery.signals as celery_signals
-from celery import shared_task
+from celery import shared_task, uuid
 from typing import Any
-from spear_job_api.services import create_spear_job
+from spear_job_api.configs import config_digest
+from spear_job_api.models import SpearJob, SpearJobStatus
+from spear_job_api.services import bulk_create_spear_jobs
+from spear_job_api.workflows import workflow_registry
+from spear_queue.models import SpearJobOutboxEntry
 
 logger = logging.getLogger(__name__)
 
+# statuses of the jobs a submission is always deduplicated against
+DEDUP_STATUSES = [SpearJobStatus.PENDING, SpearJobStatus.QUEUED, SpearJobStatus.RUNNING]
+DEDUP_ATTEMPTS = 3
+
 
 @shared_task(queue="spear_tasks", bind=True)
 def enqueue_spear_job(
@@ -24,20 +37,139 @@ def enqueue_spear_job(
     logger.info(f"Enqueue spear job task started with payload: {payload}")
 
 
-@celery_signals.after_task_publish.connect(
-    sender="spear_queue.tasks.enqueue_spear_job"
-)  # note sender is name for before/after task publish
-def handle_task_after_task_publish(
-    sender=None, headers: Any = None, body: dict[str, Any] = None, **_kwargs
-):
-    """After task publish signal handler to create a SpearJob entry in the database."""
-    logger.info("The spear job has been published")
-    logger.debug(f"Published task: {headers=}, {body=}")
-    payload = body[1]["payload"]
-    # Inject the celery job id and status into the payload
-    payload["celery_job_id"] = headers["id"]
-    payload["status"] = "QUEUED"
-    create_spear_job(data=payload)
+def dedup_key(payload: dict[str, Any]) -> str:
+    """The key of a submission: a hash of its idempotency_key, if any, or else
+    of its patient, workflow, workflow config and RayStation system.
+
+    The config is resolved like the create serializer does, a submission
+    without a config gets the default of its workflow, so it has the key of
+    the same submission with the default config spelled out."""
+    if payload.get("idempotency_key"):
+        parts = [payload.get("raystation_system"), payload["idempotency_key"]]
+    else:
+        config = payload.get("workflow_config")
+        if config is None and payload.get("workflow_name"):
+            try:
+                config = workflow_registry.get(payload["workflow_name"]).config
+            except FileNotFoundError:
+                pass
+        parts = [
+            payload.get("patient_id"),
+            payload.get("workflow_name"),
+            config_digest(config),
+            payload.get("raystation_system"),
+        ]
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def find_duplicates(keys: set[str]) -> dict[str, SpearJob]:
+    """The jobs submitted with the keys that are still waiting or running, or
+    that completed and were created within the last SPEAR_JOB_DEDUP_WINDOW
+    seconds."""
+    if not keys:
+        return {}
+    created_after = timezone.now() - timedelta(seconds=settings.SPEAR_JOB_DEDUP_WINDOW)
+    duplicates = SpearJob.objects.filter(dedup_key__in=keys).filter(
+        Q(status__in=DEDUP_STATUSES)
+        | Q(status=SpearJobStatus.COMPLETED, created_at__gte=created_after)
+    )
+    # the latest job of a key wins
+    return {job.dedup_key: job for job in duplicates.order_by("created_at", "id")}
+
+
+@transaction.atomic
+def bulk_enqueue_spear_jobs(payloads: list[dict[str, Any]]) -> list[SpearJob]:
+    """Register many spear jobs and queue their messages in the outbox.
+
+    The payloads (see enqueue_spear_job) are validated together, the jobs and
+    their outbox entries are inserted in one transaction, so a job exists
+    before its message is published by the outbox relay (see
+    spear_queue.outbox) and every committed job is eventually published.
+    Raises serializers.ValidationError if any payload is invalid, nothing is
+    created in that case.
+
+    A payload may carry an "idempotency_key". A payload with the dedup_key of
+    a waiting, running or recently completed job (see find_duplicates), or of
+    an earlier payload of the batch, is not registered again: the existing
+    job is returned in its place. The unique index on the dedup_key of the
+    waiting and running jobs makes a concurrent submission of the same job
+    fail, the jobs are then looked up again.
+
+    With SPEAR_SCHEDULER_ENABLED the jobs are created PENDING without outbox
+    entries, the scheduler (see spear_queue.scheduler) queues them later.
+    """
+    if settings.SPEAR_SCHEDULER_ENABLED:
+        status = SpearJobStatus.PENDING
+    else:
+        status = SpearJobStatus.QUEUED
+    keys = [dedup_key(payload) for payload in payloads]
+    payloads = [
+        {key: value for key, value in payload.items() if key != "idempotency_key"}
+        for payload in payloads
+    ]
+
+    for attempt in range(1, DEDUP_ATTEMPTS + 1):
+        duplicates = find_duplicates(set(keys))
+        new = {}  # dedup key -> index of its first payload
+        for i, key in enumerate(keys):
+            if key not in duplicates and key not in new:
+                new[key] = i
+        try:
+            with transaction.atomic():
+                created = bulk_create_spear_jobs(
+                    data=[
+                        payloads[i] | {"celery_job_id": uuid(), "status": status}
+                        for i in new.values()
+                    ],
+                    dedup_keys=list(new),
+                )
+            break
+        except IntegrityError:
+            if attempt == DEDUP_ATTEMPTS:
+                raise
+            logger.info("Concurrent duplicate submission, looking up the jobs again")
+
+    jobs_by_key = duplicates | dict(zip(new, created))
+    jobs = [jobs_by_key[key] for key in keys]
+    if len(created) < len(jobs):
+        logger.info(
+            f"{len(jobs) - len(created)} duplicate submissions returned their "
+            "existing spear job"
+        )
+    if status == SpearJobStatus.PENDING:
+        logger.info(f"Submitted {len(created)} spear jobs to the scheduler")
+        return jobs
+    SpearJobOutboxEntry.objects.bulk_create(
+        SpearJobOutboxEntry(job=job, payload=payloads[i])
+        for job, i in zip(created, new.values())
+    )
+    logger.info(f"Enqueued {len(created)} spear jobs")
+    return jobs
+
+
+def enqueue_spear_job_payload(payload: dict[str, Any]) -> SpearJob:
+    """Register one spear job and queue its message in the outbox, or return
+    the existing job of a duplicate submission."""
+    return bulk_enqueue_spear_jobs([payload])[0]
+
+
+def publish_spear_job(
+    job: SpearJob, payload: dict[str, Any], producer=None, queue=None
+) -> None:
+    """Publish the enqueue_spear_job message of a registered job, with its
+    celery_job_id as task id, to `queue` (default: the shared queue)."""
+    options = {"queue": queue} if queue else {}
+    enqueue_spear_job.apply_async(
+        kwargs={"payload": payload},
+        task_id=str(job.celery_job_id),
+        priority=job.priority,
+        producer=producer,
+        # the job state lives in SpearJob, subscribing to the result
+        # backend would cost a redis round trip per message
+        ignore_result=True,
+        **options,
+    )
 
 
 # @celery_signals.task_prerun.connect(sender=spear_job)
@@ -0,0 +1,56 @@
+from django.test import TestCase
+from spear_job_api.models import RayStationSystem, SpearJob
+from spear_queue.benchmarks import SCENARIOS, compare, run_suite
+
+
+def suite_results(**results):
+    return {
+        "meta": {"commit": "abc1234"},
+        "results": {
+            name: {"ops_per_sec": ops, "p99_ms": p99, "queries_per_op": queries}
+            for name, (ops, p99, queries) in results.items()
+        },
+    }
+
+
+class TestBenchmarks(TestCase):
+    def test_run_suite(self):
+        """Test every scenario runs without errors and cleans up its jobs"""
+        with self.assertNoLogs("spear_queue.outbox", "ERROR"):
+            suite = run_suite(list(SCENARIOS), ops=3, concurrency=1, jobs=2)
+
+        self.assertEqual(suite["meta"]["ops"], 3)
+        self.assertEqual(suite["meta"]["database"], "sqlite")
+        self.assertEqual(set(suite["results"]), set(SCENARIOS))
+        for name, result in suite["results"].items():
+            self.assertEqual(result["errors"], 0, name)
+            self.assertGreater(result["ops_per_sec"], 0, name)
+            self.assertGreater(result["queries_per_op"], 0, name)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"], name)
+        self.assertFalse(RayStationSystem.objects.exists())
+        self.assertFalse(SpearJob.objects.exists())
+
+    def test_compare(self):
+        """Test slower, higher p99 or more queries is flagged as a regression"""
+        baseline = suite_results(
+            create=(100.0, 10.0, 5),
+            list=(100.0, 10.0, 1),
+            heartbeat=(100.0, 10.0, 1),
+            stats=(100.0, 10.0, 1),
+        )
+        suite = suite_results(
+            create=(95.0, 10.5, 5),
+            list=(80.0, 10.0, 1),
+            heartbeat=(100.0, 10.0, 2),
+            bulk=(100.0, 10.0, 1),
+        )
+
+        comparison = compare(baseline, suite, threshold=10)
+
+        self.assertEqual(set(comparison), {"create", "list", "heartbeat"})
+        self.assertFalse(comparison["create"]["regression"])
+        self.assertAlmostEqual(comparison["create"]["ops_per_sec"], -5.0)
+        self.assertAlmostEqual(comparison["create"]["p99_ms"], 5.0)
+        self.assertTrue(comparison["list"]["regression"])
+        self.assertTrue(comparison["heartbeat"]["regression"])
+        self.assertEqual(comparison["heartbeat"]["queries_per_op"], 1)
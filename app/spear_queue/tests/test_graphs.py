@@ -0,0 +1,191 @@
+from unittest import mock
+from celery.canvas import _chain, _chord
+from django.test import TestCase
+from rest_framework import serializers
+from spear_job_api.models import RayStationSystem, SpearJob
+from spear_job_api.services import update_spear_job
+from spear_queue.graphs import (
+    STEPS_KEY,
+    enqueue_spear_job_graph,
+    graph_canvas,
+    retry_spear_job_graph,
+)
+from spear_queue.models import SpearJobOutboxEntry
+from spear_queue.outbox import relay_outbox
+from spear_queue.tasks import enqueue_spear_job
+
+HN_CONFIG = {
+    "General": {"ProtocolName": "hn_workflow"},
+    "Load Patient": [{"LoadPatient": {}}],
+    "Data Processing": [{"SetImagingSystem": {}}],
+}
+
+
+class TestJobGraphs(TestCase):
+    def setUp(self):
+        RayStationSystem.objects.create(
+            system_name="Test Ray System", system_uid="UID_TEST"
+        )
+        self.payload = {
+            "patient_id": "patient_1",
+            "priority": 5,
+            "raystation_system": "Test Ray System",
+            "workflow_name": "hn_workflow",
+            "workflow_config": HN_CONFIG,
+            "steps": [
+                {"name": "Load Patient"},
+                {"name": "Data Processing", "depends_on": ["Load Patient"]},
+                {"name": "Contouring", "depends_on": ["Load Patient"]},
+                {"name": "Planning", "depends_on": ["Data Processing", "Contouring"]},
+            ],
+        }
+
+    def steps(self, parent):
+        return {step.step_name: step for step in parent.steps.all()}
+
+    def test_enqueue_spear_job_graph(self):
+        """Test the parent, its steps and dependencies are registered in the outbox"""
+        parent = enqueue_spear_job_graph(self.payload)
+
+        steps = self.steps(parent)
+        self.assertEqual(len(steps), 4)
+        self.assertEqual(parent.status, "QUEUED")
+        self.assertCountEqual(
+            steps["Planning"].depends_on.values_list("step_name", flat=True),
+            ["Data Processing", "Contouring"],
+        )
+        self.assertEqual(
+            steps["Load Patient"].workflow_config,
+            {
+                "General": HN_CONFIG["General"],
+                "Load Patient": HN_CONFIG["Load Patient"],
+            },
+        )
+        self.assertEqual(steps["Contouring"].workflow_config, HN_CONFIG)
+        self.assertCountEqual(
+            SpearJobOutboxEntry.objects.get(job=parent).payload[STEPS_KEY],
+            [step.pk for step in steps.values()],
+        )
+        self.assertFalse(SpearJobOutboxEntry.objects.exclude(job=parent).exists())
+
+    def test_invalid_graphs(self):
+        """Test unknown dependencies and cycles are rejected, nothing is created"""
+        unknown = self.payload | {
+            "steps": [{"name": "Planning", "depends_on": ["Contouring"]}]
+        }
+        cycle = self.payload | {
+            "steps": [
+                {"name": "a", "depends_on": ["b"]},
+                {"name": "b", "depends_on": ["a"]},
+            ]
+        }
+        for payload in (unknown, cycle, self.payload | {"steps": []}):
+            with self.assertRaises(serializers.ValidationError):
+                enqueue_spear_job_graph(payload)
+        self.assertFalse(SpearJob.objects.exists())
+
+    def test_graph_canvas(self):
+        """Test independent steps are grouped between their dependencies"""
+        parent = enqueue_spear_job_graph(self.payload)
+        steps = self.steps(parent)
+
+        canvas = graph_canvas(list(parent.steps.prefetch_related("depends_on")))
+
+        # a chain of Load Patient and a chord of the two parallel steps with
+        # Planning as body
+        self.assertIsInstance(canvas, _chain)
+        first, fork_join = canvas.tasks
+        self.assertEqual(first.id, steps["Load Patient"].celery_job_id)
+        self.assertIsInstance(fork_join, _chord)
+        self.assertCountEqual(
+            [task.id for task in fork_join.tasks],
+            [steps["Data Processing"].celery_job_id, steps["Contouring"].celery_job_id],
+        )
+        self.assertEqual(fork_join.body.id, steps["Planning"].celery_job_id)
+        self.assertEqual(fork_join.body.kwargs["payload"]["patient_id"], "patient_1")
+
+    @mock.patch.object(enqueue_spear_job.app, "producer_or_acquire")
+    @mock.patch("spear_queue.outbox.publish_spear_job_graph")
+    def test_relay_publishes_graph(self, mock_publish_graph, _mock_producer):
+        parent = enqueue_spear_job_graph(self.payload)
+
+        self.assertEqual(relay_outbox(), 1)
+
+        self.assertCountEqual(
+            mock_publish_graph.call_args.args[0],
+            parent.steps.values_list("pk", flat=True),
+        )
+
+    def test_status_and_retry(self):
+        """Test the parent follows its steps and a retry requeues the failed part"""
+        parent = enqueue_spear_job_graph(self.payload)
+        SpearJobOutboxEntry.objects.all().delete()
+        steps = self.steps(parent)
+
+        def report(name, status):
+            update_spear_job(
+                celery_job_id=steps[name].celery_job_id, data={"status": status}
+            )
+            parent.refresh_from_db()
+            return parent.status
+
+        self.assertEqual(report("Load Patient", "RUNNING"), "RUNNING")
+        self.assertEqual(report("Load Patient", "COMPLETED"), "RUNNING")
+        self.assertEqual(report("Data Processing", "COMPLETED"), "RUNNING")
+        self.assertEqual(report("Contouring", "FAILED"), "FAILED")
+
+        retried = retry_spear_job_graph(parent.pk)
+
+        self.assertCountEqual(
+            [step.step_name for step in retried], ["Contouring", "Planning"]
+        )
+        parent.refresh_from_db()
+        self.assertEqual(parent.status, "RUNNING")
+        contouring = SpearJob.objects.get(pk=steps["Contouring"].pk)
+        self.assertEqual(contouring.status, "QUEUED")
+        self.assertNotEqual(contouring.celery_job_id, steps["Contouring"].celery_job_id)
+        self.assertIn("Retried after FAILED", contouring.get_logs())
+        self.assertCountEqual(
+            SpearJobOutboxEntry.objects.get(job=parent).payload[STEPS_KEY],
+            [step.pk for step in retried],
+        )
+        with self.assertRaises(ValueError):
+            retry_spear_job_graph(parent.pk)
+
+    @mock.patch("spear_queue.graphs.revoke_tasks")
+    def test_retry_waits_for_running_steps(self, mock_revoke_tasks):
+        """Test a graph failed while a step still runs is not retried until the
+        step is done, and the queued steps of the retry lose their old tasks"""
+        parent = enqueue_spear_job_graph(self.payload)
+        SpearJobOutboxEntry.objects.all().delete()
+        steps = self.steps(parent)
+        for name, status in [
+            ("Load Patient", "RUNNING"),
+            ("Load Patient", "COMPLETED"),
+            ("Data Processing", "RUNNING"),
+            ("Contouring", "RUNNING"),
+            ("Contouring", "FAILED"),
+        ]:
+            update_spear_job(
+                celery_job_id=steps[name].celery_job_id, data={"status": status}
+            )
+        parent.refresh_from_db()
+        self.assertEqual(parent.status, "FAILED")
+
+        with self.assertRaises(ValueError):
+            retry_spear_job_graph(parent.pk)
+        processing = SpearJob.objects.get(pk=steps["Data Processing"].pk)
+        self.assertEqual(
+            processing.celery_job_id, steps["Data Processing"].celery_job_id
+        )
+
+        update_spear_job(
+            celery_job_id=processing.celery_job_id, data={"status": "COMPLETED"}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            retried = retry_spear_job_graph(parent.pk)
+
+        self.assertCountEqual(
+            [step.step_name for step in retried], ["Contouring", "Planning"]
+        )
+        mock_revoke_tasks.assert_called_once_with([steps["Planning"].celery_job_id])
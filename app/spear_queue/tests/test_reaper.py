@@ -0,0 +1,133 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from spear_job_api.models import RayStationSystem, SpearJob
+from spear_queue.reaper import REQUEUE, reap_stale_jobs
+from spear_queue.models import SpearJobOutboxEntry
+from spear_queue.tasks import enqueue_spear_job
+
+
+@override_settings(
+    SPEAR_JOB_HEARTBEAT_TIMEOUT=300,
+    SPEAR_JOB_HEARTBEAT_TIMEOUTS={"slow_workflow": 3600},
+)
+@mock.patch.object(enqueue_spear_job.app.control, "revoke")
+class TestReapStaleJobs(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.raystation_system = RayStationSystem.objects.create(
+            system_name="Test Ray System", system_uid="UID_TEST"
+        )
+
+    def create_job(self, n, *, heartbeat_age=None, status="RUNNING", **fields):
+        latest_heartbeat = None
+        if heartbeat_age is not None:
+            latest_heartbeat = self.now - timedelta(seconds=heartbeat_age)
+        fields = {
+            "workflow_name": "test_workflow",
+            "worker_name": "worker_sp1",
+            **fields,
+        }
+        return SpearJob.objects.create(
+            patient_id=f"patient_{n}",
+            celery_job_id=f"{n:08x}-0000-4000-8000-000000000000",
+            raystation_system=self.raystation_system,
+            status=status,
+            latest_heartbeat=latest_heartbeat,
+            **fields,
+        )
+
+    def test_fail_stale_jobs(self, mock_revoke):
+        """Test only RUNNING jobs past their heartbeat timeout are failed and revoked"""
+        stale = self.create_job(1, heartbeat_age=600)
+        never_beat = self.create_job(
+            2, started_at=self.now - timedelta(seconds=600), heartbeat_age=None
+        )
+        alive = self.create_job(3, heartbeat_age=60)
+        done = self.create_job(4, heartbeat_age=600, status="COMPLETED")
+        slow = self.create_job(5, heartbeat_age=600, workflow_name="slow_workflow")
+        slow_stale = self.create_job(
+            6, heartbeat_age=7200, workflow_name="slow_workflow"
+        )
+
+        result = reap_stale_jobs(now=self.now)
+
+        reaped = [stale, never_beat, slow_stale]
+        self.assertCountEqual(result.failed, [job.celery_job_id for job in reaped])
+        for job in reaped:
+            job.refresh_from_db()
+            self.assertEqual(job.status, "FAILED")
+            self.assertEqual(job.completed_at, self.now)
+            self.assertIn("stale job reaper", job.get_logs())
+        for job, expected in [
+            (alive, "RUNNING"),
+            (done, "COMPLETED"),
+            (slow, "RUNNING"),
+        ]:
+            job.refresh_from_db()
+            self.assertEqual(job.status, expected)
+        mock_revoke.assert_called_once()
+        self.assertCountEqual(
+            mock_revoke.call_args.args[0], [job.celery_job_id for job in reaped]
+        )
+        self.assertTrue(mock_revoke.call_args.kwargs["terminate"])
+
+    def test_reap_in_batches(self, mock_revoke):
+        """Test the jobs are reaped in batches, up to max_batches"""
+        for n in range(5):
+            self.create_job(n, heartbeat_age=600 + n)
+
+        result = reap_stale_jobs(batch_size=2, max_batches=2, now=self.now)
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(mock_revoke.call_count, 2)
+        # the oldest heartbeats go first
+        self.assertEqual(
+            SpearJob.objects.get(status="RUNNING").celery_job_id,
+            f"{0:08x}-0000-4000-8000-000000000000",
+        )
+
+        reap_stale_jobs(batch_size=2, now=self.now)
+        self.assertFalse(SpearJob.objects.filter(status="RUNNING").exists())
+
+    def test_requeue_stale_jobs(self, mock_revoke):
+        """Test requeued jobs are reset to QUEUED and go through the outbox again
+        under a new task id, the old task is revoked"""
+        job = self.create_job(
+            1,
+            heartbeat_age=600,
+            started_at=self.now - timedelta(seconds=900),
+            priority=3,
+            workflow_config={"key": "value"},
+        )
+
+        result = reap_stale_jobs(action=REQUEUE, now=self.now)
+
+        self.assertEqual(result.requeued, [job.celery_job_id])
+        mock_revoke.assert_called_once()
+        self.assertEqual(mock_revoke.call_args.args[0], [job.celery_job_id])
+        self.assertTrue(mock_revoke.call_args.kwargs["terminate"])
+        old_celery_job_id = job.celery_job_id
+        job.refresh_from_db()
+        self.assertNotEqual(job.celery_job_id, old_celery_job_id)
+        self.assertIn(f"previous task id {old_celery_job_id}", job.get_logs())
+        self.assertEqual(job.status, "QUEUED")
+        self.assertIsNone(job.started_at)
+        self.assertIsNone(job.latest_heartbeat)
+        self.assertIsNone(job.worker_name)
+        self.assertIn("Requeued by the stale job reaper", job.get_logs())
+        self.assertEqual(
+            SpearJobOutboxEntry.objects.get(job=job).payload,
+            {
+                "patient_id": "patient_1",
+                "priority": 3,
+                "raystation_system": "Test Ray System",
+                "workflow_name": "test_workflow",
+                "workflow_config": {"key": "value"},
+            },
+        )
+
+    def test_unknown_action(self, mock_revoke):
+        with self.assertRaises(ValueError):
+            reap_stale_jobs(action="delete")
@@ -0,0 +1,141 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from app.celery import celery_app
+from spear_job_api.models import RayStationSystem, SpearJob, SpearServer
+from spear_queue.outbox import relay_outbox
+from spear_queue.routing import SHARED_QUEUE, Router, server_queue
+from spear_queue.tasks import bulk_enqueue_spear_jobs, enqueue_spear_job
+
+SP1, SP2 = SpearServer.SP1.value, SpearServer.SP2.value
+
+
+@override_settings(
+    SPEAR_ROUTING_POLICY="least-loaded",
+    SPEAR_SERVER_SLOTS={SP1: 2, SP2: 2},
+    SPEAR_PINNED_WORKFLOWS=["pinned_workflow"],
+)
+class TestRouter(TestCase):
+    def setUp(self):
+        self.raystation_system = RayStationSystem.objects.create(
+            system_name="Test Ray System", system_uid="UID_TEST"
+        )
+        self.count = 0
+
+    def create_job(self, status="QUEUED", server_name="", **fields):
+        self.count += 1
+        job = SpearJob.objects.create(
+            patient_id=fields.pop("patient_id", f"patient_{self.count}"),
+            celery_job_id=f"{self.count:08x}-0000-4000-8000-000000000000",
+            raystation_system=self.raystation_system,
+            status=status,
+            workflow_name=fields.pop("workflow_name", "test_workflow"),
+            **fields,
+        )
+        # as routed by the relay, bypassing SpearJob.save
+        SpearJob.objects.filter(pk=job.pk).update(server_name=server_name)
+        job.server_name = server_name
+        return job
+
+    def test_server_queues_are_declared(self):
+        queues = {queue.name for queue in celery_app.conf.task_queues}
+        self.assertEqual(
+            queues, {SHARED_QUEUE} | {server_queue(s) for s in SpearServer.values}
+        )
+
+    def test_least_loaded(self):
+        """Test jobs go to the least loaded server, then to the shared queue"""
+        self.create_job("RUNNING", SP1)
+        jobs = [self.create_job() for _ in range(4)]
+
+        routes = [route for route, _queue in map(Router(jobs).route, jobs)]
+
+        self.assertEqual(routes, [SP2, SP1, SP2, ""])
+
+    def test_pinned_workflow(self):
+        """Test a pinned job goes to the server of the patient's last job"""
+        self.create_job(
+            "COMPLETED", SP2, patient_id="patient_x", started_at=timezone.now()
+        )
+        self.create_job("RUNNING", SP2)
+        pinned = self.create_job(
+            patient_id="patient_x", workflow_name="pinned_workflow"
+        )
+        unpinned = self.create_job(patient_id="patient_x")
+
+        router = Router([pinned, unpinned])
+
+        self.assertEqual(router.route(pinned), (SP2, server_queue(SP2)))
+        self.assertEqual(router.route(unpinned), (SP1, server_queue(SP1)))
+
+    def test_pinned_server_saturated(self):
+        """Test a pinned job is not sent to a saturated server"""
+        self.create_job(
+            "COMPLETED", SP2, patient_id="patient_x", started_at=timezone.now()
+        )
+        self.create_job("RUNNING", SP2)
+        self.create_job("QUEUED", SP2)
+        pinned = self.create_job(
+            patient_id="patient_x", workflow_name="pinned_workflow"
+        )
+
+        self.assertEqual(Router([pinned]).route(pinned)[0], SP1)
+
+    @override_settings(SPEAR_ROUTING_POLICY="shared")
+    def test_shared(self):
+        job = self.create_job()
+        self.assertEqual(Router([job]).route(job), ("", SHARED_QUEUE))
+
+    @mock.patch.object(enqueue_spear_job.app, "producer_or_acquire")
+    @mock.patch.object(enqueue_spear_job, "apply_async")
+    def test_relay_routes_jobs(self, mock_apply_async, _mock_producer):
+        """Test the relay publishes to the server queue and records the server"""
+        self.create_job("RUNNING", SP1)
+        job = bulk_enqueue_spear_jobs(
+            [
+                {
+                    "patient_id": "patient_y",
+                    "priority": 5,
+                    "raystation_system": "Test Ray System",
+                    "workflow_name": "test_workflow",
+                    "workflow_config": {},
+                }
+            ]
+        )[0]
+
+        relay_outbox()
+
+        self.assertEqual(mock_apply_async.call_args.kwargs["queue"], server_queue(SP2))
+        job.refresh_from_db()
+        self.assertEqual(job.server_name, SP2)
+
+        # the worker that picks it up does not change the routed server
+        job.worker_name = "celery@worker-spear-serverB"
+        job.save()
+        self.assertEqual(job.server_name, SP2)
+
+    @mock.patch.object(enqueue_spear_job.app, "producer_or_acquire")
+    @mock.patch.object(enqueue_spear_job, "apply_async")
+    def test_relay_keeps_server_of_started_job(self, _mock_apply_async, _producer):
+        """Test a job a worker picked up before the relay published it again
+        keeps its server and version"""
+        job = bulk_enqueue_spear_jobs(
+            [
+                {
+                    "patient_id": "patient_z",
+                    "priority": 5,
+                    "raystation_system": "Test Ray System",
+                    "workflow_name": "test_workflow",
+                    "workflow_config": {},
+                }
+            ]
+        )[0]
+        job.worker_name = "celery@worker_sp1"
+        job.save()
+
+        relay_outbox()
+
+        version = job.version
+        job.refresh_from_db()
+        self.assertEqual(job.server_name, SP1)
+        self.assertEqual(job.version, version)
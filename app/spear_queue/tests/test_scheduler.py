@@ -0,0 +1,156 @@
+import itertools
+from datetime import timedelta
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.utils import timezone
+from spear_job_api.models import RayStationSystem, SpearJob
+from spear_queue.models import SpearJobOutboxEntry
+from spear_queue.scheduler import Candidate, schedule_jobs, select_jobs
+from spear_queue.simulation import (
+    HOUR,
+    TRACES,
+    generate_trace,
+    simulate,
+    summarize,
+)
+from spear_queue.tasks import bulk_enqueue_spear_jobs
+
+
+def candidates(key, *priorities, created_at=0.0):
+    return [
+        Candidate(key=key, id=f"{key}{i}", priority=priority, created_at=created_at)
+        for i, priority in enumerate(priorities)
+    ]
+
+
+class TestSelectJobs(SimpleTestCase):
+    def test_fair_share(self):
+        """Test the slots are shared by the virtual queues, not by priority"""
+        waiting = candidates("a", 10, 10, 10, 10) + candidates("b", 1, 1)
+
+        selected = select_jobs(waiting, active={"a": 1}, slots=4, now=0)
+
+        self.assertEqual([c.key for c in selected], ["b", "a", "b", "a"])
+
+    def test_weights(self):
+        """Test a queue with twice the weight gets twice the slots"""
+        waiting = candidates("a", 5, 5, 5, 5) + candidates("b", 5, 5, 5, 5)
+
+        selected = select_jobs(waiting, active={}, slots=6, now=0, weights={"a": 2.0})
+
+        self.assertEqual(sum(c.key == "a" for c in selected), 4)
+
+    def test_priority_and_aging(self):
+        """Test the highest priority goes first, unless an older job aged past it"""
+        old = Candidate(key="a", id="old", priority=1, created_at=0.0)
+        new = Candidate(key="a", id="new", priority=5, created_at=3000.0)
+
+        without_aging = select_jobs([old, new], active={}, slots=1, now=3000.0)
+        with_aging = select_jobs(
+            [old, new], active={}, slots=1, now=3000.0, aging_seconds=600
+        )
+
+        self.assertEqual(without_aging[0].id, "new")
+        self.assertEqual(with_aging[0].id, "old")
+
+    def test_no_free_slots(self):
+        self.assertEqual(
+            select_jobs(candidates("a", 5), active={"a": 2}, slots=0, now=0), []
+        )
+
+
+@override_settings(
+    SPEAR_SCHEDULER_ENABLED=True,
+    SPEAR_WORKER_SLOTS=2,
+    SPEAR_SCHEDULER_SHARE_BY="raystation_system",
+    SPEAR_SCHEDULER_WEIGHTS={},
+    SPEAR_SCHEDULER_AGING_SECONDS=600,
+)
+class TestScheduleJobs(TestCase):
+    def setUp(self):
+        for name in ("System A", "System B"):
+            RayStationSystem.objects.create(system_name=name, system_uid=name)
+        self.patients = itertools.count()
+
+    def submit(self, system, *priorities):
+        return bulk_enqueue_spear_jobs(
+            [
+                {
+                    "patient_id": f"patient_{next(self.patients)}",
+                    "priority": priority,
+                    "raystation_system": system,
+                    "workflow_name": "test_workflow",
+                    "workflow_config": {},
+                }
+                for priority in priorities
+            ]
+        )
+
+    def test_submitted_jobs_wait_for_the_scheduler(self):
+        """Test submitted jobs stay PENDING without outbox entries"""
+        self.submit("System A", 5, 5)
+
+        self.assertEqual(SpearJob.objects.filter(status="PENDING").count(), 2)
+        self.assertFalse(SpearJobOutboxEntry.objects.exists())
+
+    def test_schedule_jobs(self):
+        """Test only the free slots are filled, shared by the systems"""
+        self.submit("System A", 10, 10, 10)
+        system_b_job = self.submit("System B", 1)[0]
+
+        scheduled = schedule_jobs()
+
+        self.assertEqual(len(scheduled), 2)
+        self.assertIn(system_b_job, scheduled)
+        self.assertEqual(SpearJob.objects.filter(status="QUEUED").count(), 2)
+        self.assertCountEqual(
+            SpearJobOutboxEntry.objects.values_list("job", flat=True),
+            [job.id for job in scheduled],
+        )
+        self.assertEqual(schedule_jobs(), [])
+
+        # a slot frees up
+        SpearJob.objects.filter(pk=scheduled[0].pk).update(status="COMPLETED")
+        self.assertEqual(len(schedule_jobs()), 1)
+        self.assertEqual(SpearJob.objects.filter(status="PENDING").count(), 1)
+
+    def test_aged_job_is_scheduled_first(self):
+        """Test a low priority job waiting long enough passes a newer one"""
+        old = self.submit("System A", 1)[0]
+        SpearJob.objects.filter(pk=old.pk).update(
+            created_at=timezone.now() - timedelta(hours=2)
+        )
+        self.submit("System A", 9)
+        SpearJob.objects.create(
+            patient_id="running",
+            celery_job_id="00000000-0000-4000-8000-000000000000",
+            status="RUNNING",
+            raystation_system=old.raystation_system,
+        )
+
+        self.assertEqual(schedule_jobs(), [old])
+
+
+class TestSimulation(SimpleTestCase):
+    def test_fair_share_on_flood(self):
+        """Test fair-share is fairer than a priority queue at the same throughput"""
+        jobs = generate_trace(TRACES["flood"], duration=24 * HOUR, seed=1)
+
+        priority = summarize(simulate(jobs, policy="priority", slots=2))
+        fair_share = summarize(simulate(jobs, policy="fair-share", slots=2))
+
+        self.assertGreater(fair_share["fairness"], priority["fairness"])
+        self.assertLess(
+            fair_share["keys"]["system_b"]["mean_wait"],
+            priority["keys"]["system_b"]["mean_wait"],
+        )
+        self.assertAlmostEqual(
+            fair_share["throughput"], priority["throughput"], delta=1.0
+        )
+
+    def test_every_job_runs(self):
+        jobs = generate_trace(TRACES["overload"], duration=8 * HOUR, seed=2)
+
+        simulation = simulate(jobs, policy="fair-share", slots=2)
+
+        self.assertEqual(len(simulation.jobs), len(jobs))
+        self.assertTrue(all(job.start >= job.arrival for job in simulation.jobs))
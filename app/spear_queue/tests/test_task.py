@@ -1,63 +1,250 @@
-from time import timezone
-from django.test import TestCase
-from spear_queue.tasks import enqueue_spear_job, handle_task_after_task_publish
-from django.test import override_settings
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import serializers
+from spear_queue.models import SpearJobOutboxEntry
+from spear_queue.outbox import claim_entries, relay_all, relay_outbox
+from spear_queue.tasks import (
+    bulk_enqueue_spear_jobs,
+    dedup_key,
+    enqueue_spear_job,
+    enqueue_spear_job_payload,
+)
 from spear_job_api.models import SpearJob, RayStationSystem
+from spear_job_api.workflows import workflow_registry
 
 
 def create_raystation_system(name="Test RayStation System"):
     return RayStationSystem.objects.create(system_name=name, system_uid="UID_TEST")
 
 
-class TestSpearTask(TestCase):
-    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
-    def test_handle_task_after_task_publish(self):
+class TestBulkEnqueue(TestCase):
+    def setUp(self):
         create_raystation_system("Test Ray System")
-        celery_id = "7a4b5a64-ec4e-4a0f-a3e6-1c8dc3c977fb"
-        headers = {
-            "lang": "py",
-            "task": "spear_queue.tasks.enqueue_spear_job",
-            "id": celery_id,
-            "shadow": None,
-            "eta": None,
-            "expires": None,
-            "group": None,
-            "group_index": None,
-            "retries": 0,
-            "timelimit": [None, None],
-            "root_id": celery_id,
-            "parent_id": None,
-            "argsrepr": "()",
-            "kwargsrepr": "{'payload': {'patient_id': 'test_pt1', 'priority': 2, 'raystation_system': 'Test Ray System', 'workflow_name': 'test_workflow_1', 'workflow_config': {'key1': 'value1', 'key2': 2}}}",
-            "origin": "gen1@e3195a40bfb1",
-            "ignore_result": False,
-            "replaced_task_nesting": 0,
-            "stamped_headers": None,
-            "stamps": {},
-        }
-        body = (
-            (),
+        self.payloads = [
+            {
+                "patient_id": f"test_pt{i}",
+                "priority": i,
+                "raystation_system": "Test Ray System",
+                "workflow_name": "test_workflow_1",
+                "workflow_config": {"key1": "value1"},
+            }
+            for i in range(1, 4)
+        ]
+
+    @mock.patch.object(enqueue_spear_job, "apply_async")
+    def test_bulk_enqueue_spear_jobs(self, mock_apply_async):
+        """Test jobs are registered with their outbox entries, nothing is published."""
+        jobs = bulk_enqueue_spear_jobs(self.payloads)
+
+        self.assertEqual(SpearJob.objects.filter(status="QUEUED").count(), 3)
+        for job, payload in zip(jobs, self.payloads):
+            self.assertEqual(SpearJobOutboxEntry.objects.get(job=job).payload, payload)
+        mock_apply_async.assert_not_called()
+
+    @mock.patch.object(enqueue_spear_job, "apply_async")
+    def test_bulk_enqueue_spear_jobs_invalid_payload(self, mock_apply_async):
+        """Test nothing is registered or published if one payload is invalid."""
+        self.payloads[1]["raystation_system"] = "Unknown System"
+
+        with self.assertRaises(serializers.ValidationError) as context:
+            bulk_enqueue_spear_jobs(self.payloads)
+
+        self.assertIn("raystation_system", context.exception.detail[1])
+        self.assertFalse(SpearJob.objects.exists())
+        self.assertFalse(SpearJobOutboxEntry.objects.exists())
+        mock_apply_async.assert_not_called()
+
+
+@mock.patch.object(enqueue_spear_job.app, "producer_or_acquire")
+@mock.patch.object(enqueue_spear_job, "apply_async")
+class TestOutboxRelay(TestCase):
+    def setUp(self):
+        create_raystation_system("Test Ray System")
+        self.payloads = [
             {
-                "payload": {
-                    "patient_id": "test_pt1",
-                    "priority": 2,
-                    "raystation_system": "Test Ray System",
-                    "workflow_name": "test_workflow_1",
-                    "workflow_config": {"key1": "value1", "key2": 2},
-                }
-            },
-            {"callbacks": None, "errbacks": None, "chain": None, "chord": None},
+                "patient_id": f"test_pt{i}",
+                "priority": i,
+                "raystation_system": "Test Ray System",
+                "workflow_name": "test_workflow_1",
+                "workflow_config": {"key1": "value1"},
+            }
+            for i in range(1, 6)
+        ]
+        self.jobs = bulk_enqueue_spear_jobs(self.payloads)
+
+    def test_relay_outbox(self, mock_apply_async, mock_producer):
+        """Test a batch is published over one producer and removed from the outbox."""
+        producer = mock_producer.return_value.__enter__.return_value
+
+        self.assertEqual(relay_outbox(batch_size=3), 3)
+
+        mock_producer.assert_called_once()
+        self.assertEqual(mock_apply_async.call_count, 3)
+        for job, payload, call in zip(
+            self.jobs, self.payloads, mock_apply_async.call_args_list
+        ):
+            self.assertEqual(call.kwargs["kwargs"], {"payload": payload})
+            self.assertEqual(call.kwargs["task_id"], str(job.celery_job_id))
+            self.assertEqual(call.kwargs["priority"], payload["priority"])
+            self.assertIs(call.kwargs["producer"], producer)
+            self.assertTrue(call.kwargs["ignore_result"])
+        self.assertCountEqual(
+            SpearJobOutboxEntry.objects.values_list("job_id", flat=True),
+            [job.id for job in self.jobs[3:]],
         )
 
-        handle_task_after_task_publish(
-            sender="spear_queue.tasks.enqueue_spear_job",
-            headers=headers,
-            body=body,
+    def test_relay_all(self, mock_apply_async, _mock_producer):
+        """Test batches are published until the outbox is empty."""
+        self.assertEqual(relay_all(batch_size=2), 5)
+        self.assertEqual(mock_apply_async.call_count, 5)
+        self.assertFalse(SpearJobOutboxEntry.objects.exists())
+        self.assertEqual(relay_all(batch_size=2), 0)
+
+    @override_settings(SPEAR_OUTBOX_RETRY_DELAY=5, SPEAR_OUTBOX_RETRY_MAX_DELAY=60)
+    def test_relay_outbox_publish_error(self, mock_apply_async, _mock_producer):
+        """Test a failing entry is retried with a growing delay and does not
+        hold back the entries after it."""
+
+        def publish(*args, **kwargs):
+            if kwargs["task_id"] == str(self.jobs[0].celery_job_id):
+                raise ConnectionError("broker down")
+
+        mock_apply_async.side_effect = publish
+
+        self.assertEqual(relay_all(batch_size=10), 4)
+
+        failed = SpearJobOutboxEntry.objects.get()
+        self.assertEqual(failed.job_id, self.jobs[0].id)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn("broker down", failed.last_error)
+        delay = failed.next_attempt_at - timezone.now()
+        self.assertTrue(timedelta(seconds=4) < delay <= timedelta(seconds=5))
+
+        # not due yet
+        self.assertEqual(relay_outbox(), 0)
+        self.assertEqual(mock_apply_async.call_count, 5)
+
+        for attempts in range(2, 6):
+            SpearJobOutboxEntry.objects.update(next_attempt_at=None)
+            relay_outbox()
+            failed.refresh_from_db()
+            self.assertEqual(failed.attempts, attempts)
+        delay = failed.next_attempt_at - timezone.now()
+        self.assertTrue(timedelta(seconds=59) < delay <= timedelta(seconds=60))
+
+    @override_settings(SPEAR_OUTBOX_MAX_ATTEMPTS=2)
+    def test_relay_outbox_max_attempts(self, mock_apply_async, _mock_producer):
+        """Test the job of an entry failing SPEAR_OUTBOX_MAX_ATTEMPTS times is
+        marked FAILED and the entry is removed."""
+        mock_apply_async.side_effect = ConnectionError("broker down")
+        SpearJobOutboxEntry.objects.exclude(job=self.jobs[0]).delete()
+
+        relay_outbox()
+        self.assertEqual(SpearJobOutboxEntry.objects.get().attempts, 1)
+        SpearJobOutboxEntry.objects.update(next_attempt_at=None)
+        relay_outbox()
+
+        self.assertFalse(SpearJobOutboxEntry.objects.exists())
+        job = SpearJob.objects.get(pk=self.jobs[0].pk)
+        self.assertEqual(job.status, "FAILED")
+        self.assertIsNotNone(job.completed_at)
+        self.assertIn("broker down", job.get_logs())
+
+    def test_claimed_entries_are_skipped(self, mock_apply_async, _mock_producer):
+        """Test the entries claimed by a relay are not published by another
+        one until the claim expired."""
+        now = timezone.now()
+        claimed = claim_entries(2, now)
+        self.assertEqual(len(claimed), 2)
+
+        self.assertEqual(relay_outbox(), 3)
+        self.assertCountEqual(
+            SpearJobOutboxEntry.objects.values_list("id", flat=True),
+            [entry.id for entry in claimed],
+        )
+        self.assertEqual(len(claim_entries(10, now + timedelta(seconds=60))), 0)
+        with override_settings(SPEAR_OUTBOX_CLAIM_SECONDS=300):
+            self.assertEqual(len(claim_entries(10, now + timedelta(seconds=301))), 2)
+
+
+@override_settings(SPEAR_JOB_DEDUP_WINDOW=3600)
+class TestDeduplication(TestCase):
+    def setUp(self):
+        create_raystation_system("Test Ray System")
+        self.payload = {
+            "patient_id": "test_pt1",
+            "priority": 5,
+            "raystation_system": "Test Ray System",
+            "workflow_name": "test_workflow_1",
+            "workflow_config": {"key1": "value1"},
+        }
+        self.job = enqueue_spear_job_payload(self.payload)
+
+    def test_duplicate_returns_existing_job(self):
+        """Test a duplicate, also within a batch, is not registered or queued again."""
+        other = self.payload | {"workflow_config": {"key1": "value2"}}
+
+        jobs = bulk_enqueue_spear_jobs([dict(self.payload), other, dict(other)])
+
+        self.assertEqual(jobs[0], self.job)
+        self.assertEqual(jobs[1], jobs[2])
+        self.assertNotEqual(jobs[1], self.job)
+        self.assertEqual(SpearJob.objects.count(), 2)
+        self.assertEqual(SpearJobOutboxEntry.objects.count(), 2)
+
+    def test_default_config_is_a_duplicate(self):
+        """Test a payload without a config and one with the default config
+        of the workflow are duplicates."""
+        payload = self.payload | {"workflow_name": "hn_workflow"}
+        del payload["workflow_config"]
+        default = payload | {
+            "workflow_config": workflow_registry.get_config("hn_workflow")
+        }
+
+        self.assertEqual(dedup_key(payload), dedup_key(default))
+        self.assertEqual(
+            enqueue_spear_job_payload(payload), enqueue_spear_job_payload(default)
         )
-        job = SpearJob.objects.get(celery_job_id=celery_id)
-        self.assertEqual(job.status, "QUEUED")
-        self.assertEqual(job.patient_id, "test_pt1")
-        self.assertEqual(job.priority, 2)
-        self.assertEqual(job.workflow_name, "test_workflow_1")
-        self.assertEqual(job.workflow_config, {"key1": "value1", "key2": 2})
-        self.assertEqual(job.raystation_system.system_name, "Test Ray System")
+
+    def test_idempotency_key(self):
+        """Test payloads with the same idempotency key are duplicates."""
+        first = enqueue_spear_job_payload(self.payload | {"idempotency_key": "req-1"})
+        retry = enqueue_spear_job_payload(
+            self.payload | {"idempotency_key": "req-1", "priority": 9}
+        )
+
+        self.assertEqual(retry, first)
+        self.assertNotEqual(first, self.job)
+        self.assertNotIn(
+            "idempotency_key", SpearJobOutboxEntry.objects.get(job=first).payload
+        )
+
+    def test_dedup_window(self):
+        """Test completed jobs are duplicates within the window, failed ones never."""
+        SpearJob.objects.filter(pk=self.job.pk).update(status="COMPLETED")
+        self.assertEqual(enqueue_spear_job_payload(self.payload), self.job)
+
+        SpearJob.objects.filter(pk=self.job.pk).update(
+            created_at=timezone.now() - timedelta(hours=2)
+        )
+        outside_window = enqueue_spear_job_payload(self.payload)
+        self.assertNotEqual(outside_window, self.job)
+
+        SpearJob.objects.filter(pk=outside_window.pk).update(status="FAILED")
+        self.assertNotIn(
+            enqueue_spear_job_payload(self.payload), [self.job, outside_window]
+        )
+
+    def test_concurrent_duplicate(self):
+        """Test a duplicate missed by the lookup fails on the unique index and
+        returns the existing job."""
+        with mock.patch(
+            "spear_queue.tasks.find_duplicates",
+            side_effect=[{}, {self.job.dedup_key: self.job}],
+        ):
+            job = enqueue_spear_job_payload(self.payload)
+
+        self.assertEqual(job, self.job)
+        self.assertEqual(SpearJob.objects.count(), 1)
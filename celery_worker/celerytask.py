@@ -1,18 +1,31 @@
+import os
 from celery import Celery
 from kombu import Queue, Exchange
 
 app = Celery("app")
 app.config_from_object("celeryconfig")
 app.conf.imports = ("spear_queue.tasks",)
-app.conf.task_queues = [
-    Queue(
-        "spear_tasks",
-        Exchange("spear_tasks"),
-        routing_key="spear_tasks",
+
+
+def spear_queue(name):
+    return Queue(
+        name,
+        Exchange(name),
+        routing_key=name,
         queue_arguments={"x-max-priority": 10},
-    ),
+    )
+
+
+# consume the shared queue and, with SPEAR_SERVER (e.g. HPTC-RAY-SP01), the
+# queue of the server the worker runs on
+app.conf.task_queues = [
+    spear_queue("spear_tasks"),
     # Queue("dead_letter_queue", routing_key="dead_letter_queue"),
 ]
+if os.environ.get("SPEAR_SERVER"):
+    app.conf.task_queues.append(
+        spear_queue(f"spear_tasks.{os.environ['SPEAR_SERVER']}")
+    )
 app.conf.task_acks_late = True
 app.conf.task_default_priority = 5
 app.conf.worker_prefetch_multiplier = 1
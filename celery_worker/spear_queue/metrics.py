@@ -0,0 +1,48 @@
+"""Optional Prometheus exporter of the worker hot paths.
+
+Set WORKER_METRICS_PORT to serve the metrics over HTTP. The tasks run in the
+pool processes, every pool process serves its own metrics on
+WORKER_METRICS_PORT + its pool index (0 for the first one).
+"""
+
+import logging
+import os
+from billiard.process import current_process
+from prometheus_client import Counter, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+TASK_DURATION = Histogram(
+    "spear_worker_task_duration_seconds",
+    "Duration of the tasks, from prerun to postrun",
+    ["task", "state"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200),
+)
+SIGNAL_HANDLER_DURATION = Histogram(
+    "spear_worker_signal_handler_duration_seconds",
+    "Duration of the task signal handlers",
+    ["signal"],
+    buckets=BUCKETS,
+)
+STATUS_FLUSH_DURATION = Histogram(
+    "spear_worker_status_flush_duration_seconds",
+    "Duration of sending one batch of status updates to the API",
+    buckets=BUCKETS,
+)
+STATUS_UPDATES = Counter(
+    "spear_worker_status_updates_total",
+    "Status updates sent to the API per result (sent, retry, dropped, rejected)",
+    ["result"],
+)
+
+
+def start_exporter() -> None:
+    """Serve the metrics of this pool process if WORKER_METRICS_PORT is set."""
+    port = os.environ.get("WORKER_METRICS_PORT")
+    if not port:
+        return
+    port = int(port) + getattr(current_process(), "index", 0)
+    start_http_server(port)
+    logger.info(f"Serving worker metrics on port {port}")
@@ -0,0 +1,42 @@
+"""The revoked-id set of the spear job API (spear_job_api.revocation).
+
+Revoking a job adds its celery task id to Redis, as one key per id that
+expires. The task_prerun handler checks it with one EXISTS, so a task that
+was revoked while it waited in the queue is dropped before it runs, also if
+this worker missed the Celery revoke broadcast.
+"""
+
+import logging
+import os
+import redis
+
+logger = logging.getLogger(__name__)
+
+# shared with spear_job_api.revocation
+REVOKED_PREFIX = "spear_jobs.revoked."
+
+_client: redis.Redis | None = None
+
+
+def _redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            os.environ.get(
+                "SPEAR_JOB_REVOKED_URL",
+                os.environ.get("CELERY_BACKEND", "redis://redis:6379/0"),
+            ),
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _client
+
+
+def is_revoked(task_id: str) -> bool:
+    """Whether the job of the task was revoked. An unreachable Redis counts
+    as not revoked, the task then runs."""
+    try:
+        return bool(_redis().exists(f"{REVOKED_PREFIX}{task_id}"))
+    except redis.RedisError as exc:
+        logger.warning(f"Could not check if task {task_id} was revoked: {exc}")
+        return False
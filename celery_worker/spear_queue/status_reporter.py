@@ -0,0 +1,328 @@
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any
+import requests
+from requests.adapters import HTTPAdapter
+from pytz import timezone
+from .metrics import STATUS_FLUSH_DURATION, STATUS_UPDATES
+from .transitions import RUNNING, can_transition
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = os.environ.get("TIMEZONE", "Europe/Amsterdam")
+
+
+def now_isoformat() -> str:
+    return datetime.now(tz=timezone(TIMEZONE)).isoformat()
+
+
+def merge_updates(older: dict[str, Any], newer: dict[str, Any]) -> dict[str, Any]:
+    """Merge two pending updates of the same job.
+
+    Fields of the newer update win, log entries of both are kept in order."""
+    merged = older | newer
+    logs = older.get("append_logs", []) + newer.get("append_logs", [])
+    if logs:
+        merged["append_logs"] = logs
+    return merged
+
+
+class StatusReporter:
+    """Report task status updates to the spear job API without blocking tasks.
+
+    Updates are buffered per celery task id and coalesced (the latest status
+    and timestamps win, log entries are concatenated). A background thread
+    flushes the buffer in batches over a pooled HTTP session, retries failed
+    updates with bounded exponential backoff and sends a heartbeat for every
+    running task through the batch heartbeat endpoint. Calling `report` never
+    waits on the network. While the API is unreachable the buffer holds the
+    updates of at most `max_pending` tasks, the updates of other tasks are
+    dropped.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        flush_interval: float = 1.0,
+        heartbeat_interval: float = 30.0,
+        max_batch_size: int = 100,
+        max_pending: int = 10000,
+        max_retries: int = 8,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        request_timeout: float = 10.0,
+        pool_size: int = 4,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.flush_interval = flush_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_timeout = request_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"accept": "application/json", "Content-Type": "application/json"}
+        )
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        # celery task id -> pending (coalesced) update
+        self._pending: dict[str, dict[str, Any]] = {}
+        # celery task id -> (failed attempts, monotonic time of the next attempt)
+        self._retries: dict[str, tuple[int, float]] = {}
+        # celery task id -> monotonic time of the last heartbeat
+        self._running: dict[str, float] = {}
+        # celery task id -> last status reported for a running task
+        self._statuses: dict[str, str] = {}
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+        atexit.register(self.stop)
+
+    @classmethod
+    def from_env(cls) -> "StatusReporter":
+        return cls(
+            f"http://{os.environ['QUEUE_API_HOST']}:{os.environ['QUEUE_API_PORT']}",
+            flush_interval=float(os.environ.get("STATUS_FLUSH_INTERVAL", 1.0)),
+            heartbeat_interval=float(os.environ.get("STATUS_HEARTBEAT_INTERVAL", 30.0)),
+            max_pending=int(os.environ.get("STATUS_MAX_PENDING", 10000)),
+        )
+
+    # Producer side, called from the task signal handlers
+    def report(
+        self, task_id: str, *, append_logs: list[str] | None = None, **fields: Any
+    ) -> None:
+        """Buffer an update of a job, it is sent with the next flush.
+
+        The status of a running task is checked against the job life cycle
+        (see spear_queue.transitions): a status it does not allow after the
+        last reported one is left out of the update, the API would reject
+        it."""
+        update = dict(fields)
+        if append_logs:
+            update["append_logs"] = list(append_logs)
+        with self._lock:
+            status, previous = update.get("status"), self._statuses.get(task_id)
+            if status and previous and not can_transition(previous, status):
+                STATUS_UPDATES.labels(result="rejected").inc()
+                logger.warning(
+                    f"Not reporting {status} for {task_id} after {previous}, "
+                    "the job life cycle does not allow it"
+                )
+                del update["status"]
+            elif status and task_id in self._running:
+                self._statuses[task_id] = status
+            if task_id not in self._pending and len(self._pending) >= self.max_pending:
+                STATUS_UPDATES.labels(result="dropped").inc()
+                logger.error(
+                    f"Dropping status update of {task_id}, {self.max_pending} "
+                    f"updates are waiting to be sent: {update}"
+                )
+                return
+            self._pending[task_id] = merge_updates(
+                self._pending.get(task_id, {}), update
+            )
+            if len(self._pending) >= self.max_batch_size:
+                self._wakeup.set()
+        self._ensure_started()
+
+    def task_started(self, task_id: str, **fields: Any) -> None:
+        """Report a task as RUNNING and keep sending heartbeats for it."""
+        with self._lock:
+            self._running[task_id] = time.monotonic()
+        self.report(task_id, status=RUNNING, **fields)
+
+    def task_finished(self, task_id: str, **fields: Any) -> None:
+        """Report the final state of a task and stop its heartbeats."""
+        self.report(task_id, **fields)
+        with self._lock:
+            self._running.pop(task_id, None)
+            self._statuses.pop(task_id, None)
+        # final states should not wait for the next flush interval
+        self._wakeup.set()
+
+    # Consumer side, runs in the background thread
+    def _ensure_started(self) -> None:
+        # threads do not survive the fork of the prefork pool, start one per process
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="spear-status-reporter", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._send_heartbeats()
+                while self._flush_once():
+                    pass
+            except Exception:  # the reporter thread must never die
+                logger.exception("Flushing status updates failed")
+
+    def _send_heartbeats(self) -> None:
+        """Send the heartbeats that are due with one batch heartbeat request.
+
+        Heartbeats are not buffered or retried, a lost one is superseded by the
+        next one anyway."""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for task_id, last in self._running.items():
+                if now - last >= self.heartbeat_interval:
+                    self._running[task_id] = now
+                    due.append(task_id)
+        for start in range(0, len(due), self.max_batch_size):
+            try:
+                response = self.session.post(
+                    f"{self.base_url}/api/spear-jobs/heartbeat/",
+                    json={
+                        "celery_job_ids": due[start : start + self.max_batch_size],
+                        "latest_heartbeat": now_isoformat(),
+                    },
+                    timeout=self.request_timeout,
+                )
+                response.raise_for_status()
+            except requests.RequestException as exc:
+                logger.warning(f"Sending heartbeats failed: {exc}")
+
+    def _take_batch(self) -> dict[str, dict[str, Any]]:
+        now = time.monotonic()
+        batch = {}
+        with self._lock:
+            for task_id in list(self._pending):
+                if len(batch) >= self.max_batch_size:
+                    break
+                _attempts, retry_at = self._retries.get(task_id, (0, 0.0))
+                if retry_at <= now:
+                    batch[task_id] = self._pending.pop(task_id)
+        return batch
+
+    def _flush_once(self) -> bool:
+        """Send one batch. Return True if a full batch was sent."""
+        batch = self._take_batch()
+        if not batch:
+            return False
+        with STATUS_FLUSH_DURATION.time():
+            results = self._send(batch)
+        for task_id, update in batch.items():
+            self._handle_result(task_id, update, results.get(task_id, False))
+        return len(batch) >= self.max_batch_size
+
+    def _send(self, batch: dict[str, dict[str, Any]]) -> dict[str, bool | None]:
+        """Send a batch with one bulk update request. Return per task id True
+        on success, False on a retryable failure and None if the API rejected
+        the update for good."""
+        items = [
+            {"celery_job_id": task_id} | update for task_id, update in batch.items()
+        ]
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/spear-jobs/bulk-update/",
+                json=items,
+                timeout=self.request_timeout,
+            )
+        except requests.RequestException as exc:
+            logger.warning(f"Sending {len(items)} status updates failed: {exc}")
+            return {}
+        if not response.ok:
+            # 429/5xx: try again later, anything else is a bug on our side
+            if response.status_code == 429 or response.status_code >= 500:
+                logger.info(
+                    f"Sending status updates failed with {response.status_code}, retrying"
+                )
+                return {}
+            logger.error(
+                f"Status updates rejected: {response.status_code=} {response.text=}"
+            )
+            return {task_id: None for task_id in batch}
+
+        results = {}
+        for item in response.json():
+            if item["result"] == "updated":
+                results[item["celery_job_id"]] = True
+            elif item["result"] == "not_found":
+                # the job may not be registered yet
+                results[item["celery_job_id"]] = False
+            elif item["result"] == "rejected":
+                # an out-of-order status, e.g. the job was revoked meanwhile
+                logger.info(f"Status update rejected by the job life cycle: {item}")
+                results[item["celery_job_id"]] = None
+            else:
+                logger.error(f"Status update rejected: {item}")
+                results[item["celery_job_id"]] = None
+        return results
+
+    def _handle_result(
+        self, task_id: str, update: dict[str, Any], result: bool | None
+    ) -> None:
+        with self._lock:
+            if result is not False:
+                self._retries.pop(task_id, None)
+                STATUS_UPDATES.labels(result="sent" if result else "dropped").inc()
+                return
+            attempts = self._retries.get(task_id, (0, 0.0))[0] + 1
+            if attempts > self.max_retries:
+                self._retries.pop(task_id, None)
+                STATUS_UPDATES.labels(result="dropped").inc()
+                logger.error(
+                    f"Dropping status update of {task_id} after {self.max_retries} retries: {update}"
+                )
+                return
+            STATUS_UPDATES.labels(result="retry").inc()
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+            delay *= random.uniform(0.5, 1.0)
+            self._retries[task_id] = (attempts, time.monotonic() + delay)
+            # updates reported meanwhile are newer than the failed one
+            self._pending[task_id] = merge_updates(
+                update, self._pending.get(task_id, {})
+            )
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """Try to send everything buffered, waiting for retries up to `timeout`."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending:
+                    return
+            if not self._flush_once():
+                time.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the background thread after flushing the buffer."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush(timeout)
+
+
+_reporter: StatusReporter | None = None
+
+
+def get_reporter() -> StatusReporter:
+    """Return the status reporter of this worker (process)."""
+    global _reporter
+    if _reporter is None:
+        _reporter = StatusReporter.from_env()
+    return _reporter
@@ -1,12 +1,14 @@
 import os
 import time
-from datetime import datetime
 import celery.signals as celery_signals
 from celery import shared_task, Task
+from celery.exceptions import Ignore
 from typing import Any
 import logging
-import requests
-from pytz import timezone
+from .metrics import SIGNAL_HANDLER_DURATION, TASK_DURATION, start_exporter
+from .revocation import is_revoked
+from .status_reporter import get_reporter, now_isoformat
+from .transitions import COMPLETED, FAILED
 
 # set basic config for a logger
 logger = logging.getLogger(__name__)
@@ -16,11 +18,23 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# celery task id -> monotonic start time, for the task duration metric
+_task_started_at: dict[str, float] = {}
+# celery task ids of the revoked jobs found by the prerun handler
+_revoked_tasks: set[str] = set()
 
-TIMEZONE = os.environ.get("TIMEZONE", "Europe/Amsterdam")
 
+class RevocableTask(Task):
+    """A task that is dropped, without running, if the prerun handler found
+    its job revoked (see spear_queue.revocation)."""
 
-@shared_task(queue="spear_tasks")
+    def __call__(self, *args, **kwargs):
+        if self.request.id in _revoked_tasks:
+            raise Ignore()
+        return super().__call__(*args, **kwargs)
+
+
+@shared_task(queue="spear_tasks", base=RevocableTask)
 def spear_job(priority: int, params: dict[str, Any]) -> str:
     time.sleep(5)
     logger.info(f"Running a spear job with priority {priority}")
@@ -34,41 +48,26 @@ def spear_job(priority: int, params: dict[str, Any]) -> str:
 # ):
 #     logger.info(f"Task before task pubish: {headers=} {body=}")
 @celery_signals.task_prerun.connect(sender=spear_job)
+@SIGNAL_HANDLER_DURATION.labels(signal="task_prerun").time()
 def handle_task_prerun(
     task_id: str, task: Any, args: list[Any], kwargs: dict[str, Any], **_kwargs
 ):
+    if is_revoked(task_id):
+        logger.info(f"Dropping the task of a revoked job: {task_id=}")
+        _revoked_tasks.add(task_id)
+        return
+    _task_started_at[task_id] = time.monotonic()
     worker = os.environ.get("WORKER_NAME")
     logger.info(f"Task before task run: {task_id=}, {worker=}")
-    now = datetime.now(tz=timezone(TIMEZONE)).isoformat()
-    payload = {
-        "status": "RUNNING",
-        "started_at": now,
-        "worker_name": worker,
-    }
-    logger.info(f"Payload prerun: {payload=}")
-    request_headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json",
-    }
-    response = requests.patch(
-        f"http://{os.environ["QUEUE_API_HOST"]}:{os.environ["QUEUE_API_PORT"]}/api/spear_job/spear-jobs/{task_id}/",
-        json=payload,
-        headers=request_headers,
+    now = now_isoformat()
+    # buffered and sent by the reporter thread, the task starts right away
+    get_reporter().task_started(
+        task_id, started_at=now, latest_heartbeat=now, worker_name=worker
     )
-    while response.status_code != 200:
-        logger.info(
-            "Update the Django backend failed, probably because the data is not registered yet, try again after 1 second"
-        )
-        time.sleep(1)
-        response = requests.patch(
-            f"http://{os.environ['QUEUE_API_HOST']}:{os.environ['QUEUE_API_PORT']}/api/spear_job/spear-jobs/{task_id}/",
-            json=payload,
-            headers=request_headers,
-        )
-    logger.info(f"Response prerun: {response.status_code=} {response.text=}")
 
 
 @celery_signals.task_postrun.connect(sender=spear_job)
+@SIGNAL_HANDLER_DURATION.labels(signal="task_postrun").time()
 def handle_task_postrun(
     task_id: str,
     task: Any,
@@ -78,32 +77,44 @@ def handle_task_postrun(
     state: str,
     **_kwargs,
 ):
+    if task_id in _revoked_tasks:
+        # dropped by RevocableTask, the job is REVOKED already
+        _revoked_tasks.discard(task_id)
+        return
     worker = os.environ.get("WORKER_NAME")
-    now = datetime.now(tz=timezone(TIMEZONE)).isoformat()
     logger.info(f"Task after task run: {task_id=}, {state=}, {retval=}, {worker=}")
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        TASK_DURATION.labels(task=task.name, state=state).observe(
+            time.monotonic() - started_at
+        )
     if state == "SUCCESS":
-        payload = {
-            "status": state,
-            "completed_at": now,
-            "result": retval,
-        }
-    elif state == "FAILURE":
-        payload = {
-            "status": state,
-            "completed_at": now,
-            "error": str(retval),
-        }
-
-    request_headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json",
-    }
-    response = requests.patch(
-        f"http://{os.environ["QUEUE_API_HOST"]}:{os.environ["QUEUE_API_PORT"]}/api/spear_job/spear-jobs/{task_id}/",
-        json=payload,
-        headers=request_headers,
-    )
-    logger.info(f"Response postrun: {response.status_code=} {response.text=}")
+        get_reporter().task_finished(
+            task_id,
+            status=COMPLETED,
+            completed_at=now_isoformat(),
+            append_logs=[f"Task finished: {retval}"],
+        )
+    elif state == "RETRY":
+        # the job stays RUNNING, the retry reports it again from its prerun
+        get_reporter().task_finished(task_id, append_logs=[f"Task retried: {retval}"])
+    else:
+        get_reporter().task_finished(
+            task_id,
+            status=FAILED,
+            completed_at=now_isoformat(),
+            append_logs=[f"Task failed ({state}): {retval}"],
+        )
+
+
+@celery_signals.worker_process_init.connect
+def handle_worker_process_init(**_kwargs):
+    start_exporter()
+
+
+@celery_signals.worker_process_shutdown.connect
+def handle_worker_process_shutdown(**_kwargs):
+    get_reporter().stop()
 
 
 @celery_signals.celeryd_after_setup.connect
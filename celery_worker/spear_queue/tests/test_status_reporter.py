@@ -0,0 +1,183 @@
+import unittest
+from unittest import mock
+import requests
+from spear_queue.status_reporter import StatusReporter, merge_updates
+
+
+def response(status_code=200, json=None):
+    res = mock.Mock(status_code=status_code, ok=status_code < 400)
+    res.json.return_value = json
+    return res
+
+
+def updated(*task_ids):
+    return response(
+        json=[{"celery_job_id": task_id, "result": "updated"} for task_id in task_ids]
+    )
+
+
+@mock.patch("spear_queue.status_reporter.requests.Session")
+class StatusReporterTests(unittest.TestCase):
+    def reporter(self, **kwargs):
+        reporter = StatusReporter("http://api/", **kwargs)
+        # the background thread is started by the tests that need it
+        reporter._ensure_started = mock.Mock()
+        return reporter
+
+    def sent_items(self, session):
+        return [
+            call.kwargs["json"] for call in session.return_value.post.call_args_list
+        ]
+
+    def test_merge_updates(self, session):
+        self.assertEqual(
+            merge_updates(
+                {"status": "RUNNING", "append_logs": ["a"]},
+                {"status": "COMPLETED", "append_logs": ["b"]},
+            ),
+            {"status": "COMPLETED", "append_logs": ["a", "b"]},
+        )
+
+    def test_updates_of_a_job_are_coalesced(self, session):
+        """Test the updates of a job are sent as one item, the latest status
+        winning and the log entries kept in order"""
+        reporter = self.reporter()
+        session.return_value.post.return_value = updated("t1")
+
+        reporter.task_started("t1", worker_name="w1")
+        reporter.report("t1", append_logs=["first"])
+        reporter.task_finished("t1", status="COMPLETED", append_logs=["second"])
+        reporter.flush()
+
+        self.assertEqual(
+            self.sent_items(session),
+            [
+                [
+                    {
+                        "celery_job_id": "t1",
+                        "status": "COMPLETED",
+                        "worker_name": "w1",
+                        "append_logs": ["first", "second"],
+                    }
+                ]
+            ],
+        )
+
+    @mock.patch("spear_queue.status_reporter.random.uniform", return_value=1.0)
+    @mock.patch("spear_queue.status_reporter.time.monotonic")
+    def test_backoff_after_server_error(self, monotonic, _uniform, session):
+        """Test an update failing with a 5xx is retried after its backoff"""
+        reporter = self.reporter(backoff_base=2.0)
+        session.return_value.post.side_effect = [response(503), updated("t1")]
+        monotonic.return_value = 100.0
+
+        reporter.report("t1", status="RUNNING")
+        reporter._flush_once()
+        self.assertEqual(reporter._retries["t1"], (1, 102.0))
+        # not due yet
+        self.assertFalse(reporter._flush_once())
+        self.assertEqual(session.return_value.post.call_count, 1)
+
+        monotonic.return_value = 102.0
+        reporter._flush_once()
+        self.assertEqual(session.return_value.post.call_count, 2)
+        self.assertEqual(reporter._pending, {})
+        self.assertNotIn("t1", reporter._retries)
+
+    def test_resend_after_not_found(self, session):
+        """Test an update of a job the API does not know yet is kept and
+        merged with the newer updates"""
+        reporter = self.reporter(backoff_base=0.0)
+        session.return_value.post.side_effect = [
+            response(json=[{"celery_job_id": "t1", "result": "not_found"}]),
+            updated("t1"),
+        ]
+
+        reporter.report("t1", status="RUNNING", append_logs=["first"])
+        reporter._flush_once()
+        reporter.report("t1", append_logs=["second"])
+        reporter._flush_once()
+
+        self.assertEqual(
+            self.sent_items(session)[1],
+            [
+                {
+                    "celery_job_id": "t1",
+                    "status": "RUNNING",
+                    "append_logs": ["first", "second"],
+                }
+            ],
+        )
+
+    def test_status_follows_the_life_cycle(self, session):
+        """Test a status the job life cycle does not allow after the last
+        reported one is left out, the log entries are kept"""
+        reporter = self.reporter()
+
+        reporter.task_started("t1")
+        reporter.report("t1", status="FAILED")
+        reporter.task_finished("t1", status="COMPLETED", append_logs=["done"])
+
+        self.assertEqual(
+            reporter._pending, {"t1": {"status": "FAILED", "append_logs": ["done"]}}
+        )
+        self.assertEqual(reporter._statuses, {})
+
+    def test_rejected_updates_are_not_retried(self, session):
+        reporter = self.reporter()
+        session.return_value.post.return_value = response(
+            json=[{"celery_job_id": "t1", "result": "rejected"}]
+        )
+        reporter.report("t1", status="RUNNING")
+        reporter._flush_once()
+        self.assertEqual((reporter._pending, reporter._retries), ({}, {}))
+
+    def test_drop_when_the_buffer_is_full(self, session):
+        """Test the updates of new tasks are dropped once max_pending tasks
+        wait, those of the buffered tasks are still merged"""
+        reporter = self.reporter(max_pending=2)
+
+        for task_id in ("t1", "t2", "t3"):
+            reporter.report(task_id, status="RUNNING")
+        reporter.report("t1", status="COMPLETED")
+
+        self.assertEqual(
+            reporter._pending,
+            {"t1": {"status": "COMPLETED"}, "t2": {"status": "RUNNING"}},
+        )
+
+    def test_network_errors_are_retried(self, session):
+        reporter = self.reporter()
+        session.return_value.post.side_effect = requests.ConnectionError("down")
+        reporter.report("t1", status="RUNNING")
+        reporter._flush_once()
+        self.assertEqual(reporter._retries["t1"][0], 1)
+        self.assertEqual(reporter._pending, {"t1": {"status": "RUNNING"}})
+
+    def test_stop_flushes(self, session):
+        """Test stop() sends what is buffered and ends the thread"""
+        reporter = StatusReporter("http://api/", flush_interval=60)
+        session.return_value.post.return_value = updated("t1")
+
+        reporter.report("t1", status="FAILED")
+        reporter.stop()
+
+        self.assertFalse(reporter._thread.is_alive())
+        self.assertEqual(
+            self.sent_items(session), [[{"celery_job_id": "t1", "status": "FAILED"}]]
+        )
+
+    @mock.patch("spear_queue.status_reporter.atexit.register")
+    def test_stop_is_registered_once(self, register, session):
+        reporter = StatusReporter("http://api/", flush_interval=60)
+        session.return_value.post.return_value = updated("t1")
+        reporter.report("t1", status="RUNNING")
+        reporter._thread.join(0)
+        reporter._pid = None
+        reporter.report("t1", status="RUNNING")
+        reporter.stop()
+        register.assert_called_once_with(reporter.stop)
+
+
+if __name__ == "__main__":
+    unittest.main()
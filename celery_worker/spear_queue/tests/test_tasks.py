@@ -0,0 +1,41 @@
+import unittest
+from unittest import mock
+from spear_queue import tasks
+
+
+@mock.patch("spear_queue.tasks.get_reporter")
+class PostrunTests(unittest.TestCase):
+    def postrun(self, state, retval="result"):
+        tasks.handle_task_postrun(
+            task_id="t1",
+            task=tasks.spear_job,
+            args=[],
+            kwargs={},
+            retval=retval,
+            state=state,
+        )
+
+    def finished(self, get_reporter):
+        call = get_reporter.return_value.task_finished.call_args
+        return call.kwargs.get("status")
+
+    def test_job_statuses_are_reported(self, get_reporter):
+        """Test the Celery states are reported as job statuses"""
+        for state, status in [
+            ("SUCCESS", "COMPLETED"),
+            ("FAILURE", "FAILED"),
+            ("REJECTED", "FAILED"),
+            ("RETRY", None),
+        ]:
+            self.postrun(state)
+            self.assertEqual(self.finished(get_reporter), status, state)
+
+    def test_revoked_task_is_not_reported(self, get_reporter):
+        tasks._revoked_tasks.add("t1")
+        self.postrun("SUCCESS")
+        get_reporter.return_value.task_finished.assert_not_called()
+        self.assertNotIn("t1", tasks._revoked_tasks)
+
+
+if __name__ == "__main__":
+    unittest.main()
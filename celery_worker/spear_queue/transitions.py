@@ -0,0 +1,30 @@
+"""The job life cycle of the spear job API (spear_job_api.transitions).
+
+A copy of TRANSITIONS, the status changes the API accepts from the workers,
+kept equal to the API table by its tests. The status reporter checks the
+statuses it reports against it, see StatusReporter.report.
+"""
+
+PENDING = "PENDING"
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+REVOKED = "REVOKED"
+
+# shared with spear_job_api.transitions
+_STARTED = (RUNNING, COMPLETED, FAILED, REVOKED)
+
+TRANSITIONS: dict[str, tuple[str, ...]] = {
+    PENDING: (QUEUED, *_STARTED),
+    QUEUED: _STARTED,
+    RUNNING: (COMPLETED, FAILED, REVOKED),
+    COMPLETED: (),
+    FAILED: (),
+    REVOKED: (),
+}
+
+
+def can_transition(current: str, status: str) -> bool:
+    """Whether a job may change from `current` to `status`."""
+    return current == status or status in TRANSITIONS.get(current, ())